@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+import numpy as np
+from p2 import parallel
+from p2.forest import CompactForest
+from benchmarks.bench_parallel_inference import build_model
+from benchmarks.synthetic import make_q6_dataset
+
+"""
+Benchmark - Vectorized forest scoring latency by batch size
+
+Per call `predict_proba` latency of the `RandomForestClassifier` and of
+its `CompactForest`, on preprocessed rows. Results are checked to match,
+the forest sums its trees in thread order with `n_jobs` > 1. Forest
+`n_jobs` is set as `build_model` sets it.
+
+Command:
+cd <project_folder>/p2
+python -m benchmarks.bench_forest_latency --batch-sizes 1 100 10000
+"""
+
+
+def latency_ms(predict_proba, X, repeat):
+    """
+    p50 and p99 milliseconds of `repeat` calls, after one warm up call.
+    """
+    predict_proba(X)
+    timings = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        predict_proba(X)
+        timings.append((time.perf_counter() - time_start) * 1000)
+    return np.percentile(timings, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 100, 10000])
+    parser.add_argument('--train-rows', type=int, default=20000)
+    parser.add_argument('--n-jobs', type=int, default=None,
+                        help='Forest n_jobs. Default as build_model')
+    parser.add_argument('--repeat', type=int, default=200)
+    options = parser.parse_args()
+
+    model = build_model(options.train_rows)
+    forest = model.steps[-1][1]
+    forest.set_params(n_jobs=parallel.n_jobs(options.n_jobs))
+    compact = CompactForest.from_forest(forest)
+    X = model[:-1].transform(
+        make_q6_dataset(max(options.batch_sizes)).iloc[:, :-1].values)
+    print(f'trees={len(forest.estimators_)} nodes={compact.n_nodes_} '
+          f'max_depth={compact.depths_.max()} n_jobs={forest.n_jobs}')
+    print(f'{"rows":>7} {"forest p50":>11} {"p99":>8} '
+          f'{"compact p50":>12} {"p99":>8} {"speedup":>8}')
+
+    for batch_size in options.batch_sizes:
+        X_batch = X[:batch_size]
+        np.testing.assert_allclose(compact.predict_proba(X_batch),
+                                   forest.predict_proba(X_batch))
+        # Fewer calls for large batches
+        repeat = max(3, min(options.repeat,
+                            options.repeat * 100 // batch_size))
+        forest_ms = latency_ms(forest.predict_proba, X_batch, repeat)
+        compact_ms = latency_ms(compact.predict_proba, X_batch, repeat)
+        print(f'{batch_size:>7} {forest_ms[0]:>11.3f} {forest_ms[1]:>8.3f} '
+              f'{compact_ms[0]:>12.3f} {compact_ms[1]:>8.3f} '
+              f'{forest_ms[0] / compact_ms[0]:>8.2f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
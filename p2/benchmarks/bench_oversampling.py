@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import train_test_split
+from p2 import const as C
+from p2 import instrument, oversample
+from p2.impute import MedianImputer
+from benchmarks.synthetic import make_q6_dataset
+
+"""
+Benchmark - Oversampling methods against full SMOTE
+
+Seconds and peak RSS growth of resampling and of fitting the forest, and
+macro F1 on held out rows, by oversampling method. Saved time and memory
+are relative to the `smote` method.
+
+Command:
+cd <project_folder>/p2
+python -m benchmarks.bench_oversampling --rows 50000
+"""
+
+
+def run_method(method, X_train, y_train, X_test, y_test):
+    with instrument.span('bench.resample', rows=len(y_train)) as resample:
+        X, y = oversample.resample(X_train, y_train, method)
+    classifier = RandomForestClassifier(
+        n_estimators=C.MD_n_estimators,
+        min_samples_split=C.MD_min_samples_split,
+        min_samples_leaf=C.MD_min_samples_leaf,
+        max_depth=C.MD_max_depth,
+        criterion='entropy',
+        n_jobs=-1,
+        random_state=C.MD_RANDOM_STATE)
+    with instrument.span('bench.fit', rows=len(y)) as fit:
+        oversample.fit_balanced(classifier, X, y, method)
+    y_pred = classifier.predict(X_test)
+    return {
+        'method': method,
+        'rows': len(y),
+        'resample_seconds': resample.record['seconds'],
+        'resample_peak_mb': resample.record['peak_rss_delta_mb'],
+        'fit_seconds': fit.record['seconds'],
+        'fit_peak_mb': fit.record['peak_rss_delta_mb'],
+        'accuracy': accuracy_score(y_test, y_pred),
+        'macro_f1': f1_score(y_test, y_pred, average='macro')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--methods', nargs='+', default=list(
+        oversample.METHODS), choices=oversample.METHODS)
+    options = parser.parse_args()
+    C.METRICS_PATH = None
+
+    df = make_q6_dataset(options.rows)
+    X = MedianImputer().fit_transform(df.iloc[:, :-1].values)
+    y = df.iloc[:, -1].values
+    del df
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=C.MD_TEST_SIZE, random_state=C.MD_RANDOM_STATE)
+    print(f'rows={options.rows} cols={X.shape[1]} cpu={os.cpu_count()}')
+    print(f'{"method":>12} {"rows":>8} {"resample_s":>10} {"resample_mb":>11} '
+          f'{"fit_s":>8} {"fit_mb":>8} {"macro_f1":>8} {"saved_s":>8} '
+          f'{"saved_mb":>8}')
+
+    baseline = None
+    for method in options.methods:
+        result = run_method(method, X_train, y_train, X_test, y_test)
+        if method == 'smote':
+            baseline = result
+        saved_seconds = saved_mb = float('nan')
+        if baseline is not None:
+            saved_seconds = (
+                baseline['resample_seconds'] + baseline['fit_seconds'] -
+                result['resample_seconds'] - result['fit_seconds'])
+            saved_mb = (max(baseline['resample_peak_mb'],
+                            baseline['fit_peak_mb']) -
+                        max(result['resample_peak_mb'],
+                            result['fit_peak_mb']))
+        print(f'{method:>12} {result["rows"]:>8} '
+              f'{result["resample_seconds"]:>10.2f} '
+              f'{result["resample_peak_mb"]:>11.1f} '
+              f'{result["fit_seconds"]:>8.1f} {result["fit_peak_mb"]:>8.1f} '
+              f'{result["macro_f1"]:>8.4f} {saved_seconds:>8.1f} '
+              f'{saved_mb:>8.1f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
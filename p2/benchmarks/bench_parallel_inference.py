@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import time
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from p2 import const as C
+from p2.impute import MedianImputer
+from p2.scoring import ParallelScorer
+from benchmarks.synthetic import make_q6_dataset
+
+"""
+Benchmark - Parallel Batch Scoring speedup by worker count
+
+Command:
+cd <project_folder>/p2
+python -m benchmarks.bench_parallel_inference --rows 200000 --workers 1 2 4 8
+"""
+
+
+def build_model(train_rows):
+    df = make_q6_dataset(train_rows, random_state=1)
+    model = Pipeline([
+        ('imputer', MedianImputer()),
+        ('scaler', StandardScaler()),
+        ('classifier', RandomForestClassifier(
+            n_estimators=C.MD_n_estimators,
+            min_samples_split=C.MD_min_samples_split,
+            min_samples_leaf=C.MD_min_samples_leaf,
+            max_depth=C.MD_max_depth,
+            criterion='entropy',
+            random_state=C.MD_RANDOM_STATE))])
+    return model.fit(df.iloc[:, :-1].values, df.iloc[:, -1].values)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--train-rows', type=int, default=20000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count()}))
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    model = build_model(options.train_rows)
+    X = make_q6_dataset(options.rows).iloc[:, :-1].values
+    print(f'rows={options.rows} cols={X.shape[1]} cpu={os.cpu_count()}')
+    print(f'{"workers":>8} {"seconds":>9} {"rows/s":>11} {"speedup":>8}')
+
+    baseline = None
+    for n_workers in options.workers:
+        with ParallelScorer(model, n_workers) as scorer:
+            # Warm up the pool so worker start-up is not timed
+            scorer.predict(X[:n_workers])
+            timings = []
+            for _ in range(options.repeat):
+                time_start = time.perf_counter()
+                scorer.predict(X)
+                timings.append(time.perf_counter() - time_start)
+        best = min(timings)
+        baseline = baseline or best
+        print(f'{n_workers:>8} {best:>9.3f} {X.shape[0] / best:>11,.0f} '
+              f'{baseline / best:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+import joblib
+from p2 import const as C
+from p2 import parallel, tuning
+from p2.impute import MedianImputer
+from benchmarks.synthetic import make_q6_dataset
+
+"""
+Benchmark - Tuning core split by core budget
+
+Successive halving search seconds for every split of the core budget
+between tuning workers and forest `n_jobs`, and every joblib backend.
+The fastest split of each budget is the one to set as
+`MD_TUNNING_WORKERS` / `JOBLIB_BACKEND` for a host of that size. Budgets
+above the cores available oversubscribe and are not meaningful.
+
+Command:
+cd <project_folder>/p2
+python -m benchmarks.bench_parallelism --rows 50000 --cores 4 8 16
+"""
+
+
+def worker_counts(budget):
+    """
+    Worker counts that split `budget` evenly, 1 to `budget`.
+    """
+    return [workers for workers in range(1, budget + 1)
+            if budget % workers == 0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--cores', type=int, nargs='+',
+                        default=sorted({1, 2, 4, joblib.cpu_count()}))
+    parser.add_argument('--backends', nargs='+', default=['threading', 'loky'],
+                        choices=parallel.BACKENDS)
+    parser.add_argument('--n-candidates', type=int,
+                        default=C.MD_TUNNING_N_CANDIDATES)
+    options = parser.parse_args()
+
+    df = make_q6_dataset(options.rows)
+    X = MedianImputer().fit_transform(df.iloc[:, :-1].values)
+    y = df.iloc[:, -1].values
+    del df
+    print(f'rows={options.rows} candidates={options.n_candidates} '
+          f'available={joblib.cpu_count()}')
+    print(f'{"cores":>6} {"workers":>8} {"n_jobs":>7} {"backend":>10} '
+          f'{"seconds":>9} {"speedup":>8}')
+
+    for budget in options.cores:
+        C.CPU_BUDGET = budget
+        timings = []
+        for workers in worker_counts(budget):
+            for backend in options.backends:
+                if workers == 1 and timings:
+                    # One worker runs in process, whatever the backend
+                    continue
+                time_start = time.perf_counter()
+                _, search = tuning.successive_halving_search(
+                    X, y, n_candidates=options.n_candidates,
+                    time_budget=None, workers=workers, backend=backend)
+                seconds = time.perf_counter() - time_start
+                timings.append((seconds, workers, search['forest_n_jobs'],
+                                backend))
+                print(f'{budget:>6} {workers:>8} {search["forest_n_jobs"]:>7} '
+                      f'{backend:>10} {seconds:>9.2f} '
+                      f'{timings[0][0] / seconds:>8.2f}', flush=True)
+        seconds, workers, n_jobs, backend = min(timings)
+        print(f'Best for {budget} cores: MD_TUNNING_WORKERS = {workers} '
+              f'(n_jobs {n_jobs}), JOBLIB_BACKEND = {backend!r}, '
+              f'{seconds:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
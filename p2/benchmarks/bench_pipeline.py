@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from sqlalchemy import text
+from p2 import const as C
+from p2 import data_eng, db, instrument, model_build
+from p2 import inference as inf
+from benchmarks.synthetic import iter_q6_chunks
+
+"""
+Benchmark - Full Pipeline by dataset size
+
+Synthetic Q6 shaped data is loaded into a SQLite stand-in for the source
+DB, then fetch, check, process, build and inference run on it as the
+pipeline runs them. Seconds, rows/s and peak RSS of every stage are
+compared against a stored baseline, the exit code is 1 on regression.
+The first run without a baseline file stores itself as the baseline.
+
+Command:
+cd <project_folder>/p2
+python -m benchmarks.bench_pipeline --rows 10000 100000 1000000
+python -m benchmarks.bench_pipeline --rows 10000 --save-baseline
+"""
+
+STAGES = ('fetch', 'check', 'process', 'build', 'inference')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def load_source_table(row_count, chunk_rows, random_state=0):
+    """
+    Replace the source table of the current DB with synthetic rows.
+    """
+    engine = db.get_engine()
+    with engine.begin() as db_connection:
+        db_connection.execute(text(
+            f'drop table if exists {C.DB_SOURCE_TABLE}'))
+    for df in iter_q6_chunks(row_count, chunk_rows,
+                             random_state=random_state):
+        df.to_sql(C.DB_SOURCE_TABLE, engine, if_exists='append',
+                  index=False, chunksize=C.DB_WRITE_BATCH_SIZE)
+
+
+def run_size(row_count, work_dir, options):
+    """
+    Run every stage on `row_count` synthetic rows.
+
+    Returns:
+        results (list):
+            Dict per stage with seconds, rows/s, peak RSS and status
+    """
+    C.DB_URL = 'sqlite:///' + os.path.join(work_dir, f'q6_{row_count}.db')
+    db.dispose_engines()
+    load_source_table(row_count, options.chunk_rows)
+
+    extension = os.path.splitext(C.DATA_FILE_PATH)[1]
+    path = {name: os.path.join(work_dir, name + suffix) for name, suffix in
+            [('data', extension), ('X', '.npy'), ('y', '.npy'),
+             ('imputer', '.pkl'), ('columns', '.json'), ('model', '.sav')]}
+    stages = {
+        'fetch': lambda: data_eng.fetch_data_from_mssql(path['data']),
+        'check': lambda: data_eng.data_file_check(path['data'])[0],
+        'process': lambda: data_eng.process_data(
+            path['data'], path['X'], path['y'], path['imputer'],
+            path['columns'], low_memory=options.low_memory)[0],
+        'build': lambda: model_build.build_model(
+            path['X'], path['y'], path['model'],
+            enable_tunning=options.tunning,
+            imputer_file=path['imputer'], columns_file=path['columns'],
+            low_memory=options.low_memory)[0],
+        'inference': lambda: inf.batch_inference(
+            path['model'], chunk_size=options.chunk_size,
+            n_workers=options.workers)[0]
+    }
+
+    results = []
+    for stage in STAGES:
+        with instrument.span('bench.' + stage, rows=row_count) as span:
+            result = stages[stage]()
+        results.append({
+            'rows': row_count,
+            'stage': stage,
+            'status': bool(result['status']),
+            'seconds': round(span.record['seconds'], 3),
+            'rows_per_sec': span.record.get('rows_per_sec'),
+            'peak_rss_mb': span.record['peak_rss_mb']
+        })
+        print_result(results[-1])
+    db.dispose_engines()
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance, min_seconds):
+    """
+    Stages slower than the baseline by more than `tolerance` and
+    `min_seconds`, or above its peak RSS by more than `memory_tolerance`.
+
+    Returns:
+        regressions (list):
+            Message per regression
+    """
+    base = {(r['rows'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = base.get((result['rows'], result['stage']))
+        if previous is None:
+            continue
+        name = '{stage} @ {rows} rows'.format(**result)
+        if result['seconds'] > previous['seconds'] * (1 + tolerance) \
+                and result['seconds'] - previous['seconds'] > min_seconds:
+            regressions.append('{}: {}s vs {}s baseline'.format(
+                name, result['seconds'], previous['seconds']))
+        if result['peak_rss_mb'] > \
+                previous['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append('{}: {} MB vs {} MB baseline'.format(
+                name, result['peak_rss_mb'], previous['peak_rss_mb']))
+    return regressions
+
+
+def print_result(result):
+    print(f'{result["rows"]:>9} {result["stage"]:>10} '
+          f'{result["seconds"]:>9.3f} {result["rows_per_sec"] or 0:>11,} '
+          f'{result["peak_rss_mb"]:>9.1f} {result["status"]!s:>7}',
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--chunk-rows', type=int, default=100000,
+                        help='Synthetic rows generated and loaded at once')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Streaming inference chunk size')
+    parser.add_argument('--workers', type=int, default=C.INF_N_WORKERS)
+    parser.add_argument('--tunning', action='store_true')
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--output', default=None,
+                        help='Write results as JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--memory-tolerance', type=float, default=0.1)
+    parser.add_argument('--min-seconds', type=float, default=0.5)
+    options = parser.parse_args()
+    # Spans are reported here, not in the pipeline metrics sink
+    C.METRICS_PATH = None
+
+    print(f'cpu={os.cpu_count()} tunning={options.tunning} '
+          f'low_memory={options.low_memory} '
+          f'chunk_size={options.chunk_size} workers={options.workers}')
+    print(f'{"rows":>9} {"stage":>10} {"seconds":>9} {"rows/s":>11} '
+          f'{"peak_mb":>9} {"status":>7}')
+    results = []
+    with tempfile.TemporaryDirectory(dir=options.work_dir) as work_dir:
+        for row_count in options.rows:
+            results += run_size(row_count, work_dir, options)
+
+    run = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'options': vars(options),
+        'results': results
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if options.save_baseline or not os.path.exists(options.baseline):
+        with open(options.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f'Baseline stored: {options.baseline}')
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if baseline['cpu_count'] != run['cpu_count']:
+        print(f'Warning: baseline recorded on {baseline["cpu_count"]} CPUs')
+    regressions = compare(results, baseline, options.tolerance,
+                          options.memory_tolerance, options.min_seconds)
+    for regression in regressions:
+        print('Regression', regression)
+    print(f'{len(regressions)} regressions against {options.baseline} '
+          f'({baseline["created_at"]})')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from p2 import const as C
+
+"""
+Synthetic Q6 shaped dataset for benchmarks.
+151 float feature columns named '0' - '150' and an imbalanced `target`.
+"""
+
+# Label distribution of the Q6 sample data (10000 / 101 / 59 / 52 / 29)
+TARGET_RATIO = np.array([10000, 101, 59, 52, 29]) / 10241
+NAN_RATE = 0.01
+
+
+def make_q6_dataset(row_count, nan_rate=NAN_RATE, random_state=0):
+    """
+    Generate Q6 shaped DataFrame.
+
+    Parameters:
+        row_count (int):
+            Number of rows.
+
+        nan_rate (float):
+            Optional. Fraction of feature values set to NaN.
+
+        random_state (int):
+            Optional. Random seed.
+
+    Returns:
+        df (DataFrame):
+            `C.DATA_FILE_COL_COUNT` columns, features then `target`.
+    """
+    rng = np.random.default_rng(random_state)
+    feature_count = C.DATA_FILE_COL_COUNT - 1
+    y = rng.choice(len(TARGET_RATIO), size=row_count, p=TARGET_RATIO)
+    X = rng.standard_normal((row_count, feature_count))
+    # Make a few features informative so the forest grows real splits
+    X[:, :10] += y[:, None] * rng.uniform(0.5, 2.0, size=10)
+    X[rng.random(X.shape) < nan_rate] = np.nan
+    df = pd.DataFrame(X, columns=[str(i) for i in range(feature_count)])
+    df['target'] = y
+    return df
+
+
+def iter_q6_chunks(row_count, chunk_rows=100000, nan_rate=NAN_RATE,
+                   random_state=0):
+    """
+    Generate a Q6 shaped dataset in DataFrame chunks, so large datasets
+    are never held in memory at once. Chunk `i` is seeded with
+    `(random_state, i)`.
+
+    Returns:
+        chunks (generator):
+            DataFrame per chunk of at most `chunk_rows` rows
+    """
+    for i, start in enumerate(range(0, row_count, chunk_rows)):
+        yield make_q6_dataset(min(chunk_rows, row_count - start),
+                              nan_rate=nan_rate,
+                              random_state=(random_state, i))
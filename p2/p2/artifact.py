@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+import os
+import pickle
+import time
+import joblib
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from . import const as C
+from . import instrument
+from . import util as ut
+from .forest import CompactForest
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def save_model(model, model_save_path,
+               compact=C.MD_ARTIFACT_COMPACT,
+               compress=C.MD_ARTIFACT_COMPRESS,
+               threshold_dtype=C.MD_ARTIFACT_THRESHOLD_DTYPE,
+               prune_tolerance=C.MD_ARTIFACT_PRUNE_TOLERANCE,
+               **metadata):
+    """
+    Save Model Artifact.
+    Model is stored together with its version and build metadata.
+
+    Parameters:
+        model (Pipeline):
+            Fitted preprocessing and classifier pipeline.
+
+        model_save_path (str):
+            Artifact file path.
+
+        compact (bool):
+            Optional. Store the forest as a `CompactForest` in a joblib
+            file, its node arrays uncompressed so `load_model` memory-maps
+            them. Pickled as is if value is False.
+            (Default value refer to const.py)
+
+        compress (int):
+            Optional. joblib compression level of a compact artifact,
+            0 for none. A compressed artifact is smaller to ship but is
+            read in full on load. (Default value refer to const.py)
+
+        threshold_dtype, prune_tolerance:
+            Optional. Refer to `CompactForest`.
+            (Default value refer to const.py)
+
+        metadata:
+            Optional. Extra values to store with the model.
+
+    Returns:
+        artifact (dict):
+            Saved artifact
+    """
+    artifact = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_version': time.strftime('%Y%m%d%H%M%S'),
+        'sklearn_version': sklearn.__version__,
+        'model': model,
+        'compact': compact
+    }
+    if compact:
+        artifact['model'] = compact_model(model,
+                                          threshold_dtype=threshold_dtype,
+                                          prune_tolerance=prune_tolerance)
+        artifact['compress'] = compress
+    artifact.update(metadata)
+    log.debug(('Save Model Artifact', model_save_path,
+               artifact['model_version']))
+    # Write aside and rename, so a reader never loads a partial artifact
+    tmp_path = '{}.tmp{}'.format(model_save_path, os.getpid())
+    if compact:
+        joblib.dump(artifact, tmp_path, compress=compress)
+    else:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(artifact, f)
+    os.replace(tmp_path, model_save_path)
+    log.debug(('Model Artifact Size MB', artifact_size_mb(model_save_path)))
+    return artifact
+
+
+def load_model(model_save_path):
+    """
+    Load Model Artifact.
+    Arrays of an uncompressed compact artifact are memory-mapped read only.
+
+    Parameters:
+        model_save_path (str):
+            Artifact file path.
+
+    Returns:
+        artifact (dict):
+            Artifact with `model` and its metadata
+    """
+    ut.file_exists_check(model_save_path, error_msg='Model File not Found')
+    with instrument.span('artifact.load_model', bytes_read=os.path.getsize(
+            model_save_path)) as span:
+        # Pickle protocol 2+ header. A compressed joblib file cannot be
+        # memory-mapped. joblib also loads plain pickle artifacts.
+        with open(model_save_path, 'rb') as f:
+            compressed = f.read(1) != b'\x80'
+        artifact = joblib.load(model_save_path,
+                               mmap_mode=None if compressed else 'r')
+        span.add(compressed=compressed)
+    if not isinstance(artifact, dict) or 'model' not in artifact:
+        raise Exception('Unsupported Model Artifact, rebuild the model - {}'
+                        .format(model_save_path))
+    log.debug(('Load Model Artifact', model_save_path,
+               artifact['model_version'], span.record['seconds']))
+    return artifact
+
+
+def compact_model(model, **params):
+    """
+    Model with its `RandomForestClassifier` replaced by a `CompactForest`.
+    Either the forest, or a pipeline ending with it.
+    """
+    if isinstance(model, RandomForestClassifier):
+        return CompactForest.from_forest(model, **params)
+    if isinstance(model, Pipeline) and \
+            isinstance(model.steps[-1][1], RandomForestClassifier):
+        name, forest = model.steps[-1]
+        # Shallow copy, the preprocessing steps are shared
+        model = copy.copy(model)
+        model.steps = model.steps[:-1] + [
+            (name, CompactForest.from_forest(forest, **params))]
+        return model
+    raise ValueError('No Random Forest to compact in {}'.format(
+        type(model).__name__))
+
+
+def artifact_size_mb(model_save_path):
+    return round(os.path.getsize(model_save_path) / 1024 ** 2, 3)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+from . import const as C
+
+log = logging.getLogger(__name__)
+
+"""
+Stage Output Cache.
+
+Stage outputs are stored under a key hashed from the content of the
+stage input files, the stage parameters, the const.py values the stage
+declares it depends on and the p2 source code. A rerun with unchanged
+inputs restores the outputs instead of executing the stage, and a run
+that failed part way resumes after the last stage that completed. Least
+recently used entries are evicted once the cache grows past
+`C.CACHE_MAX_SIZE_MB`, stage outputs larger than that are not cached.
+
+Outputs are hardlinked into the cache and back rather than copied, so a
+cached output shares its file with the cache entry. Stages write their
+outputs as new files (`util.save_array`, `artifact.save_model`) instead of
+rewriting them in place, which would change the entry too. Outputs still
+linked to an entry are removed before their stage runs.
+"""
+
+_RESULT_FILE = 'result.pkl'
+_BLOCK_SIZE = 1024 * 1024
+
+# Content hashes by file path and stat, so a file read by several stages
+# of a run is hashed once
+_fingerprints = {}
+
+# File time stamps are coarse. A file modified this close to being hashed
+# may change again without a change of its stat, its hash is not reused.
+_RACY_NS = 2 * 10 ** 9
+
+
+def run_stage(stage, func, input_paths=(), output_paths=(), params=None,
+              constants=(), enabled=True, cache_dir=C.CACHE_DIR):
+    """
+    Run Pipeline Stage through the cache.
+
+    Parameters:
+        stage (str):
+            Stage name.
+
+        func (callable):
+            Runs the stage and returns its result dict.
+
+        input_paths (list):
+            Files the stage reads. Their content is part of the key.
+
+        output_paths (list):
+            Files the stage writes. Restored on a cache hit.
+
+        params (dict):
+            Optional. Stage parameters that are not in const.py.
+
+        constants (list):
+            Optional. Names of the const.py values the stage outputs
+            depend on. Their values are part of the key, other settings
+            never invalidate the stage.
+
+        enabled (bool):
+            Optional. Always run `func` if value is False.
+
+        cache_dir (str):
+            Optional. Cache location. (Default value refer to const.py)
+
+    Returns:
+        result (dict):
+            Stage result with `cache_key` and `cache_hit`
+    """
+    # Outputs still linked to a cache entry are removed, not rewritten in
+    # place by the stage. The entry holds their content.
+    for output_path in output_paths:
+        if os.path.exists(output_path) and os.stat(output_path).st_nlink > 1:
+            os.remove(output_path)
+    if not enabled:
+        return func()
+    key = stage_key(stage, [file_fingerprint(p) for p in input_paths],
+                    params, constants)
+    result = restore(key, output_paths, cache_dir)
+    if result is not None:
+        log.info(('Cache Hit', stage, key))
+        result.update(cache_key=key, cache_hit=True)
+        return result
+
+    log.info(('Cache Miss', stage, key))
+    result = func()
+    if result is not None and result.get('status') is True:
+        store(key, output_paths, result, cache_dir, C.CACHE_MAX_SIZE_MB)
+        result.update(cache_key=key, cache_hit=False)
+    return result
+
+
+def stage_key(stage, input_fingerprints=(), params=None, constants=()):
+    payload = {
+        'stage': stage,
+        'inputs': list(input_fingerprints),
+        'params': params,
+        'const': {name: getattr(C, name) for name in constants},
+        'code': code_version()
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def file_fingerprint(path):
+    """
+    Content hash of a file. Only rehashed once the file is replaced or
+    its size or modification time changes.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_ino, stat.st_size,
+                stat.st_mtime_ns, stat.st_ctime_ns)
+    fingerprint = _fingerprints.get(memo_key)
+    if fingerprint is None:
+        hashed_at = time.time_ns()
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(functools.partial(f.read, _BLOCK_SIZE), b''):
+                digest.update(block)
+        fingerprint = digest.hexdigest()
+        if stat.st_ctime_ns + _RACY_NS < hashed_at:
+            _fingerprints[memo_key] = fingerprint
+    return fingerprint
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Content hash of the p2 package source.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            digest.update(name.encode())
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def restore(key, output_paths, cache_dir=C.CACHE_DIR):
+    """
+    Link cached outputs back to `output_paths`.
+
+    Returns:
+        result (dict):
+            Cached stage result. None if there is no complete entry.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    result_path = os.path.join(entry_dir, _RESULT_FILE)
+    cached_paths = [os.path.join(entry_dir, os.path.basename(p))
+                    for p in output_paths]
+    if not all(os.path.exists(p) for p in [result_path] + cached_paths):
+        return None
+    for cached_path, output_path in zip(cached_paths, output_paths):
+        _link(cached_path, output_path)
+    # Mark as recently used for eviction
+    os.utime(result_path)
+    with open(result_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def store(key, output_paths, result, cache_dir=C.CACHE_DIR,
+          max_size_mb=C.CACHE_MAX_SIZE_MB):
+    """
+    Link stage outputs and store the result into the cache.
+    The entry is staged in a temporary directory and renamed into place,
+    so an interrupted run never leaves a partial entry behind.
+
+    Returns:
+        stored (bool):
+            False if the outputs alone are larger than `max_size_mb`.
+    """
+    size = sum(os.path.getsize(p) for p in output_paths)
+    if size > max_size_mb * 1024 * 1024:
+        log.info(('Cache Skip, Outputs Larger than Cache', key, size))
+        return False
+    entry_dir = os.path.join(cache_dir, key)
+    staging_dir = '{}.tmp{}'.format(entry_dir, os.getpid())
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    for output_path in output_paths:
+        _link(output_path, os.path.join(staging_dir,
+                                        os.path.basename(output_path)))
+    with open(os.path.join(staging_dir, _RESULT_FILE), 'wb') as f:
+        pickle.dump(result, f)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.rename(staging_dir, entry_dir)
+    evict(cache_dir, max_size_mb, keep=key)
+    return True
+
+
+def evict(cache_dir=C.CACHE_DIR, max_size_mb=C.CACHE_MAX_SIZE_MB,
+          keep=None):
+    """
+    Remove least recently used entries until the cache fits `max_size_mb`.
+    """
+    entries = []
+    for key in os.listdir(cache_dir):
+        result_path = os.path.join(cache_dir, key, _RESULT_FILE)
+        if not os.path.exists(result_path):
+            continue
+        entry_dir = os.path.join(cache_dir, key)
+        size = sum(os.path.getsize(os.path.join(entry_dir, name))
+                   for name in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(result_path), key, size))
+
+    total_size = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total_size <= max_size_mb * 1024 * 1024:
+            break
+        if key == keep:
+            continue
+        log.debug(('Cache Evict', key, size))
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total_size -= size
+    return total_size
+
+
+def clear(cache_dir=C.CACHE_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _link(src, dst):
+    """
+    Hardlink `src` as `dst`. Copied if they are on different file systems.
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
@@ -1,22 +1,170 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+
 # Data file verification threshold checking
 DATA_FILE_MIN_ROW_COUNT = 1000
 DATA_FILE_MIN_FILE_SIZE_MB = 10 * 1000 * 1000  # 10MB
 DATA_FILE_COL_COUNT = 152
-DATA_FILE_PATH = '/tmp/Q6_data.csv'
+DATA_CHECK_CHUNK_SIZE = 5000  # CSV rows per chunk of the streaming check
+# Allowed (min, max) of critical columns
+DATA_FILE_VALUE_RANGE = {'target': (0, 4)}
+# Columnar Parquet cache. A .csv path is still supported
+DATA_FILE_PATH = '/tmp/Q6_data.parquet'
+DATA_FILE_COMPRESSION = 'snappy'
+DATA_FILE_FLOAT_DTYPE = 'float64'  # float32 halves the cache size
+DATA_FETCH_CHUNK_SIZE = 50000
 
 # Data Processing Related
-DF_X_TMP_PATH = '/tmp/X.csv'
-DF_Y_TMP_PATH = '/tmp/y.csv'
+# Binary .npy, memory-mapped on load
+DF_X_TMP_PATH = '/tmp/X.npy'
+DF_Y_TMP_PATH = '/tmp/y.npy'
+DF_IMPUTER_TMP_PATH = '/tmp/imputer.sav'
+DF_COLUMNS_TMP_PATH = '/tmp/columns.json'
+# Imputer medians by column, reused while the data file is unchanged
+DF_IMPUTER_STATS_PATH = '/tmp/imputer_stats.json'
+# Process only the feature columns of the current model artifact.
+# Cuts processing I/O, but dropped features are never reconsidered.
+DF_REUSE_MODEL_FEATURES = False
+# Low memory training. float32 features end to end, in place shuffle,
+# imputation and scaling. Refer to process_data and build_model
+DF_LOW_MEMORY = False
+# Class imbalance. smote, approx_smote, weights (balanced sample weights,
+# no rows generated) or lazy (synthetic rows generated per batch of trees
+# at model building). Refer to oversample.py
+DF_OVERSAMPLING = 'smote'
+DF_SMOTE_K_NEIGHBORS = 5
+DF_SMOTE_INDEX_ROWS = 50000  # Rows per class searched for neighbours
+DF_SMOTE_BATCH_SIZE = 65536  # Rows per neighbour query and generation
+DF_SMOTE_N_JOBS = -1  # -1 for CPU_BUDGET
+DF_LAZY_BATCHES = 5
 
 # Model Training Related
 MD_TEST_SIZE = 0.25
 MD_RANDOM_STATE = 4
 MD_FILE_PATH = '/tmp/model.sav'
 MD_TUNNING = True
+# Successive halving search. Refer to tuning.py
+MD_TUNNING_N_CANDIDATES = 27
+MD_TUNNING_FACTOR = 3
+MD_TUNNING_MIN_ESTIMATORS = 5
+MD_TUNNING_MAX_ESTIMATORS = 30
+MD_TUNNING_MIN_SAMPLES = 1000
+MD_TUNNING_VALID_SIZE = 0.2
+MD_TUNNING_TIME_BUDGET = 1800  # Seconds. None for no limit
+# Candidates fitted at once, each forest with CPU_BUDGET // workers cores
+MD_TUNNING_WORKERS = 1
 MD_n_estimators = 25
 MD_min_samples_split = 5
 MD_min_samples_leaf = 2
 MD_max_depth = 26
+# Out-of-core training. Streams the data file in chunks of
+# MD_OUT_OF_CORE_CHUNK_SIZE rows instead of data processing and model
+# building in memory. Refer to out_of_core.py
+MD_OUT_OF_CORE = False
+MD_OUT_OF_CORE_CHUNK_SIZE = 100000
+MD_OUT_OF_CORE_CLASS_SAMPLE = 2000  # Rows per class added to every chunk
+MD_OUT_OF_CORE_TEST_ROWS = 50000
+# Feature Selection. Opt in. Refit on the most important features that
+# together hold MD_FEATURE_IMPORTANCE_CUTOFF of the forest feature
+# importance, with the same (tuned) parameters
+MD_FEATURE_SELECTION = False
+MD_FEATURE_IMPORTANCE_CUTOFF = 0.95
+# Compact model artifact. Forest node arrays stored for memory-mapped load,
+# pages shared by every process loading the artifact. Refer to forest.py
+MD_ARTIFACT_COMPACT = False
+# joblib compress level, ex. 3 to ship. Compressed artifacts load without
+# mmap
+MD_ARTIFACT_COMPRESS = 0
+MD_ARTIFACT_THRESHOLD_DTYPE = 'float64'  # float32 keeps predictions exact
+MD_ARTIFACT_PRUNE_TOLERANCE = None  # Leaf merging, above 0 changes predictions
+
+# Quantile sketch values per column and summary. Rank error is about
+# log2(chunk count) / SKETCH_SIZE. Refer to sketch.py
+SKETCH_SIZE = 2048
+
+# Data profile of the fetched data and drift against the profile of the
+# data the current model was trained on. Refer to drift.py
+DATA_PROFILE = True
+DATA_PROFILE_PATH = '/tmp/data_profile.pkl'
+DATA_PROFILE_REFERENCE_PATH = '/tmp/data_profile_reference.pkl'
+DATA_PROFILE_DIR = '/tmp/p2_data_profiles'  # One profile per run and source
+DATA_PROFILE_KEEP = 200  # Newest profiles kept in DATA_PROFILE_DIR
+DATA_PROFILE_SKETCH_SIZE = 512
+DRIFT_HISTOGRAM_BINS = 10
+DRIFT_PSI_THRESHOLD = 0.25  # Column drifted above this PSI
+# Drift is detected above this share of drifted columns
+DRIFT_MAX_DRIFTED_SHARE = 0.2
+# Skip model building while drift is detected and keep scoring with the
+# current model, until the profile is accepted as the new reference
+# (--accept-drift). Drift is only reported if False
+DRIFT_BLOCK_RETRAINING = False
+
+# Parallelism. Cores shared by all stages, None for the cores available to
+# the process (CPU affinity and cgroup quota included). Refer to parallel.py
+CPU_BUDGET = None
+# Joblib backend of the tuning workers. threading, loky or multiprocessing
+JOBLIB_BACKEND = 'threading'
+# BLAS / OpenMP threads per pipeline stage. CPU_BUDGET for a stage not
+# listed. Scoring workers limit their own, refer to scoring.py
+STAGE_THREAD_LIMITS = {
+    'data-fetch': 1,
+    'data-check': 1,
+    'inference': 1
+}
+
+# Stage Output Cache
+CACHE_DIR = '/tmp/p2_cache'
+CACHE_MAX_SIZE_MB = 2048
+
+# Database Related
+# SQLAlchemy URL. `mysqldb` is the C mysqlclient driver. Env var P2_DB_URL
+# overrides it, ex. sqlite:////tmp/micron.db for a local stand-in
+DB_URL = os.getenv('P2_DB_URL', 'mysql+mysqldb://root:@127.0.0.1/micron')
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 5
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = True
+# Result Writer. `batch` driver executemany per batch (mysqlclient sends
+# multi-row INSERTs), `multi` explicit multi-row INSERT, or `load_data`
+# MySQL LOAD DATA LOCAL INFILE (needs local_infile enabled on the server)
+DB_WRITE_METHOD = 'batch'
+DB_WRITE_BATCH_SIZE = 1000
+DB_SOURCE_TABLE = 'q6_data'
+DB_RESULT_TABLE = 'q6_data_result'
+DB_STATE_TABLE = 'q6_inference_state'
+DB_COMPARE_TABLE = 'q6_data_compare'  # Refer to inference.compare_models
+# Incremental inference. Rows are upserted on DB_KEY_COLUMN and selected
+# past the last DB_WATERMARK_COLUMN value seen. Use a last-modified
+# timestamp column as watermark to also rescore changed rows.
+DB_KEY_COLUMN = 'id'
+DB_WATERMARK_COLUMN = 'id'
+
+# Inference Related
+INF_CHUNK_SIZE = 10000
+INF_N_WORKERS = 1  # Scoring worker processes. -1 for all CPU cores
+INF_QUEUE_SIZE = 2  # Chunks buffered between read, score and write stages
+# Result table holds key, prediction, probability and model version.
+# Set INF_RESULT_FEATURES to also copy the feature columns.
+INF_RESULT_PROBABILITY = True
+INF_RESULT_FEATURES = False
+# Profile inference input chunks and report drift against the reference
+INF_DATA_PROFILE = False
+
+# Metrics sink. JSON lines, or SQLite table `metrics` if the path ends
+# with .db. None to only log. Refer to util.store_metric
+METRICS_PATH = '/tmp/p2_metrics.jsonl'
+# Per stage cProfile / pyinstrument output. Refer to instrument.py
+PROFILE_DIR = '/tmp/p2_profile'
+
+# Prediction Server
+SRV_HOST = '127.0.0.1'
+SRV_PORT = 8080
+SRV_MAX_BATCH_ROWS = 256  # Rows coalesced into one predict call
+SRV_MAX_WAIT_MS = 2  # Wait for more requests after the first one
+SRV_LATENCY_WINDOW = 10000  # Recent requests kept for p50/p99
+SRV_RELOAD_INTERVAL = 5  # Seconds between model file checks. 0 to disable
+# Serve the forest as a CompactForest, same predictions with much lower
+# latency for micro-batches. Refer to forest.py
+SRV_VECTORIZED_FOREST = True
@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import csv
+import json
 import logging
 import os
+import pickle
 import time
 import pandas as pd
 import numpy as np
-from sklearn.impute import SimpleImputer
-from imblearn.over_sampling import SMOTE
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.parquet as pq
+from . import db
+from . import drift
+from .impute import MedianImputer
+from . import instrument
+from . import oversample
 from . import util as ut
 from . import const as C
 
@@ -19,6 +26,8 @@ def fetch_data_from_mssql(data_file_path=C.DATA_FILE_PATH):
     """
     Fetch Data from MSSQL.
     Convert the file to store in local drive.
+    Rows are streamed in chunks into a typed, compressed Parquet file,
+    or a CSV file if `data_file_path` ends with `.csv`.
 
     Parameters:
         data_file_path (str):
@@ -29,57 +38,282 @@ def fetch_data_from_mssql(data_file_path=C.DATA_FILE_PATH):
             Dictionary with metrics and status
     """
     time_start = time.time()
-    log.info('Fetch Data from MSSQL')
-    sqlEngine = create_engine('mysql+pymysql://root:@127.0.0.1/micron',
-                              pool_recycle=3600)
-    with sqlEngine.connect() as db_connection:
+    with instrument.span('fetch_data_from_mssql') as stage_span:
+        log.info('Fetch Data from MSSQL')
+        # Profile the rows on their way to the data file, refer to drift.py
+        profile = drift.DataProfile(reference=drift.load_profile(
+            C.DATA_PROFILE_REFERENCE_PATH)) if C.DATA_PROFILE else None
         # Fetch input from DB
-        df = pd.read_sql('select * from q6_data', db_connection)
-        df.to_csv(data_file_path, index=False, mode='w')
+        chunks = db.read_sql_chunks(f'select * from {C.DB_SOURCE_TABLE}',
+                                    C.DATA_FETCH_CHUNK_SIZE)
+        # Key columns are not features, keep them out of the data file
+        chunks = (df.drop(db.key_columns(), axis=1, errors='ignore')
+                  for df in chunks)
+        with instrument.span('fetch_data_from_mssql.write') as span:
+            chunks = _count_rows(chunks, span, profile)
+            if _is_parquet(data_file_path):
+                _write_parquet(chunks, data_file_path)
+            else:
+                for i, df in enumerate(chunks):
+                    df.to_csv(data_file_path, index=False,
+                              mode='w' if i == 0 else 'a', header=i == 0)
+            span.add(bytes_written=os.path.getsize(data_file_path))
+        profile_path = drift.save_profile(profile, 'fetch',
+                                          C.DATA_PROFILE_PATH) \
+            if profile is not None else None
     duration = ut.get_duration_msg(time_start)
     log.info('Fetch Data from MSSQL Completed')
     return {
         'func_name': fetch_data_from_mssql.__name__,
         'status': os.path.exists(data_file_path),
         'path': data_file_path,
+        'profile_path': profile_path,
+        'profile_seconds': round(span.counters.get('profile_seconds', 0), 3),
         'duration': duration,
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
         'ram_usage_percent': ut.get_memroy_percent()
     }
 
 
-def data_file_check(data_file_path=C.DATA_FILE_PATH):
+def _count_rows(chunks, span, profile=None):
+    for df in chunks:
+        span.add(rows=df.shape[0])
+        if profile is not None:
+            profile_start = time.perf_counter()
+            profile.update(df)
+            span.add(profile_seconds=time.perf_counter() - profile_start)
+        yield df
+
+
+def _is_parquet(data_file_path):
+    return data_file_path.endswith('.parquet')
+
+
+def _write_parquet(chunks, data_file_path):
+    """
+    Write DataFrame chunks as row groups of one Parquet file.
+    Features are cast to `C.DATA_FILE_FLOAT_DTYPE` so every row group
+    shares one schema, whatever type the driver inferred for the chunk.
+    """
+    writer = None
+    try:
+        for df in chunks:
+            df = df.astype({col: C.DATA_FILE_FLOAT_DTYPE
+                            for col in df.columns if col != 'target'})
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    data_file_path, table.schema,
+                    compression=C.DATA_FILE_COMPRESSION)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_data_file(data_file_path=C.DATA_FILE_PATH, columns=None):
+    """
+    Load Data File into DataFrame.
+
+    Parameters:
+        data_file_path (str):
+            Data File location. Parquet or CSV. (Default value refer to
+            const.py)
+
+        columns (list):
+            Optional. Only read these columns. All columns if None.
+            Parquet only reads the projected columns from disk.
+
+    Returns:
+        df (DataFrame)
+    """
+    log.debug(('Read Data File', data_file_path, columns))
+    if _is_parquet(data_file_path):
+        return pd.read_parquet(data_file_path, columns=columns)
+    return pd.read_csv(data_file_path, usecols=columns)
+
+
+def read_feature_array(data_file_path=C.DATA_FILE_PATH, columns=None,
+                       dtype=np.float32):
+    """
+    Load Data File into one feature array, without an intermediate
+    DataFrame. Rows are copied chunk by chunk into a preallocated
+    C-contiguous array.
+
+    Parameters:
+        data_file_path (str):
+            Data File location. Parquet or CSV.
+
+        columns (list):
+            Optional. Feature columns to read. All columns but the last
+            (label) column if None.
+
+        dtype:
+            Optional. Feature dtype.
+
+    Returns:
+        X (ndarray):
+            Features
+
+        y (ndarray):
+            Label, the last column of the file
+
+        feature_columns (list)
+    """
+    log.debug(('Read Feature Array', data_file_path, columns, dtype))
+    feature_columns, label_column = data_file_columns(data_file_path,
+                                                      columns)
+    if _is_parquet(data_file_path):
+        metadata = pq.ParquetFile(data_file_path).metadata
+        row_count = metadata.num_rows
+    else:
+        with open(data_file_path) as f:
+            row_count = sum(1 for _ in f) - 1
+    X = np.empty((row_count, len(feature_columns)), dtype=dtype, order='C')
+    y = None
+    start = 0
+    for X_chunk, y_chunk in iter_feature_chunks(data_file_path,
+                                                feature_columns, dtype=dtype):
+        stop = start + X_chunk.shape[0]
+        X[start:stop] = X_chunk
+        if y is None:
+            y = np.empty(row_count, dtype=y_chunk.dtype)
+        y[start:stop] = y_chunk
+        start = stop
+    if y is None:
+        y = np.empty(0)
+    return X, y, feature_columns
+
+
+def data_file_columns(data_file_path=C.DATA_FILE_PATH, columns=None):
+    """
+    Returns:
+        feature_columns (list):
+            `columns`, or all columns but the last and the key
+            columns if None
+
+        label_column (str):
+            Last column of the file
+    """
+    if _is_parquet(data_file_path):
+        names = pq.ParquetFile(data_file_path).schema_arrow.names
+    else:
+        names = list(pd.read_csv(data_file_path, nrows=0).columns)
+    if not columns:
+        key_columns = db.key_columns()
+        columns = [c for c in names[:-1] if c not in key_columns]
+    return [str(c) for c in columns], names[-1]
+
+
+def iter_feature_chunks(data_file_path=C.DATA_FILE_PATH, columns=None,
+                        chunk_size=C.DATA_FETCH_CHUNK_SIZE,
+                        dtype=np.float32):
+    """
+    Stream Data File as feature and label arrays of at most `chunk_size`
+    rows. Only one chunk is held in memory at a time, whatever the file
+    size.
+
+    Parameters:
+        data_file_path (str):
+            Data File location. Parquet or CSV.
+
+        columns (list):
+            Optional. Feature columns to read. All columns but the last
+            (label) column if None.
+
+        chunk_size (int):
+            Optional. Rows per chunk.
+
+        dtype:
+            Optional. Feature dtype.
+
+    Returns:
+        chunks (generator):
+            (X, y) per chunk
+    """
+    feature_columns, label_column = data_file_columns(data_file_path,
+                                                      columns)
+    if _is_parquet(data_file_path):
+        # Row groups, split into chunks of at most `chunk_size` rows and
+        # converted column by column. Skips the DataFrame conversion,
+        # which needs several times the chunk size. `iter_batches` holds
+        # on to memory as it goes, in proportion to the file size.
+        parquet_file = pq.ParquetFile(data_file_path)
+        for i in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(
+                i, columns=feature_columns + [label_column])
+            for start in range(0, table.num_rows, chunk_size):
+                chunk = table.slice(start, chunk_size)
+                X = np.empty((chunk.num_rows, len(feature_columns)),
+                             dtype=dtype, order='C')
+                for j, name in enumerate(feature_columns):
+                    X[:, j] = chunk.column(name).to_numpy()
+                yield X, chunk.column(label_column).to_numpy()
+    else:
+        for df in pd.read_csv(data_file_path, chunksize=chunk_size,
+                              usecols=feature_columns + [label_column]):
+            yield (df[feature_columns].to_numpy(dtype=dtype),
+                   df[label_column].to_numpy())
+
+
+def data_file_check(data_file_path=C.DATA_FILE_PATH, load_data=False):
     """
     Data File Check
 
+    Row count, header width, per-column null count and min/max are
+    collected in a single constant memory pass. CSV is scanned in chunks
+    of `C.DATA_CHECK_CHUNK_SIZE` rows, Parquet is read from the file
+    metadata only.
+
     Parameters:
         data_file_path (str):
             Data File location. (Default value refer to const.py)
 
+        load_data (bool):
+            Optional. Also load the whole file into the returned DataFrame.
+
     Returns:
         result (dict):
             Dict contains metrics and status
 
         df (Dataframe):
             DataFrame loaded from input param - `data_file_path`
+            None unless `load_data` is True.
 
     """
     time_start = time.time()
+    ut.reset_peak_rss()
     log.info('Data File Check Start')
     log.debug(('data_file_path', data_file_path))
     ut.file_exists_check(data_file_path)
 
     # Collect Data Metrics
-    df = pd.read_csv(data_file_path)
-    row_count = df.shape[0]
-    col_count = df.shape[1]
-    file_size = os.stat(data_file_path).st_size
+    if _is_parquet(data_file_path):
+        # Compare the uncompressed size against the CSV size threshold
+        metadata = pq.ParquetFile(data_file_path).metadata
+        file_size = sum(metadata.row_group(i).total_byte_size
+                        for i in range(metadata.num_row_groups))
+        row_count, stats = _parquet_column_stats(metadata)
+    else:
+        file_size = os.stat(data_file_path).st_size
+        row_count, stats = _csv_column_stats(data_file_path)
+    # Key columns of a data file fetched before they were dropped
+    col_count = len([c for c in stats if c not in db.key_columns()])
+    df = read_data_file(data_file_path) if load_data else None
+
+    # Value range of critical columns
+    range_errors = {
+        col: (stats[col]['min'], stats[col]['max'])
+        for col, (low, high) in C.DATA_FILE_VALUE_RANGE.items()
+        if col not in stats
+        or not low <= stats[col]['min'] <= stats[col]['max'] <= high}
 
     # Metrics Checking
     status = row_count > C.DATA_FILE_MIN_ROW_COUNT \
         and col_count == C.DATA_FILE_COL_COUNT \
-        and file_size > C.DATA_FILE_MIN_FILE_SIZE_MB
+        and file_size > C.DATA_FILE_MIN_FILE_SIZE_MB \
+        and not range_errors
 
-    # TODO validate value range of critical column etc.
     duration = ut.get_duration_msg(time_start)
     result = {
         'func_name': data_file_check.__name__,
@@ -87,18 +321,84 @@ def data_file_check(data_file_path=C.DATA_FILE_PATH):
         'row_count': (row_count, row_count > C.DATA_FILE_MIN_ROW_COUNT),
         'col_count': (col_count, col_count == C.DATA_FILE_COL_COUNT),
         'file_zie': (file_size > C.DATA_FILE_MIN_FILE_SIZE_MB),
+        'value_range': (range_errors, not range_errors),
+        'null_count': sum(s['null_count'] for s in stats.values()),
+        'column_stats': stats,
         'status': status,
         'duration': duration,
+        'peak_rss_mb': ut.get_peak_rss_mb(),
         'ram_usage_percent': ut.get_memroy_percent()
     }
     log.info('Data File Check Completed')
     return result, df
 
 
+def _csv_column_stats(data_file_path):
+    """
+    Row count and per-column null count / min / max of a CSV file,
+    scanned in chunks so memory stays flat whatever the file size.
+    """
+    with open(data_file_path, newline='') as f:
+        header = next(csv.reader(f))
+    null_count = np.zeros(len(header), dtype=np.int64)
+    col_min = np.full(len(header), np.inf)
+    col_max = np.full(len(header), -np.inf)
+    row_count = 0
+    for chunk in pd.read_csv(data_file_path, dtype=np.float64,
+                             chunksize=C.DATA_CHECK_CHUNK_SIZE):
+        values = chunk.to_numpy()
+        row_count += values.shape[0]
+        null_count += np.isnan(values).sum(axis=0)
+        # fmin / fmax skip NaN
+        col_min = np.fmin(col_min, np.fmin.reduce(values, axis=0))
+        col_max = np.fmax(col_max, np.fmax.reduce(values, axis=0))
+    return row_count, _column_stats(header, null_count, col_min, col_max)
+
+
+def _parquet_column_stats(metadata):
+    """
+    Row count and per-column null count / min / max from the row group
+    statistics of a Parquet file footer.
+    """
+    header = [metadata.schema.column(i).name
+              for i in range(metadata.num_columns)]
+    null_count = np.zeros(len(header), dtype=np.int64)
+    col_min = np.full(len(header), np.inf)
+    col_max = np.full(len(header), -np.inf)
+    for g in range(metadata.num_row_groups):
+        row_group = metadata.row_group(g)
+        for i in range(len(header)):
+            statistics = row_group.column(i).statistics
+            if statistics is None:
+                continue
+            null_count[i] += statistics.null_count
+            if statistics.has_min_max:
+                col_min[i] = min(col_min[i], statistics.min)
+                col_max[i] = max(col_max[i], statistics.max)
+    return metadata.num_rows, \
+        _column_stats(header, null_count, col_min, col_max)
+
+
+def _column_stats(header, null_count, col_min, col_max):
+    # Columns without a single value have no range
+    col_min[np.isinf(col_min)] = np.nan
+    col_max[np.isinf(col_max)] = np.nan
+    return {col: {'null_count': int(null_count[i]),
+                  'min': float(col_min[i]),
+                  'max': float(col_max[i])}
+            for i, col in enumerate(header)}
+
+
 def process_data(data_file_path=C.DATA_FILE_PATH,
                  training_data_path=C.DF_X_TMP_PATH,
                  label_data_path=C.DF_Y_TMP_PATH,
-                 dataset_override=None):
+                 imputer_path=C.DF_IMPUTER_TMP_PATH,
+                 columns_path=C.DF_COLUMNS_TMP_PATH,
+                 dataset_override=None,
+                 columns=None,
+                 low_memory=C.DF_LOW_MEMORY,
+                 imputer_stats_path=C.DF_IMPUTER_STATS_PATH,
+                 oversampling=C.DF_OVERSAMPLING):
     """
     Data Processing.
 
@@ -112,10 +412,35 @@ def process_data(data_file_path=C.DATA_FILE_PATH,
         predict_data_path (str):
             Save Predict Data Path (Default value refer const.py)
 
+        imputer_path (str):
+            Save fitted Imputer Path (Default value refer const.py)
+            Packaged with the model so inference does not refit it.
+
+        columns_path (str):
+            Save Feature Column Names Path (Default value refer const.py)
+
         dataset (dataframe):
             Optional. If value is none.
             Data will be loaded from `data_file_path`.
 
+        columns (list):
+            Optional. Feature columns to load from `data_file_path`.
+            All columns if None.
+
+        low_memory (bool):
+            Optional. Read features straight into a float32 array, shuffle
+            and impute it in place. (Default value refer to const.py)
+
+        imputer_stats_path (str):
+            Optional. Imputer medians by column. Reused instead of
+            refitting while `data_file_path` is unchanged.
+            (Default value refer to const.py)
+
+        oversampling (str):
+            Optional. Class imbalance handling, refer to oversample.py.
+            `weights` and `lazy` leave the rows as they are for model
+            building to balance. (Default value refer to const.py)
+
     Returns:
         result (dict):
             Status and Metrics
@@ -129,35 +454,70 @@ def process_data(data_file_path=C.DATA_FILE_PATH,
     """
     log.info('Data Processing Start')
     time_start = time.time()
-    # Log all input param
-    log.debug(process_data.__code__.co_varnames)
-    dataset = dataset_override if dataset_override is not None else \
-        pd.read_csv(data_file_path)
-
-    target_group_metric = dataset.groupby(['target']).size().to_string()
-
-    # Store data metric - label group
-    log.debug(('target_group_metrics', target_group_metric))
-
-    # Shuffle rows
-    dataset = dataset.sample(frac=1)
-
-    # Split Train and Test Data
-    X = dataset.iloc[:, :-1].values
-    y = dataset.iloc[:, -1].values
-
-    # Data Cleaning. Fill NaN
-    imputer = SimpleImputer(missing_values=np.nan, strategy='median')
-    imputer.fit(X)
-    X = imputer.transform(X)
-
-    # Handle Data Imbalance
-    smote = SMOTE(random_state=31)
-    X, y = smote.fit_resample(X, y)
-
-    # Store Data in temp directory
-    np.savetxt(training_data_path, X)
-    np.savetxt(label_data_path, y)
+    with instrument.span('process_data') as stage_span:
+        # Log all input param
+        log.debug(process_data.__code__.co_varnames)
+        with instrument.span('process_data.load') as span:
+            if low_memory:
+                X, y, feature_columns = _load_features_low_memory(
+                    data_file_path, dataset_override, columns)
+            else:
+                X, y, feature_columns = _load_features(
+                    data_file_path, dataset_override, columns)
+            span.add(rows=X.shape[0], bytes_read=0 if dataset_override
+                     is not None else os.path.getsize(data_file_path))
+
+        # Data Cleaning. Fill NaN with the column medians
+        with instrument.span('process_data.impute', rows=X.shape[0]):
+            # Only a file has a version to reuse the medians of
+            source = _file_version(data_file_path) \
+                if dataset_override is None else None
+            imputer = MedianImputer.load_statistics(
+                imputer_stats_path, feature_columns, source) \
+                if source else None
+            imputer_reused = imputer is not None
+            if not imputer_reused:
+                imputer = MedianImputer().fit(X)
+                imputer.save_statistics(imputer_stats_path, feature_columns,
+                                        source)
+            # Impute in place, but not the caller's input at inference
+            X = imputer.set_params(copy=not low_memory).transform(X)
+            imputer.set_params(copy=True)
+
+        # Handle Data Imbalance
+        with instrument.span('process_data.oversample',
+                             rows=X.shape[0]) as span:
+            row_count = X.shape[0]
+            # Rows and bytes full SMOTE would have added
+            smote_rows = oversample.synthetic_row_count(y)
+            row_bytes = X.shape[1] * X.dtype.itemsize + y.dtype.itemsize
+            X, y = oversample.resample(X, y, oversampling)
+            synthetic_rows = X.shape[0] - row_count
+            span.add(synthetic_rows=synthetic_rows)
+        oversampling_metrics = {
+            'method': oversampling,
+            'seconds': round(span.record['seconds'], 3),
+            'peak_rss_delta_mb': span.record['peak_rss_delta_mb'],
+            'synthetic_rows': synthetic_rows,
+            'rows_saved': smote_rows - synthetic_rows,
+            'memory_saved_mb': round((smote_rows - synthetic_rows) * row_bytes
+                                     / 1024 ** 2, 1)
+        }
+
+        # Store Data in temp directory
+        with instrument.span('process_data.save', rows=X.shape[0]) as span:
+            ut.save_array(training_data_path, X)
+            ut.save_array(label_data_path, y)
+            # New files, the old ones may be linked from the stage cache
+            ut.delete_file(imputer_path)
+            ut.delete_file(columns_path)
+            with open(imputer_path, 'wb') as f:
+                pickle.dump(imputer, f)
+            with open(columns_path, 'w') as f:
+                json.dump(feature_columns, f)
+            span.add(bytes_written=sum(os.path.getsize(p) for p in (
+                training_data_path, label_data_path, imputer_path,
+                columns_path)))
 
     duration = ut.get_duration_msg(time_start)
     result = {
@@ -166,11 +526,77 @@ def process_data(data_file_path=C.DATA_FILE_PATH,
         'y_shape': y.shape,
         'status':
             os.path.exists(training_data_path) and
-            os.path.exists(label_data_path),
+            os.path.exists(label_data_path) and
+            os.path.exists(imputer_path) and
+            os.path.exists(columns_path),
         'X_data_path': training_data_path,
         'Y_data_path': label_data_path,
+        'imputer_path': imputer_path,
+        'imputer_reused': imputer_reused,
+        'low_memory': low_memory,
+        'oversampling': oversampling_metrics,
         'duration': duration,
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
         'ram_usage_percent': ut.get_memroy_percent()
     }
     log.info('Data Processing Completed')
     return result, X, y
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size,
+                             stat.st_mtime_ns)
+
+
+def _load_features(data_file_path, dataset_override, columns):
+    if dataset_override is not None:
+        dataset = dataset_override
+    else:
+        dataset = read_data_file(
+            data_file_path,
+            columns=list(columns) + ['target'] if columns else None)
+
+    dataset = dataset.drop(db.key_columns(), axis=1, errors='ignore')
+    target_group_metric = dataset.groupby(['target']).size().to_string()
+
+    # Store data metric - label group
+    log.debug(('target_group_metrics', target_group_metric))
+
+    # Shuffle rows
+    dataset = dataset.sample(frac=1)
+
+    # Split Train and Test Data
+    feature_columns = [str(col) for col in dataset.columns[:-1]]
+    X = dataset.iloc[:, :-1].values
+    y = dataset.iloc[:, -1].values
+    return X, y, feature_columns
+
+
+def _load_features_low_memory(data_file_path, dataset_override, columns):
+    """
+    Features as one C-contiguous float32 array, shuffled in place rather
+    than through a shuffled copy of the DataFrame.
+    """
+    if dataset_override is not None:
+        dataset_override = dataset_override.drop(db.key_columns(), axis=1,
+                                                 errors='ignore')
+        X = dataset_override.iloc[:, :-1].to_numpy(dtype=np.float32)
+        y = dataset_override.iloc[:, -1].to_numpy()
+        feature_columns = [str(c) for c in dataset_override.columns[:-1]]
+    else:
+        X, y, feature_columns = read_feature_array(
+            data_file_path, columns, dtype=np.float32)
+    X = np.ascontiguousarray(X)
+
+    labels, counts = np.unique(y, return_counts=True)
+    log.debug(('target_group_metrics', dict(zip(labels.tolist(),
+                                                counts.tolist()))))
+
+    # Shuffle rows. Same permutation for X and y by replaying the state
+    rng = np.random.default_rng()
+    state = rng.bit_generator.state
+    rng.shuffle(X)
+    rng.bit_generator.state = state
+    rng.shuffle(y)
+    return X, y, feature_columns
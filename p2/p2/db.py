@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import tempfile
+import time
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from . import const as C
+
+log = logging.getLogger(__name__)
+
+# One pooled engine per URL, shared by every pipeline stage
+_engines = {}
+
+# Bound variable limit per statement of older SQLite builds
+_SQLITE_MAX_VARIABLES = 999
+
+
+def get_engine(db_url=None):
+    """
+    Shared Database Engine.
+
+    Parameters:
+        db_url (str):
+            Optional. SQLAlchemy URL. (Default value refer to const.py,
+            overridable with env var `P2_DB_URL`)
+
+    Returns:
+        engine (Engine):
+            Pooled engine, created on first use and reused afterwards
+    """
+    db_url = db_url or C.DB_URL
+    engine = _engines.get(db_url)
+    if engine is None:
+        engine = _engines[db_url] = _create_engine(db_url)
+    return engine
+
+
+def _create_engine(db_url):
+    url = make_url(db_url)
+    log.debug(('Create DB Engine', url.drivername, url.database))
+    options = {
+        'pool_pre_ping': C.DB_POOL_PRE_PING,
+        'pool_recycle': C.DB_POOL_RECYCLE
+    }
+    if url.get_backend_name() != 'sqlite':
+        options.update(pool_size=C.DB_POOL_SIZE,
+                       max_overflow=C.DB_MAX_OVERFLOW)
+    if url.get_backend_name() == 'mysql':
+        # Client side switch for the LOAD DATA LOCAL INFILE result writer
+        options['connect_args'] = {'local_infile': 1}
+    engine = create_engine(url, **options)
+
+    if url.get_backend_name() == 'sqlite':
+        # Let a streaming read and the result writes run side by side
+        @event.listens_for(engine, 'connect')
+        def _set_wal(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.close()
+    return engine
+
+
+def dispose_engines():
+    """
+    Close all pooled connections. Ex. before forking worker processes.
+    """
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
+
+
+def key_columns():
+    """
+    Key and watermark columns of the source table. They only serve
+    incremental inference and are never features.
+    """
+    return list(dict.fromkeys([C.DB_KEY_COLUMN, C.DB_WATERMARK_COLUMN]))
+
+
+def read_sql_chunks(sql, chunk_size, params=None, engine=None):
+    """
+    Stream Query Result in DataFrame chunks.
+    Rows are fetched through a server-side cursor, so only one chunk is
+    held in memory at a time. Empty chunks are skipped.
+
+    Parameters:
+        sql (str):
+            Query. Bind parameters as `:name`.
+
+        chunk_size (int):
+            Rows per chunk.
+
+        params (dict):
+            Optional. Query parameters.
+
+        engine (Engine):
+            Optional. Shared engine if value is None.
+
+    Returns:
+        chunks (generator):
+            DataFrame per chunk
+    """
+    engine = engine or get_engine()
+    with engine.connect() as db_connection:
+        db_connection = db_connection.execution_options(stream_results=True)
+        for df in pd.read_sql(text(sql), db_connection, params=params,
+                              chunksize=chunk_size):
+            if not df.empty:
+                yield df
+
+
+class ResultWriter:
+    """
+    Result Table Writer.
+
+    In atomic mode rows are written to a staging table that replaces the
+    result table in one swap on `commit`, so readers never see a half
+    written result. The key index is built once on `commit` rather than
+    maintained per insert. Otherwise rows are written to the table
+    directly.
+
+    Rows are sent in INSERT batches of `batch_size`, or with
+    `LOAD DATA LOCAL INFILE` from a temporary CSV file on MySQL when
+    `method` is `load_data`.
+
+    Usage:
+        writer = ResultWriter()
+        for df in chunks:
+            writer.write(df)
+        writer.commit()
+    """
+
+    def __init__(self, table=C.DB_RESULT_TABLE, engine=None,
+                 method=C.DB_WRITE_METHOD, batch_size=C.DB_WRITE_BATCH_SIZE,
+                 atomic=True, key=C.DB_KEY_COLUMN):
+        """
+        Parameters:
+            table (str):
+                Optional. Result table. (Default value refer to const.py)
+
+            engine (Engine):
+                Optional. Shared engine if value is None.
+
+            method (str):
+                Optional. `batch`, `multi` or `load_data`. `load_data`
+                falls back to `batch` on databases other than MySQL.
+
+            batch_size (int):
+                Optional. Rows per INSERT statement.
+
+            atomic (bool):
+                Optional. Write through a staging table and swap on commit.
+
+            key (str):
+                Optional. Key column the index of written rows is stored
+                in, indexed and upserted on.
+                (Default value refer to const.py)
+        """
+        self.engine = engine or get_engine()
+        self.table = table
+        self.staging_table = table + '_staging' if atomic else table
+        self.batch_size = batch_size
+        self.is_mysql = self.engine.dialect.name == 'mysql'
+        if method == 'load_data' and not self.is_mysql:
+            method = 'batch'
+        self.method = method
+        self.atomic = atomic
+        self.key = key
+        self.row_count = 0
+        self.write_seconds = 0.0
+        self._created = not atomic
+
+    def write(self, df):
+        """
+        Append rows of `df`, keyed by its index, to the staging table.
+        The staging table is recreated on the first write.
+        """
+        time_start = time.perf_counter()
+        with self.engine.begin() as db_connection:
+            self._insert(df, db_connection)
+        self.row_count += df.shape[0]
+        self.write_seconds += time.perf_counter() - time_start
+
+    def upsert(self, df):
+        """
+        Replace rows of the table that share a key with the index of `df`.
+        Delete and insert keeps it portable across MySQL and SQLite.
+        """
+        time_start = time.perf_counter()
+        delete = text('delete from {} where {} in :keys'.format(
+            self._quote(self.table), self._quote(self.key)))
+        delete = delete.bindparams(bindparam('keys', expanding=True))
+        with self.engine.begin() as db_connection:
+            db_connection.execute(delete, {'keys': df.index.tolist()})
+            self._insert(df, db_connection)
+        self.row_count += df.shape[0]
+        self.write_seconds += time.perf_counter() - time_start
+
+    def commit(self):
+        """
+        Swap the staging table in as the result table.
+        """
+        if not self.atomic or not self._created:
+            return
+        time_start = time.perf_counter()
+        table = self._quote(self.table)
+        staging = self._quote(self.staging_table)
+        old = self._quote(self.table + '_old')
+        index_sql = 'create index {} on {{}} ({})'.format(
+            self._quote('ix_{}_{}'.format(self.table, self.key)),
+            self._quote(self.key))
+        exists = inspect(self.engine).has_table(self.table)
+        log.debug(('Swap Result Table', self.staging_table, self.table))
+        with self.engine.begin() as db_connection:
+            if self.is_mysql:
+                # Index names are per table, build it before the swap.
+                # RENAME TABLE swaps both names in one atomic statement.
+                db_connection.execute(text(index_sql.format(staging)))
+                db_connection.execute(text(f'drop table if exists {old}'))
+                if exists:
+                    db_connection.execute(text(
+                        f'rename table {table} to {old}, '
+                        f'{staging} to {table}'))
+                    db_connection.execute(text(f'drop table {old}'))
+                else:
+                    db_connection.execute(text(
+                        f'rename table {staging} to {table}'))
+            else:
+                # Transactional DDL. Ex. SQLite
+                db_connection.execute(text(f'drop table if exists {table}'))
+                db_connection.execute(text(
+                    f'alter table {staging} rename to {table}'))
+                # Index names are global in SQLite, build it after the
+                # old table and its index are gone
+                db_connection.execute(text(index_sql.format(table)))
+        self.write_seconds += time.perf_counter() - time_start
+
+    def _insert(self, df, db_connection):
+        rows = df.rename_axis(self.key).reset_index()
+        if_exists = 'append' if self._created else 'replace'
+        if self.method == 'load_data':
+            rows.head(0).to_sql(self.staging_table, db_connection,
+                                if_exists=if_exists, index=False)
+            self._load_data(rows, db_connection)
+        elif self.method == 'multi':
+            batch_size = self.batch_size
+            if self.engine.dialect.name == 'sqlite':
+                batch_size = min(batch_size, max(
+                    1, _SQLITE_MAX_VARIABLES // rows.shape[1]))
+            rows.to_sql(self.staging_table, db_connection,
+                        if_exists=if_exists, index=False, method='multi',
+                        chunksize=batch_size)
+        else:
+            rows.to_sql(self.staging_table, db_connection,
+                        if_exists=if_exists, index=False,
+                        chunksize=self.batch_size)
+        self._created = True
+
+    def _load_data(self, rows, db_connection):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            rows.to_csv(f, header=False, index=False, na_rep='\\N')
+            f.flush()
+            db_connection.execute(text(
+                "load data local infile '{}' into table {} "
+                "fields terminated by ',' optionally enclosed by '\"' "
+                "lines terminated by '\\n' ({})".format(
+                    f.name, self._quote(self.staging_table),
+                    ', '.join(self._quote(c) for c in rows.columns))))
+
+    def _quote(self, name):
+        return self.engine.dialect.identifier_preparer.quote(name)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import pickle
+import shutil
+import time
+import numpy as np
+from . import const as C
+from . import instrument
+from . import util as ut
+from .sketch import QuantileSketch
+
+log = logging.getLogger(__name__)
+
+"""
+Data Profiling and Drift Detection.
+
+A `DataProfile` summarizes the numeric columns of a table in one
+streaming pass over its chunks: a quantile sketch per column (with null
+count, min and max) and a histogram over fixed bin edges. Profiles of
+chunks, files or runs merge into the profile of all their rows.
+
+Data fetch profiles the rows it streams to the data file. The profile is
+persisted per run in `C.DATA_PROFILE_DIR`, which keeps the newest
+`C.DATA_PROFILE_KEEP` profiles, and the profile of the data
+the current model was trained on is kept as the reference. Drift is
+computed from the two profiles alone, the historical data is never
+reread:
+
+- psi: Population Stability Index over the reference histogram bins.
+  Below 0.1 is stable, above 0.25 a significant shift.
+- ks: largest distance between the two column CDFs, from the sketches.
+- null_rate_delta: change in the share of null values.
+
+A new profile takes its histogram bin edges from the reference, at the
+reference deciles, so both histograms count the same bins.
+"""
+
+
+class DataProfile:
+
+    def __init__(self, reference=None, bins=C.DRIFT_HISTOGRAM_BINS,
+                 sketch_size=C.DATA_PROFILE_SKETCH_SIZE):
+        """
+        Parameters:
+            reference (DataProfile):
+                Optional. Histogram bin edges of columns in the reference
+                are taken from it. Other columns get edges at the
+                quantiles of their first chunk.
+
+            bins (int):
+                Optional. Histogram bins per column.
+                (Default value refer to const.py)
+
+            sketch_size (int):
+                Optional. Refer to `QuantileSketch`.
+                (Default value refer to const.py)
+        """
+        self.reference = reference
+        self.bins = bins
+        self.sketch = QuantileSketch(sketch_size)
+        self.columns = None
+        # (n_columns, bins + 1) edges, -inf first and +inf last
+        self.bin_edges = None
+        self.histogram = None
+        self.row_count = 0
+
+    def update(self, df):
+        """
+        Add the rows of a chunk. Non numeric columns are skipped.
+
+        Parameters:
+            df (DataFrame):
+                Chunk, same columns as the first one.
+        """
+        if df.shape[0] == 0:
+            return self
+        if self.columns is None:
+            self.columns = list(df.select_dtypes('number').columns)
+        X = df[self.columns].to_numpy(dtype=np.float64)
+        # Sorted once for the sketch and the histogram
+        columns = np.sort(X.T, axis=1)
+        self.sketch.update_sorted(columns)
+        if self.bin_edges is None:
+            self._init_bins()
+        count = X.shape[0] - np.isnan(columns).sum(axis=1)
+        for j in range(len(self.columns)):
+            # Values below each inner edge. NaN sort last, left out
+            below = np.searchsorted(columns[j, :count[j]],
+                                    self.bin_edges[j, 1:-1])
+            self.histogram[j] += np.diff(below, prepend=0, append=count[j])
+        self.row_count += X.shape[0]
+        return self
+
+    def merge(self, other):
+        """
+        Add the rows of another profile with the same columns and bins.
+        """
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self.columns = list(other.columns)
+            self.bins = other.bins
+            self.bin_edges = other.bin_edges.copy()
+            self.histogram = np.zeros_like(other.histogram)
+        if self.columns != other.columns or \
+                not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError('Profiles have different columns or bins')
+        self.sketch.merge(other.sketch)
+        self.histogram += other.histogram
+        self.row_count += other.row_count
+        return self
+
+    def null_rate(self):
+        return self.sketch.nan_count / max(self.row_count, 1)
+
+    def column_stats(self):
+        """
+        Per column count, null count, min, max and median.
+        """
+        median = self.sketch.median()
+        return {
+            column: {
+                'count': int(self.sketch.count[j]),
+                'null_count': int(self.sketch.nan_count[j]),
+                'min': self.sketch.min[j],
+                'max': self.sketch.max[j],
+                'median': median[j]
+            }
+            for j, column in enumerate(self.columns or [])}
+
+    def __getstate__(self):
+        # The reference is only needed to set up the bins
+        state = self.__dict__.copy()
+        state['reference'] = None
+        return state
+
+    def _init_bins(self):
+        grid = np.arange(1, self.bins) / self.bins
+        # Edges of columns without a value put every value in one bin
+        inner = np.nan_to_num(self.sketch.quantile(grid).T, nan=np.inf)
+        if self.reference is not None and self.reference.columns:
+            position = {c: i for i, c in enumerate(self.reference.columns)}
+            for j, column in enumerate(self.columns):
+                if column in position and self.reference.bins == self.bins:
+                    inner[j] = self.reference.bin_edges[position[column],
+                                                        1:-1]
+        self.bin_edges = np.column_stack([
+            np.full(len(self.columns), -np.inf), inner,
+            np.full(len(self.columns), np.inf)])
+        self.histogram = np.zeros((len(self.columns), self.bins),
+                                  dtype=np.int64)
+
+
+def compare(reference, current):
+    """
+    Drift of every column of `current` also in `reference`.
+
+    Returns:
+        drift (dict):
+            Column -> `psi`, `ks` and `null_rate_delta`
+    """
+    position = {c: i for i, c in enumerate(current.columns or [])}
+    columns = [c for c in reference.columns or [] if c in position]
+    index = np.array([position[c] for c in columns], dtype=np.int64)
+    ref_index = np.array([reference.columns.index(c) for c in columns],
+                         dtype=np.int64)
+    if not columns:
+        return {}
+
+    expected = _fractions(reference.histogram[ref_index])
+    # Same bins as the reference, counted exactly. Otherwise the share of
+    # the current rows in the reference bins, from the sketch.
+    actual = np.empty_like(expected)
+    edges = reference.bin_edges[ref_index]
+    same_bins = np.array([
+        current.bins == reference.bins and
+        np.array_equal(current.bin_edges[i], edges[k])
+        for k, i in enumerate(index)], dtype=bool)
+    actual[same_bins] = _fractions(current.histogram[index[same_bins]])
+    if (~same_bins).any():
+        cdf = _sketch_cdf(current.sketch, index[~same_bins],
+                          edges[~same_bins, 1:-1])
+        actual[~same_bins] = np.diff(
+            np.column_stack([np.zeros(len(cdf)), cdf,
+                             np.ones(len(cdf))]), axis=1)
+    psi = _psi(expected, actual)
+
+    # CDF distance at the reference percentiles
+    grid = np.arange(1, 100) / 100
+    points = reference.sketch.quantile(grid)[:, ref_index]
+    distance = np.abs(_sketch_cdf(current.sketch, index, points.T) - grid)
+    # No reference percentiles for a column without a value
+    distance[np.isnan(points.T)] = 0.0
+    ks = distance.max(axis=1, initial=0.0)
+
+    null_rate_delta = current.null_rate()[index] - \
+        reference.null_rate()[ref_index]
+    return {
+        column: {'psi': float(psi[k]), 'ks': float(ks[k]),
+                 'null_rate_delta': float(null_rate_delta[k])}
+        for k, column in enumerate(columns)}
+
+
+def _fractions(histogram):
+    total = histogram.sum(axis=1, keepdims=True)
+    return histogram / np.maximum(total, 1)
+
+
+def _sketch_cdf(sketch, index, points):
+    """
+    CDF of sketch columns `index` at `points` (len(index), n_points).
+    0 for columns without a value.
+    """
+    all_points = np.zeros((points.shape[1], sketch.n_columns))
+    all_points[:, index] = points.T
+    cdf = sketch.cdf(all_points)[:, index].T
+    return np.nan_to_num(cdf, nan=0.0)
+
+
+def _psi(expected, actual, epsilon=1e-4):
+    """
+    Population Stability Index per row of bin fractions.
+    """
+    expected = np.maximum(expected, epsilon)
+    actual = np.maximum(actual, epsilon)
+    return ((actual - expected) * np.log(actual / expected)).sum(axis=1)
+
+
+def save_profile(profile, source, path=None):
+    """
+    Persist the profile of this run as `<run_id>_<source>.pkl` in
+    `C.DATA_PROFILE_DIR`, and to `path` if given. Profiles past the newest
+    `C.DATA_PROFILE_KEEP` are removed.
+
+    Returns:
+        run_path (str)
+    """
+    os.makedirs(C.DATA_PROFILE_DIR, exist_ok=True)
+    run_path = os.path.join(C.DATA_PROFILE_DIR,
+                            '{}_{}.pkl'.format(ut.RUN_ID, source))
+    with open(run_path, 'wb') as f:
+        pickle.dump(profile, f)
+    if path is not None:
+        shutil.copyfile(run_path, path)
+    log.debug(('Save Data Profile', run_path, path, profile.row_count))
+    _remove_old_profiles(C.DATA_PROFILE_KEEP)
+    return run_path
+
+
+def _remove_old_profiles(keep):
+    paths = [os.path.join(C.DATA_PROFILE_DIR, name)
+             for name in os.listdir(C.DATA_PROFILE_DIR)
+             if name.endswith('.pkl')]
+    paths.sort(key=lambda p: (os.path.getmtime(p), p), reverse=True)
+    for path in paths[keep:]:
+        log.debug(('Remove Data Profile', path))
+        ut.delete_file(path)
+
+
+def load_profile(path):
+    """
+    Profile at `path`. None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def set_reference(profile_path=C.DATA_PROFILE_PATH,
+                  reference_path=C.DATA_PROFILE_REFERENCE_PATH):
+    """
+    Make the profile of the data file the reference, once a model is
+    built from it.
+    """
+    if os.path.exists(profile_path):
+        log.debug(('Set Reference Data Profile', profile_path))
+        shutil.copyfile(profile_path, reference_path)
+
+
+def summarize(drift):
+    """
+    Drifted columns and the largest scores.
+
+    Returns:
+        summary (dict)
+    """
+    drifted = sorted((c for c, d in drift.items()
+                      if d['psi'] > C.DRIFT_PSI_THRESHOLD),
+                     key=lambda c: -drift[c]['psi'])
+    return {
+        'column_count': len(drift),
+        'drifted_columns': drifted,
+        'drifted_share': len(drifted) / len(drift) if drift else 0.0,
+        'max_psi': max((d['psi'] for d in drift.values()), default=0.0),
+        'max_ks': max((d['ks'] for d in drift.values()), default=0.0),
+        'max_null_rate_delta': max(
+            (abs(d['null_rate_delta']) for d in drift.values()),
+            default=0.0)
+    }
+
+
+def check_drift(profile_path=C.DATA_PROFILE_PATH,
+                reference_path=C.DATA_PROFILE_REFERENCE_PATH):
+    """
+    Data Drift Check
+    Drift of the fetched data against the data the current model was
+    trained on. Drift is detected if the share of columns with a PSI above
+    `C.DRIFT_PSI_THRESHOLD` is above `C.DRIFT_MAX_DRIFTED_SHARE`. It is
+    reported, the pipeline decides what to do about it. No reference yet,
+    ex. on the first run, is no drift.
+
+    Parameters:
+        profile_path (str):
+            Profile of the data file. (Default value refer to const.py)
+
+        reference_path (str):
+            Reference profile. (Default value refer to const.py)
+
+    Returns:
+        result (dict):
+            Dictionary with metrics and status. `drift_detected` as
+            above, `drift` holds the scores of every column.
+    """
+    time_start = time.time()
+    log.info('Data Drift Check Start')
+    ut.file_exists_check(profile_path, error_msg='Data Profile not Found')
+    with instrument.span('check_drift') as stage_span:
+        profile = load_profile(profile_path)
+        reference = load_profile(reference_path)
+        drift = compare(reference, profile) if reference is not None \
+            else {}
+        summary = summarize(drift)
+    drift_detected = reference is not None and \
+        C.DRIFT_MAX_DRIFTED_SHARE is not None and \
+        summary['drifted_share'] > C.DRIFT_MAX_DRIFTED_SHARE
+    if summary['drifted_columns']:
+        log.warning(('Data Drift', summary['drifted_columns'][:10]))
+
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': check_drift.__name__,
+        'reference': reference_path if reference is not None else None,
+        'row_count': profile.row_count,
+        'reference_row_count': reference.row_count
+        if reference is not None else None,
+        **summary,
+        'drift_detected': drift_detected,
+        'drift': drift,
+        'status': True,
+        'duration': duration,
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    log.info('Data Drift Check Completed')
+    return result
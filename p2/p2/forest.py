@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+import sklearn
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+log = logging.getLogger(__name__)
+
+"""
+Compact Random Forest.
+
+The trees of a fitted `RandomForestClassifier` flattened into one set of
+node arrays, the only state needed to predict. Arrays are plain NumPy, so
+a joblib artifact stores them uncompressed and `joblib.load(mmap_mode='r')`
+maps them instead of reading them, and processes loading the same
+artifact share its pages. Refer to artifact.py.
+
+Layout, for all trees together:
+
+- Internal nodes of every tree first, then the leaves of every tree.
+  Tree `i` starts at node `roots[i]` and is `depths[i]` levels deep.
+- `feature`, `threshold` and `children` (left, right) per node. A row
+  goes left if its `feature` value is <= `threshold`. A leaf has
+  threshold +inf and points to itself on both sides.
+- `value` holds the class probabilities of leaf `n - n_internal`.
+
+Prediction walks every tree for every row together, one level per step:
+a (row, tree) node vector is advanced with vectorized gathers, and pairs
+that reached a leaf drop out. There is no per tree Python dispatch or
+per call input validation, so small batches score far faster than the
+forest's `predict_proba`. Refer to benchmarks/bench_forest_latency.py.
+"""
+
+# Rows walked together, bounds the (row, tree) node vectors
+BLOCK_ROWS = 8192
+# scikit-learn 1.4+ stores class fractions in `tree_.value` and predicts
+# them as they are, earlier versions store counts and normalize them
+_VALUE_NORMALIZED = tuple(
+    int(v) for v in sklearn.__version__.split('.')[:2]) >= (1, 4)
+
+
+class CompactForest(ClassifierMixin, BaseEstimator):
+
+    def __init__(self, threshold_dtype='float64', prune_tolerance=None):
+        """
+        Parameters:
+            threshold_dtype (str):
+                Optional. `float32` halves the threshold array. Thresholds
+                are rounded down to float32, so predictions stay the same
+                as the forest's, which compares float32 features.
+
+            prune_tolerance (float):
+                Optional. Merge two sibling leaves into their parent if
+                their class probabilities differ by at most this much.
+                0 only merges leaves with the same probabilities and keeps
+                predictions unchanged. No pruning if value is None.
+        """
+        self.threshold_dtype = threshold_dtype
+        self.prune_tolerance = prune_tolerance
+
+    @classmethod
+    def from_forest(cls, forest, **params):
+        """
+        Compact a fitted `RandomForestClassifier`.
+        """
+        compact = cls(**params)
+        if forest.n_outputs_ != 1:
+            raise ValueError('Only single output forests are supported')
+        trees = [compact._tree_arrays(e.tree_) for e in forest.estimators_]
+        n_internal = sum(len(t['feature']) for t in trees)
+        n_leaves = sum(len(t['value']) for t in trees)
+        internal_start = np.cumsum([0] + [len(t['feature'])
+                                          for t in trees])[:-1]
+        leaf_start = n_internal + np.cumsum(
+            [0] + [len(t['value']) for t in trees])[:-1]
+
+        threshold = np.full(n_internal + n_leaves, np.inf,
+                            dtype=compact.threshold_dtype)
+        feature = np.zeros(n_internal + n_leaves, dtype=np.int32)
+        # Leaves point to themselves
+        children = np.repeat(np.arange(n_internal + n_leaves,
+                                       dtype=np.int32)[:, None], 2, axis=1)
+        roots = np.empty(len(trees), dtype=np.int32)
+        for tree, i_start, l_start in zip(trees, internal_start, leaf_start):
+            # Tree local ids: internal nodes 0.., then leaves
+            n_tree_internal = len(tree['feature'])
+            offset = np.where(tree['children'] < n_tree_internal, i_start,
+                              l_start - n_tree_internal)
+            stop = i_start + n_tree_internal
+            feature[i_start:stop] = tree['feature']
+            threshold[i_start:stop] = tree['threshold']
+            children[i_start:stop] = tree['children'] + offset
+        for i, (tree, i_start, l_start) in enumerate(
+                zip(trees, internal_start, leaf_start)):
+            roots[i] = i_start if len(tree['feature']) else l_start
+
+        compact.feature_ = feature
+        compact.threshold_ = threshold
+        compact.children_ = children
+        compact.value_ = np.concatenate([t['value'] for t in trees])
+        compact.roots_ = roots
+        compact.depths_ = np.array([t['depth'] for t in trees],
+                                   dtype=np.int32)
+        compact.n_internal_ = n_internal
+        compact.classes_ = forest.classes_
+        compact.n_features_in_ = forest.n_features_in_
+        compact.feature_importances_ = forest.feature_importances_
+        compact.n_forest_nodes_ = sum(e.tree_.node_count
+                                      for e in forest.estimators_)
+        log.debug(('Compact Forest', len(roots), compact.n_forest_nodes_,
+                   compact.n_nodes_, compact.nbytes))
+        return compact
+
+    @property
+    def n_nodes_(self):
+        return len(self.feature_)
+
+    @property
+    def left_(self):
+        return self.children_[:, 0]
+
+    @property
+    def right_(self):
+        return self.children_[:, 1]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in _ARRAYS)
+
+    def fit(self, X, y):
+        raise TypeError('CompactForest is not trained, build it from a '
+                        'fitted forest with `CompactForest.from_forest`')
+
+    def apply(self, X):
+        """
+        Leaf reached in every tree.
+
+        Returns:
+            leaves (ndarray):
+                (n_rows, n_trees) leaf node ids
+        """
+        X = self._validate(X)
+        if X.shape[0] <= BLOCK_ROWS:
+            return self._walk(X)
+        return np.concatenate([self._walk(X[start:start + BLOCK_ROWS])
+                               for start in range(0, X.shape[0], BLOCK_ROWS)])
+
+    def predict_proba(self, X):
+        """
+        Mean class probabilities of the trees, as the forest's.
+        """
+        leaves = self.apply(X) - self.n_internal_
+        proba = np.zeros((leaves.shape[0], len(self.classes_)))
+        # Summed tree by tree, in the forest's order, so the result is
+        # bit for bit the forest's
+        for i in range(leaves.shape[1]):
+            proba += self.value_[leaves[:, i]]
+        proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+    def _validate(self, X):
+        # Trees compare float32 features, as the forest does
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError('Expected {} features, got {}'.format(
+                self.n_features_in_, X.shape[1:]))
+        return X
+
+    def _walk(self, X):
+        """
+        Walk all trees for all rows of `X` together, level by level, until
+        every (row, tree) pair is at a leaf.
+        """
+        n_rows, n_trees = X.shape[0], len(self.roots_)
+        node = np.tile(np.asarray(self.roots_), n_rows)
+        # Position of the row of every pair in the flat `X`
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.intp) * X.shape[1],
+                               n_trees)
+        X = X.ravel()
+        children = np.asarray(self.children_).ravel()
+        active = np.flatnonzero(node < self.n_internal_)
+        while len(active):
+            parent = node[active]
+            go_right = X[row_offset[active] + self.feature_[parent]] > \
+                self.threshold_[parent]
+            child = children[2 * parent + go_right]
+            node[active] = child
+            active = active[child < self.n_internal_]
+        return node.reshape(n_rows, n_trees)
+
+    def _tree_arrays(self, tree):
+        """
+        Node arrays of one tree, pruned, internal nodes first.
+        """
+        left = tree.children_left
+        right = tree.children_right
+        # Normalized as `DecisionTreeClassifier.predict_proba` does
+        proba = tree.value[:, 0, :]
+        if not _VALUE_NORMALIZED:
+            normalizer = proba.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            proba = proba / normalizer
+        is_leaf = left == -1
+        if self.prune_tolerance is not None:
+            is_leaf = _prune(left, right, proba, is_leaf,
+                             self.prune_tolerance)
+
+        # Reachable nodes level by level from the root
+        levels = [np.array([0])]
+        while True:
+            parents = levels[-1][~is_leaf[levels[-1]]]
+            if len(parents) == 0:
+                break
+            levels.append(np.stack([left[parents], right[parents]],
+                                   axis=1).ravel())
+        nodes = np.concatenate(levels)
+        internal = nodes[~is_leaf[nodes]]
+        leaves = nodes[is_leaf[nodes]]
+        new_id = np.empty(len(left), dtype=np.int64)
+        new_id[internal] = np.arange(len(internal))
+        new_id[leaves] = len(internal) + np.arange(len(leaves))
+
+        threshold = tree.threshold[internal]
+        if np.dtype(self.threshold_dtype) == np.float32:
+            threshold = _round_down_float32(threshold)
+        return {
+            'feature': tree.feature[internal],
+            'threshold': threshold,
+            'children': np.stack([new_id[left[internal]],
+                                  new_id[right[internal]]], axis=1),
+            'value': proba[leaves],
+            'depth': len(levels) - 1
+        }
+
+    def __getstate__(self):
+        # Memory-mapped arrays are pickled as a reference to their file,
+        # so a scoring worker maps the same pages instead of a copy
+        state = self.__dict__.copy()
+        for name in _ARRAYS:
+            array = state.get(name)
+            if isinstance(array, np.memmap) and array.filename:
+                state[name] = _MemmapReference(array)
+        return state
+
+    def __setstate__(self, state):
+        for name, array in state.items():
+            if isinstance(array, _MemmapReference):
+                state[name] = array.open()
+        self.__dict__.update(state)
+
+
+_ARRAYS = ('feature_', 'threshold_', 'children_', 'value_', 'roots_',
+           'depths_')
+
+
+class _MemmapReference:
+
+    def __init__(self, array):
+        self.filename = array.filename
+        self.offset = array.offset
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.order = 'F' if array.flags.f_contiguous and \
+            not array.flags.c_contiguous else 'C'
+
+    def open(self):
+        return np.memmap(self.filename, dtype=self.dtype, mode='r',
+                         offset=self.offset, shape=self.shape,
+                         order=self.order)
+
+
+def _prune(left, right, proba, is_leaf, tolerance):
+    """
+    Merge sibling leaves with class probabilities within `tolerance` into
+    their parent, which becomes a leaf, until no pair is left.
+    """
+    is_leaf = is_leaf.copy()
+    while True:
+        internal = np.flatnonzero(~is_leaf)
+        internal = internal[is_leaf[left[internal]] &
+                            is_leaf[right[internal]]]
+        difference = np.abs(proba[left[internal]] -
+                            proba[right[internal]]).max(axis=1)
+        merged = internal[difference <= tolerance]
+        if len(merged) == 0:
+            return is_leaf
+        is_leaf[merged] = True
+
+
+def _round_down_float32(threshold):
+    """
+    Largest float32 <= each threshold. For float32 `x`,
+    `x <= threshold` and `x <= _round_down_float32(threshold)` agree.
+    """
+    rounded = threshold.astype(np.float32)
+    above = rounded > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
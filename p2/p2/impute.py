@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from . import const as C
+from .sketch import QuantileSketch
+
+log = logging.getLogger(__name__)
+
+
+class MedianImputer(TransformerMixin, BaseEstimator):
+    """
+    Median Imputer fitted through a quantile sketch.
+
+    Fills NaN with the approximate median of each column, like
+    `SimpleImputer(strategy='median')`. Rows are summarized a chunk at a
+    time, so it can be fitted with `partial_fit` over data that does not
+    fit in memory. Columns without a value are kept and filled with 0.
+
+    Medians are taken from the sketch on first use of `statistics_` after
+    a fit, not after every `partial_fit` chunk. The sketch is not pickled.
+    `statistics_` is kept, and a `partial_fit` after loading starts a new
+    sketch.
+    """
+
+    def __init__(self, sketch_size=C.SKETCH_SIZE,
+                 chunk_size=C.DATA_FETCH_CHUNK_SIZE, copy=True):
+        """
+        Parameters:
+            sketch_size (int):
+                Optional. Refer to `QuantileSketch`.
+
+            chunk_size (int):
+                Optional. Rows summarized at once by `fit`.
+
+            copy (bool):
+                Optional. Impute a copy of the input. Impute in place if
+                value is False and the input is a float array.
+        """
+        self.sketch_size = sketch_size
+        self.chunk_size = chunk_size
+        self.copy = copy
+
+    @classmethod
+    def from_sketch(cls, sketch, **params):
+        """
+        Imputer fitted on the rows summarized by `sketch`.
+        """
+        imputer = cls(sketch_size=sketch.size, **params)
+        imputer.sketch_ = sketch
+        return imputer._reset_statistics()
+
+    def fit(self, X, y=None):
+        self.sketch_ = QuantileSketch(self.sketch_size)
+        for start in range(0, len(X), self.chunk_size):
+            self.sketch_.update(X[start:start + self.chunk_size])
+        return self._reset_statistics()
+
+    def partial_fit(self, X, y=None):
+        if getattr(self, 'sketch_', None) is None:
+            self.sketch_ = QuantileSketch(self.sketch_size)
+        self.sketch_.update(X)
+        return self._reset_statistics()
+
+    @property
+    def statistics_(self):
+        """
+        Median per column, 0 for columns without a value.
+        """
+        if getattr(self, '_statistics', None) is None:
+            if getattr(self, 'sketch_', None) is None:
+                raise AttributeError('MedianImputer is not fitted')
+            self._statistics = np.nan_to_num(self.sketch_.median(),
+                                             nan=0.0)
+        return self._statistics
+
+    @statistics_.setter
+    def statistics_(self, statistics):
+        self._statistics = statistics
+
+    def transform(self, X):
+        dtype = np.result_type(np.asarray(X).dtype, np.float32)
+        X = np.array(X, dtype=dtype) if self.copy \
+            else np.asarray(X, dtype=dtype)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError('X has {} features, imputer expects {}'.format(
+                X.shape[1], self.n_features_in_))
+        rows, cols = np.nonzero(np.isnan(X))
+        X[rows, cols] = self.statistics_[cols]
+        return X
+
+    def save_statistics(self, path, columns, source=None):
+        """
+        Persist the fitted medians by column as JSON.
+
+        Parameters:
+            path (str):
+                Statistics file.
+
+            columns (list):
+                Column name per feature.
+
+            source (str):
+                Optional. Identifies the data the imputer was fitted on.
+                Refer to `load_statistics`.
+        """
+        statistics = {
+            'source': source,
+            'sketch_size': self.sketch_size,
+            'median': dict(zip(columns, self.statistics_.tolist()))
+        }
+        sketch = getattr(self, 'sketch_', None)
+        if sketch is not None:
+            statistics['count'] = dict(zip(columns, sketch.count.tolist()))
+            statistics['nan_count'] = dict(zip(columns,
+                                               sketch.nan_count.tolist()))
+        with open(path, 'w') as f:
+            json.dump(statistics, f)
+
+    @classmethod
+    def load_statistics(cls, path, columns, source=None, **params):
+        """
+        Imputer with medians persisted by `save_statistics`.
+
+        Returns:
+            imputer (MedianImputer):
+                None if there is no statistics file, or it was fitted on
+                another `source` or misses one of `columns`.
+        """
+        try:
+            with open(path) as f:
+                statistics = json.load(f)
+        except (OSError, ValueError):
+            return None
+        median = statistics['median']
+        if statistics['source'] != source or \
+                not all(c in median for c in columns):
+            return None
+        imputer = cls(**params)
+        imputer.statistics_ = np.array([median[c] for c in columns])
+        imputer.n_features_in_ = len(columns)
+        return imputer
+
+    def __getstate__(self):
+        # A copy, on Python 3.11+ the state is the instance `__dict__`
+        state = dict(super().__getstate__())
+        # Medians are kept, the sketch is not
+        if state.pop('sketch_', None) is not None:
+            state['_statistics'] = self.statistics_
+        return state
+
+    def __setstate__(self, state):
+        # Imputers pickled before the medians were computed lazily
+        if 'statistics_' in state:
+            state['_statistics'] = state.pop('statistics_')
+        super().__setstate__(state)
+
+    def _reset_statistics(self):
+        # The sketch changed, medians are taken from it on next use
+        self._statistics = None
+        self.n_features_in_ = self.sketch_.n_columns
+        return self
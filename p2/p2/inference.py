@@ -1,15 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import pickle
+import asyncio
+import contextlib
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import joblib
 import numpy as np
 import pandas as pd
+from sklearn.pipeline import Pipeline
+from . import artifact
 from . import const as C
+from . import db
+from . import drift
+from . import instrument
 from . import util as ut
-from sqlalchemy import create_engine
-from sklearn.impute import SimpleImputer
+from .scoring import ParallelScorer
+from sqlalchemy import inspect, text
 
 
 log = logging.getLogger(__name__)
@@ -17,69 +25,752 @@ log = logging.getLogger(__name__)
 
 def batch_inference(model_save_path=C.MD_FILE_PATH,
                     model_override=None,
-                    is_test=False):
+                    is_test=False,
+                    chunk_size=None,
+                    incremental=False,
+                    n_workers=C.INF_N_WORKERS,
+                    feature_columns=None):
     """
     Model inference.
     Fetch Batch Input Data from MSSQL and store the result back to DB.
 
+    Result table holds the row key `C.DB_KEY_COLUMN`, the prediction
+    `target`, its `probability` and the `model_version`. Rows are keyed by
+    their position in the input if the source table has no key column.
+    Rows are written to a staging table that replaces the result table
+    once every row is written, except incremental runs that upsert into
+    the existing result table.
+
     Parameters:
         model_save_path (str):
             Model file that save during model building.
 
-        model_override (str):
-            Model overrride.
+        model_override (Pipeline):
+            Model overrride. Fitted Imputer, Scaler and Classifier pipeline.
             `model_save_path` will be ignored if value is not None.
 
         is_test (bool):
             To skip save result in DB if value is true.
             For Unit Test purpose
 
+        chunk_size (int):
+            Optional. Stream the input table in chunks of `chunk_size` rows
+            and append each scored chunk to the result table.
+            The whole table is loaded at once if value is None.
+
+        incremental (bool):
+            Only score rows past the watermark of the previous run and
+            upsert them into the result table. Always streams, using
+            `C.INF_CHUNK_SIZE` if `chunk_size` is not given.
+
+        n_workers (int):
+            Optional. Scoring worker processes. Input rows are split into
+            shards and scored across a process pool. -1 for all CPU cores.
+            (Default value refer to const.py)
+
+        feature_columns (list):
+            Optional. Feature columns of `model_override`.
+            Only these columns are selected from DB. Taken from the model
+            artifact if `model_override` is None.
+
     Returns:
         result (dict):
             Dictionary with metrics and status
 
         y
+
+        df (DataFrame):
+            Result rows as written to DB. None in streaming mode.
     """
     log.info('Batch Inference Start')
+    with instrument.span('batch_inference') as stage_span:
+        model, model_version, feature_columns = \
+            _load_model(model_save_path, model_override, feature_columns)
+
+        sqlEngine = db.get_engine()
+        key_columns = _key_columns(sqlEngine, incremental)
+        select_sql = _select_sql(sqlEngine, feature_columns, key_columns)
+        with ParallelScorer(model, n_workers) as scorer:
+            if incremental or chunk_size:
+                result, y, df = _batch_inference_stream(
+                    scorer, model_version, sqlEngine, select_sql,
+                    chunk_size or C.INF_CHUNK_SIZE, is_test,
+                    incremental=incremental)
+            else:
+                result, y, df = _batch_inference_full(
+                    scorer, model_version, sqlEngine, select_sql, is_test)
+    result['peak_rss_mb'] = stage_span.record['peak_rss_mb']
+    log.info('Batch Inference Completed')
+    return result, y, df
+
+
+async def batch_inference_async(model_save_path=C.MD_FILE_PATH,
+                                model_override=None,
+                                is_test=False,
+                                chunk_size=C.INF_CHUNK_SIZE,
+                                n_workers=C.INF_N_WORKERS,
+                                feature_columns=None,
+                                queue_size=C.INF_QUEUE_SIZE):
+    """
+    Overlapped Streaming Batch Inference.
+
+    DB read, scoring and DB write run as three stages connected by
+    bounded queues, each on its own thread. Chunk N+1 is fetched while
+    chunk N is scored and chunk N-1 is written, so wall time approaches
+    the slowest stage rather than the sum of all three. A full queue
+    pauses the stage feeding it, so at most `queue_size` chunks wait
+    between two stages.
+
+    Parameters:
+        Refer to `batch_inference`. Incremental runs are not supported.
+
+        queue_size (int):
+            Optional. Chunks buffered between two stages.
+            (Default value refer to const.py)
+
+    Returns:
+        result (dict):
+            Dictionary with metrics and status. `stage_seconds` holds the
+            busy time of each stage.
+
+        y
+    """
+    log.info('Batch Inference Start')
+    with instrument.span('batch_inference_async') as stage_span:
+        model, model_version, feature_columns = \
+            _load_model(model_save_path, model_override, feature_columns)
+        sqlEngine = db.get_engine()
+        select_sql = _select_sql(sqlEngine, feature_columns,
+                                 _key_columns(sqlEngine))
+        writer = db.ResultWriter(engine=sqlEngine)
+
+        loop = asyncio.get_running_loop()
+        scored = asyncio.Queue(maxsize=queue_size)
+        fetched = asyncio.Queue(maxsize=queue_size)
+        stage_seconds = {'read': 0.0, 'score': 0.0, 'write': 0.0}
+        y_chunks = []
+        time_start = time.time()
+
+        async def run_stage(stage, executor, func, *args):
+            stage_start = time.perf_counter()
+            value = await loop.run_in_executor(executor, func, *args)
+            stage_seconds[stage] += time.perf_counter() - stage_start
+            return value
+
+        async def read(executor):
+            chunks = db.read_sql_chunks(select_sql, chunk_size,
+                                        engine=sqlEngine)
+            row_count = 0
+            try:
+                while True:
+                    df = await run_stage('read', executor, next, chunks, None)
+                    if df is None:
+                        break
+                    _set_key_index(df, row_count)
+                    _drop_non_features(df)
+                    row_count += df.shape[0]
+                    await fetched.put(df)
+            finally:
+                await loop.run_in_executor(executor, chunks.close)
+            await fetched.put(None)
+
+        async def score(executor):
+            while True:
+                df = await fetched.get()
+                if df is None:
+                    break
+                y, probability = await run_stage('score', executor, _predict,
+                                                 scorer, df.values)
+                y_chunks.append(y)
+                await scored.put(
+                    _result_frame(df, y, probability, model_version))
+            await scored.put(None)
+
+        async def write(executor):
+            while True:
+                df = await scored.get()
+                if df is None:
+                    break
+                if not is_test:
+                    await loop.run_in_executor(executor, writer.write, df)
+            if not is_test:
+                await loop.run_in_executor(executor, writer.commit)
+            stage_seconds['write'] = writer.write_seconds
+
+        executors = [ThreadPoolExecutor(max_workers=1) for _ in range(3)]
+        with ParallelScorer(model, n_workers) as scorer:
+            tasks = [asyncio.ensure_future(stage(executor)) for stage, executor
+                     in zip([read, score, write], executors)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Unblock the stages waiting on a queue of the failed one and
+                # let them clean up before the executors go away
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                for executor in executors:
+                    executor.shutdown()
+
+    y = np.concatenate(y_chunks) if y_chunks else np.empty(0)
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': batch_inference_async.__name__,
+        'data_output_shape': y.shape,
+        'model_version': model_version,
+        'n_workers': scorer.n_workers,
+        'chunk_size': chunk_size,
+        'chunk_count': len(y_chunks),
+        'status': y.shape[0] > 0,
+        'duration': duration,
+        'rows_per_sec': _rows_per_sec(y.shape[0], time_start),
+        'stage_seconds': {k: round(v, 3) for k, v in stage_seconds.items()},
+        'write_method': writer.method,
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    log.info('Batch Inference Completed')
+    return result, y
+
+
+def compare_models(model_save_paths,
+                   is_test=False,
+                   chunk_size=None,
+                   n_workers=C.INF_N_WORKERS):
+    """
+    Champion / Challenger Scoring.
+    Score several models in one pass over the input table.
+
+    The input is read once, with the union of the model feature columns.
+    Models whose preprocessing (imputer, scaler) and feature columns are
+    identical share a single transform. Every model scores the same
+    in-memory rows, and the predictions are written side by side to
+    `C.DB_COMPARE_TABLE`, one `target_<model_version>` (and
+    `probability_<model_version>`) column per model.
+
+    Parameters:
+        model_save_paths (list):
+            Model artifacts. The first is the champion the others are
+            compared with.
+
+        is_test (bool):
+            To skip save result in DB if value is true.
+            For Unit Test purpose
+
+        chunk_size (int):
+            Optional. Stream the input table in chunks of `chunk_size` rows.
+            The whole table is loaded at once if value is None.
+
+        n_workers (int):
+            Optional. Scoring worker processes per model.
+            (Default value refer to const.py)
+
+    Returns:
+        result (dict):
+            Dictionary with metrics and status. `models` holds, per model,
+            the agreement of its predictions with the champion's, the peak
+            RSS while it scored and, if the input has a `target` column,
+            its accuracy and accuracy delta against the champion.
+
+        y (ndarray):
+            (n_rows, n_models) predictions
+
+        df (DataFrame):
+            Result rows as written to DB. None in streaming mode.
+    """
+    log.info('Compare Models Start')
+    time_start = time.time()
+    if not model_save_paths:
+        raise ValueError('No Model to compare')
+    models = [_load_model(path, None, None) for path in model_save_paths]
+    versions = [model_version for _, model_version, _ in models]
+    if len(set(versions)) != len(versions):
+        raise ValueError('Model versions are not unique: {}'.format(versions))
+
+    sqlEngine = db.get_engine()
+    feature_columns = None
+    if all(columns is not None for _, _, columns in models):
+        feature_columns = list(dict.fromkeys(
+            c for _, _, columns in models for c in columns))
+    has_label = 'target' in _source_columns(sqlEngine)
+    select_sql = _select_sql(sqlEngine, feature_columns,
+                             _key_columns(sqlEngine) +
+                             (['target'] if has_label else []))
+    groups = _preprocessing_groups(models)
+    y_dtype = np.result_type(*[model.classes_ for model, _, _ in models])
+    log.debug(('Compare Models', versions, 'Preprocessing Groups',
+               len(groups)))
+
+    writer = db.ResultWriter(table=C.DB_COMPARE_TABLE, engine=sqlEngine)
+    row_count = 0
+    col_count = 0
+    model_peaks = [0.0] * len(models)
+    y_chunks = []
+    label_chunks = []
+    df_result = None
+    stage_seconds = {'preprocess': 0.0, 'score': 0.0}
+    with contextlib.ExitStack() as stack:
+        stage_span = stack.enter_context(instrument.span('compare_models'))
+        scorers = {i: stack.enter_context(ParallelScorer(classifier,
+                                                         n_workers))
+                   for _, _, members in groups for i, classifier in members}
+        if chunk_size:
+            chunks = db.read_sql_chunks(select_sql, chunk_size,
+                                        engine=sqlEngine)
+        else:
+            with sqlEngine.connect() as db_connection:
+                chunks = [pd.read_sql(text(select_sql), db_connection)]
+
+        span = stack.enter_context(instrument.span('compare_models.score'))
+        for df in chunks:
+            log.debug(('Chunk', row_count, df.shape))
+            span.add(rows=df.shape[0], bytes_read=_frame_bytes(df))
+            if has_label:
+                label_chunks.append(df.pop('target').values)
+            _set_key_index(df, row_count)
+            _drop_non_features(df)
+            df_result = pd.DataFrame(index=df.index)
+            y = np.empty((df.shape[0], len(models)), dtype=y_dtype)
+            for preprocessing, columns, members in groups:
+                stage_start = time.perf_counter()
+                X = df[columns].values if columns is not None else df.values
+                if preprocessing is not None:
+                    X = preprocessing.transform(X)
+                stage_seconds['preprocess'] += \
+                    time.perf_counter() - stage_start
+                for i, _ in members:
+                    # Every model scores in its own span, for its peak RSS
+                    with instrument.span('compare_models.score.{}'.format(
+                            versions[i]), rows=X.shape[0]) as model_span:
+                        y[:, i], probability = _predict(scorers[i], X)
+                    stage_seconds['score'] += model_span.record['seconds']
+                    model_peaks[i] = max(model_peaks[i],
+                                         model_span.record['peak_rss_mb'])
+                    df_result['target_{}'.format(versions[i])] = y[:, i]
+                    if probability is not None:
+                        df_result['probability_{}'.format(versions[i])] = \
+                            probability
+            row_count += df.shape[0]
+            col_count = df.shape[1]
+            if not is_test:
+                span.add(bytes_written=_frame_bytes(df_result))
+                writer.write(df_result)
+            y_chunks.append(y)
+        if not is_test:
+            writer.commit()
+
+    y = np.concatenate(y_chunks) if y_chunks \
+        else np.empty((0, len(models)), dtype=y_dtype)
+    labels = np.concatenate(label_chunks) if has_label and label_chunks \
+        else None
+    comparison = _compare(y, labels, versions)
+    for model, peak_rss_mb in zip(comparison, model_peaks):
+        model['peak_rss_mb'] = peak_rss_mb
+    for model in comparison:
+        log.info(('Compare Models', model))
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': compare_models.__name__,
+        'data_input_shape': (row_count, col_count),
+        'data_output_shape': y.shape,
+        'champion': versions[0],
+        'models': comparison,
+        'preprocessing_count': len(groups),
+        'stage_seconds': {k: round(v, 3) for k, v in stage_seconds.items()},
+        'n_workers': n_workers,
+        'chunk_size': chunk_size,
+        'chunk_count': len(y_chunks),
+        'status': row_count > 0 and y.shape == (row_count, len(models)),
+        'duration': duration,
+        'rows_per_sec': _rows_per_sec(row_count, time_start),
+        'write_method': writer.method,
+        'write_seconds': round(writer.write_seconds, 3),
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    log.info('Compare Models Completed')
+    return result, y, None if chunk_size else df_result
+
+
+def _load_model(model_save_path, model_override, feature_columns):
+    """
+    Model, its version and feature columns. From the artifact unless
+    `model_override` is given.
+    """
     if model_override is not None:
-        model = model_override
+        return model_override, None, feature_columns
+    model_artifact = artifact.load_model(model_save_path)
+    return (model_artifact['model'], model_artifact['model_version'],
+            model_artifact.get('feature_columns'))
+
+
+def _preprocessing_groups(models):
+    """
+    Models grouped by identical preprocessing steps and feature columns,
+    so the input is transformed once per group rather than per model.
+
+    Returns:
+        groups (list):
+            (preprocessing, feature_columns, [(model index, classifier)])
+            per group. `preprocessing` is None for a bare classifier.
+    """
+    groups = {}
+    for i, (model, _, columns) in enumerate(models):
+        preprocessing, classifier = None, model
+        if isinstance(model, Pipeline) and len(model.steps) > 1:
+            preprocessing, classifier = model[:-1], model.steps[-1][1]
+        key = _preprocessing_key(preprocessing, columns)
+        groups.setdefault(key, (preprocessing, columns, []))[2].append(
+            (i, classifier))
+    return list(groups.values())
+
+
+def _preprocessing_key(preprocessing, columns):
+    """
+    Hash of the fitted preprocessing steps. Memory-mapped arrays of a
+    compact artifact hash as the same plain arrays.
+    """
+    if preprocessing is None:
+        return joblib.hash((None, columns))
+    return joblib.hash((columns, [
+        (name, type(step).__name__, {
+            k: np.asarray(v) if isinstance(v, np.ndarray) else v
+            for k, v in vars(step).items()})
+        for name, step in preprocessing.steps]))
+
+
+def _compare(y, labels, versions):
+    """
+    Agreement of every model with the champion, the first model, and
+    accuracy against `labels` if given.
+    """
+    comparison = []
+    for i, model_version in enumerate(versions):
+        model = {'model_version': model_version,
+                 'agreement': _fraction(y[:, i] == y[:, 0])}
+        if labels is not None:
+            model['accuracy'] = _fraction(y[:, i] == labels)
+            champion = comparison[0]['accuracy'] if comparison \
+                else model['accuracy']
+            model['accuracy_delta'] = None if champion is None \
+                else model['accuracy'] - champion
+        comparison.append(model)
+    return comparison
+
+
+def _fraction(matches):
+    return float(matches.mean()) if len(matches) else None
+
+
+def _select_sql(sqlEngine, feature_columns, key_columns=()):
+    """
+    Input query. Only the model feature columns (and key columns) are
+    selected, so unused columns are never transferred from DB.
+    """
+    if feature_columns is None:
+        return f'select * from {C.DB_SOURCE_TABLE}'
+    quote = sqlEngine.dialect.identifier_preparer.quote
+    columns = list(dict.fromkeys(list(key_columns) + list(feature_columns)))
+    return 'select {} from {}'.format(', '.join(quote(c) for c in columns),
+                                      C.DB_SOURCE_TABLE)
+
+
+def _batch_inference_full(scorer, model_version, sqlEngine, select_sql,
+                          is_test):
+    """
+    Batch Inference over the whole input table loaded at once.
+    """
+    # Fetch input from DB
+    time_start = time.time()
+    with instrument.span('batch_inference.read') as span:
+        with sqlEngine.connect() as db_connection:
+            df = pd.read_sql(text(select_sql), db_connection)
+        span.add(rows=df.shape[0], bytes_read=_frame_bytes(df))
+    _set_key_index(df, 0)
+    _drop_non_features(df)
+    input_shape = df.shape
+    profile = _input_profile()
+    if profile is not None:
+        profile.update(df)
+
+    # Fill NA, Scale and Predict with the fitted pipeline
+    with instrument.span('batch_inference.score', rows=df.shape[0]):
+        y, probability = _predict(scorer, df.values)
+    df = _result_frame(df, y, probability, model_version)
+
+    # Store Result back to DB
+    writer = db.ResultWriter(engine=sqlEngine)
+    if not is_test:
+        with instrument.span('batch_inference.write', rows=df.shape[0],
+                             bytes_written=_frame_bytes(df)):
+            writer.write(df)
+            writer.commit()
+
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': batch_inference.__name__,
+        'data_input_shape': input_shape,
+        'data_output_shape': y.shape,
+        'model_version': model_version,
+        'n_workers': scorer.n_workers,
+        'status': (input_shape[0] > 0 and input_shape[1] > 0 and
+                   y is not None and y.shape[0] > 0),
+        'duration': duration,
+        'rows_per_sec': _rows_per_sec(input_shape[0], time_start),
+        'write_method': writer.method,
+        'write_seconds': round(writer.write_seconds, 3),
+        'drift': _input_drift(profile),
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    return result, y, df
+
+
+def _batch_inference_stream(scorer, model_version, sqlEngine, select_sql,
+                            chunk_size, is_test, incremental=False):
+    """
+    Streaming Batch Inference.
+    Read the input table through a server-side cursor `chunk_size` rows at
+    a time, so peak memory is bounded by the chunk rather than the table.
+
+    In incremental mode only rows past the stored watermark are read and
+    the scored rows are upserted on `C.DB_KEY_COLUMN`.
+    """
+    time_start = time.time()
+    # First run writes a whole new result table, later incremental runs
+    # upsert into it
+    upsert = incremental and _get_watermark(sqlEngine) is not None
+    writer = db.ResultWriter(engine=sqlEngine, atomic=not upsert)
+    row_count = 0
+    col_count = 0
+    y_chunks = []
+    profile = _input_profile()
+
+    sql = select_sql
+    params = None
+    watermark = _get_watermark(sqlEngine) if incremental else None
+    new_watermark = watermark
+    if watermark is not None:
+        sql += f' where {C.DB_WATERMARK_COLUMN} > :watermark'
+        params = {'watermark': watermark}
+    log.debug(('Inference Query', sql, params))
+
+    chunks = db.read_sql_chunks(sql, chunk_size, params, sqlEngine)
+    with instrument.span('batch_inference.stream') as span:
+        for df in chunks:
+            log.debug(('Chunk', row_count, df.shape))
+            span.add(rows=df.shape[0], bytes_read=_frame_bytes(df))
+            if incremental:
+                chunk_watermark = _to_sql_param(
+                    df[C.DB_WATERMARK_COLUMN].max())
+                if new_watermark is None or chunk_watermark > new_watermark:
+                    new_watermark = chunk_watermark
+            _set_key_index(df, row_count)
+            _drop_non_features(df)
+            if profile is not None:
+                profile.update(df)
+
+            # Fill NA, Scale and Predict with the fitted pipeline
+            y, probability = _predict(scorer, df.values)
+            row_count += df.shape[0]
+            col_count = df.shape[1]
+            df = _result_frame(df, y, probability, model_version)
+
+            # Store Result back to DB. Streaming cursor holds the read
+            # connection, so the writer uses a separate one.
+            if not is_test:
+                span.add(bytes_written=_frame_bytes(df))
+                if upsert:
+                    writer.upsert(df)
+                else:
+                    writer.write(df)
+
+            y_chunks.append(y)
+
+        # Swap in the result table and move the watermark only once every
+        # chunk has been stored
+        if not is_test:
+            writer.commit()
+        if incremental and not is_test and new_watermark != watermark:
+            _set_watermark(sqlEngine, new_watermark)
+
+    y = np.concatenate(y_chunks) if y_chunks else np.empty(0)
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': batch_inference.__name__,
+        'data_input_shape': (row_count, col_count),
+        'data_output_shape': y.shape,
+        'model_version': model_version,
+        'n_workers': scorer.n_workers,
+        'chunk_size': chunk_size,
+        'chunk_count': len(y_chunks),
+        'status': (y.shape[0] == row_count and
+                   (incremental or row_count > 0 and col_count > 0)),
+        'duration': duration,
+        'rows_per_sec': _rows_per_sec(row_count, time_start),
+        'write_method': writer.method,
+        'write_seconds': round(writer.write_seconds, 3),
+        'drift': _input_drift(profile),
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    if incremental:
+        result['watermark'] = (watermark, new_watermark)
+    return result, y, None
+
+
+def _input_profile():
+    """
+    Profile of the input chunks with `C.INF_DATA_PROFILE`, binned as the
+    reference profile. Refer to drift.py
+    """
+    if not C.INF_DATA_PROFILE:
+        return None
+    return drift.DataProfile(reference=drift.load_profile(
+        C.DATA_PROFILE_REFERENCE_PATH))
+
+
+def _input_drift(profile):
+    """
+    Save the input profile of this run. Drift summary of the input against
+    the reference profile, None without one.
+    """
+    if profile is None:
+        return None
+    drift.save_profile(profile, 'inference')
+    reference = drift.load_profile(C.DATA_PROFILE_REFERENCE_PATH)
+    if reference is None:
+        return None
+    summary = drift.summarize(drift.compare(reference, profile))
+    if summary['drifted_columns']:
+        log.warning(('Inference Input Drift',
+                     summary['drifted_columns'][:10]))
+    return summary
+
+
+def _source_columns(sqlEngine):
+    return [c['name'] for c in
+            inspect(sqlEngine).get_columns(C.DB_SOURCE_TABLE)]
+
+
+def _key_columns(sqlEngine, incremental=False):
+    """
+    Columns selected besides the features. The key column if the source
+    table has it. Incremental inference needs both the key and watermark
+    columns.
+    """
+    columns = _source_columns(sqlEngine)
+    if not incremental:
+        return [C.DB_KEY_COLUMN] if C.DB_KEY_COLUMN in columns else []
+    key_columns = db.key_columns()
+    missing = [c for c in key_columns if c not in columns]
+    if missing:
+        raise ValueError(
+            'Incremental inference needs key / watermark columns {} in {}, '
+            'refer to DB_KEY_COLUMN and DB_WATERMARK_COLUMN in const.py'
+            .format(missing, C.DB_SOURCE_TABLE))
+    return key_columns
+
+
+def _set_key_index(df, row_count):
+    """
+    Key the rows by `C.DB_KEY_COLUMN`, or by their position in the input
+    if the source table has no key column. Either way the result table
+    keys rows by a `C.DB_KEY_COLUMN` column, whatever the mode.
+    """
+    if C.DB_KEY_COLUMN in df.columns:
+        df.set_index(C.DB_KEY_COLUMN, inplace=True)
     else:
-        ut.file_exists_check(model_save_path,
-                             error_msg='Model File not Found')
-        model = pickle.load(open(model_save_path, 'rb'))
+        # Keep the index continuous across chunks
+        df.index += row_count
+        df.index.name = C.DB_KEY_COLUMN
+
+
+def _drop_non_features(df):
+    """
+    Drop the label and, for a `select *` input, the key columns.
+    """
+    df.drop(['target'] + db.key_columns(), axis=1, inplace=True,
+            errors='ignore')
+
+
+def _frame_bytes(df):
+    """
+    In memory size of the DataFrame, counted as bytes read or written.
+    """
+    return int(df.memory_usage(index=True).sum())
+
 
-    sqlEngine = create_engine('mysql+pymysql://root:@127.0.0.1/micron',
-                              pool_recycle=3600)
+def _predict(scorer, X):
+    """
+    Predictions and, with `C.INF_RESULT_PROBABILITY`, the probability of
+    the predicted class. Both come from one `predict_proba` pass.
+    """
+    if not C.INF_RESULT_PROBABILITY:
+        return scorer.predict(X), None
+    proba = scorer.predict_proba(X)
+    # Same as predict of a forest, which takes the most probable class
+    y = scorer.model.classes_.take(proba.argmax(axis=1))
+    return y, proba.max(axis=1)
+
+
+def _result_frame(df, y, probability, model_version):
+    """
+    Rows written to the result table, keyed by the index of `df`.
+    Feature columns are only kept with `C.INF_RESULT_FEATURES`.
+    """
+    if not C.INF_RESULT_FEATURES:
+        df = pd.DataFrame(index=df.index)
+    df['target'] = y
+    if probability is not None:
+        df['probability'] = probability
+    df['model_version'] = model_version
+    return df
+
+
+def _get_watermark(sqlEngine):
+    """
+    Last watermark stored for the source table. None if never run.
+    """
+    if not inspect(sqlEngine).has_table(C.DB_STATE_TABLE):
+        return None
     with sqlEngine.connect() as db_connection:
-        # Fetch input from DB
-        time_start = time.time()
+        state = pd.read_sql(
+            text(f'select watermark from {C.DB_STATE_TABLE} '
+                 'where name = :name'),
+            db_connection,
+            params={'name': C.DB_SOURCE_TABLE})
+    if state.empty:
+        return None
+    return _to_sql_param(state['watermark'].iloc[0])
 
-        # TODO, To implment feature reduction and drop selecting all columns
-        df = pd.read_sql('select * from q6_data', db_connection)
-        df.drop(['target'], axis=1, inplace=True)
-        X = df
 
-        # Fill NA
-        imputer = SimpleImputer(missing_values=np.nan, strategy='median')
-        imputer.fit(X)
+def _set_watermark(sqlEngine, watermark):
+    log.debug(('Set Watermark', C.DB_SOURCE_TABLE, watermark))
+    state = pd.DataFrame({
+        'name': [C.DB_SOURCE_TABLE],
+        'watermark_column': [C.DB_WATERMARK_COLUMN],
+        'watermark': [watermark],
+        'updated_at': [pd.Timestamp.now()]
+    })
+    with sqlEngine.begin() as db_connection:
+        if inspect(db_connection).has_table(C.DB_STATE_TABLE):
+            db_connection.execute(
+                text(f'delete from {C.DB_STATE_TABLE} where name = :name'),
+                {'name': C.DB_SOURCE_TABLE})
+        state.to_sql(C.DB_STATE_TABLE, db_connection,
+                     if_exists='append', index=False)
 
-        X = imputer.transform(X)
-        y = model.predict(X)
-        df['target'] = y
 
-        # Store Result back to DB
-        if not is_test:
-            df.to_sql('q6_data_result', db_connection, if_exists='replace')
-
-        duration = ut.get_duration_msg(time_start)
-        result = {
-            'func_name': batch_inference.__name__,
-            'data_input_shape': df.shape,
-            'data_output_shape': y.shape,
-            'status': df.shape[0] > 0 and df.shape[1] > 0 and
-                      y is not None and y.shape[0] > 0,
-            'duration': duration,
-            'ram_usage_percent': ut.get_memroy_percent()
-        }
-        log.info('Batch Inference Completed')
-        return result, y, df
\ No newline at end of file
+def _to_sql_param(value):
+    # DB drivers do not bind numpy / pandas scalars
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _rows_per_sec(row_count, time_start):
+    elapsed = time.time() - time_start
+    return round(row_count / elapsed, 1) if elapsed > 0 else None
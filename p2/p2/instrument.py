@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import functools
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+from . import const as C
+from . import util as ut
+
+log = logging.getLogger(__name__)
+
+"""
+Stage and Sub-step Instrumentation.
+
+A span measures a block of code: wall time from the monotonic
+`perf_counter`, peak RSS, traced Python allocations if `trace_memory`
+is on, and counters such as rows and bytes read or written. Spans nest,
+every span is stored through `util.store_metric` with its parent, and
+the outermost span of a stage is profiled if a profiler is configured.
+
+Usage:
+    with instrument.span('process_data.impute', rows=len(df)) as s:
+        ...
+        s.add(bytes_written=os.path.getsize(path))
+
+    @instrument.timed('fetch')
+    def fetch(): ...
+"""
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_config = {
+    'profiler': None,
+    'profile_dir': C.PROFILE_DIR,
+    'trace_memory': False
+}
+
+# Open spans, innermost last
+_stack = []
+
+# Peak traced memory of open spans, kept across `tracemalloc.reset_peak`
+_open_trace_peaks = []
+
+
+def configure(profiler=None, profile_dir=C.PROFILE_DIR, trace_memory=False):
+    """
+    Parameters:
+        profiler (str):
+            Optional. `cprofile` or `pyinstrument` to profile every
+            outermost span. No profiling if value is None.
+
+        profile_dir (str):
+            Optional. Profile output. (Default value refer to const.py)
+
+        trace_memory (bool):
+            Optional. Trace Python allocations with tracemalloc. Slows
+            allocation heavy code down.
+    """
+    if profiler not in (None, ) + PROFILERS:
+        raise ValueError('Unknown profiler: {}'.format(profiler))
+    if profiler == 'pyinstrument':
+        _import_pyinstrument()
+    _config.update(profiler=profiler, profile_dir=profile_dir,
+                   trace_memory=trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+class Span:
+
+    def __init__(self, name, **counters):
+        self.name = name
+        self.counters = dict(counters)
+        self.parent = None
+        self.record = None
+        self._profiler = None
+
+    def add(self, **counters):
+        """
+        Add to counters. Ex. `rows`, `bytes_read`, `bytes_written`.
+        """
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def __enter__(self):
+        self.parent = _stack[-1].name if _stack else None
+        if not _stack and _config['profiler']:
+            self._profiler = _start_profiler(_config['profiler'])
+        _stack.append(self)
+        self._tracing = tracemalloc.is_tracing()
+        if self._tracing:
+            self._traced_start = tracemalloc.get_traced_memory()[0]
+            _start_trace_peak()
+        self._rss_start = ut.get_rss_mb()
+        ut.start_peak_rss()
+        self._time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._time_start
+        peak_rss_mb = ut.stop_peak_rss()
+        record = {
+            'name': self.name,
+            'parent': self.parent,
+            'status': exc_type is None,
+            'seconds': round(seconds, 6),
+            'rss_delta_mb': round(ut.get_rss_mb() - self._rss_start, 1),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'peak_rss_delta_mb': round(peak_rss_mb - self._rss_start, 1)
+        }
+        if self._tracing:
+            traced, traced_peak = _stop_trace_peak()
+            record.update(
+                traced_delta_mb=round(
+                    (traced - self._traced_start) / 1024 / 1024, 1),
+                traced_peak_delta_mb=round(
+                    (traced_peak - self._traced_start) / 1024 / 1024, 1))
+        record.update(self.counters)
+        if 'rows' in self.counters and seconds > 0:
+            record['rows_per_sec'] = round(self.counters['rows'] / seconds)
+        _stack.pop()
+        if self._profiler is not None:
+            record['profile_path'] = _stop_profiler(self._profiler, self.name)
+        self.record = record
+        log.debug(('Span', record))
+        ut.store_metric(record, kind='span')
+        return False
+
+
+def span(name, **counters):
+    """
+    Measure a block of code. Refer to `Span.add` for counters.
+
+    Returns:
+        span (Span):
+            Context manager. Its `record` holds the measurement on exit.
+    """
+    return Span(name, **counters)
+
+
+def timed(name=None):
+    """
+    Decorator. Measure every call in a span named `name`, or the
+    function name if value is None.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name or func.__qualname__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_trace_peak():
+    if hasattr(tracemalloc, 'reset_peak'):
+        peak = tracemalloc.get_traced_memory()[1]
+        _open_trace_peaks[:] = [max(p, peak) for p in _open_trace_peaks]
+        tracemalloc.reset_peak()
+    _open_trace_peaks.append(0)
+
+
+def _stop_trace_peak():
+    traced, peak = tracemalloc.get_traced_memory()
+    return traced, max(_open_trace_peaks.pop(), peak)
+
+
+def _import_pyinstrument():
+    try:
+        import pyinstrument
+    except ImportError:
+        raise ImportError('pyinstrument profiler requires the '
+                          '`pyinstrument` package')
+    return pyinstrument
+
+
+def _start_profiler(kind):
+    if kind == 'pyinstrument':
+        profiler = _import_pyinstrument().Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, name):
+    os.makedirs(_config['profile_dir'], exist_ok=True)
+    path = os.path.join(_config['profile_dir'],
+                        '{}_{}'.format(ut.RUN_ID, name))
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path += '.prof'
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path += '.html'
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+    log.info(('Profile', name, path))
+    return path
@@ -1,17 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import copy
+import json
 import numpy as np
 import logging
 import pickle
 import time
 import os
+from sklearn.base import clone
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import confusion_matrix, accuracy_score
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.pipeline import Pipeline
+from . import artifact
 from . import const as C
+from . import instrument
+from . import oversample
+from . import parallel
+from . import tuning
 from . import util as ut
 
 
@@ -23,7 +31,15 @@ def build_model(X_file=C.DF_X_TMP_PATH,
                 model_save_path=C.MD_FILE_PATH,
                 enable_tunning=C.MD_TUNNING,
                 X_override=None,
-                y_override=None):
+                y_override=None,
+                imputer_file=C.DF_IMPUTER_TMP_PATH,
+                imputer_override=None,
+                columns_file=C.DF_COLUMNS_TMP_PATH,
+                columns_override=None,
+                enable_feature_selection=C.MD_FEATURE_SELECTION,
+                time_budget=C.MD_TUNNING_TIME_BUDGET,
+                low_memory=C.DF_LOW_MEMORY,
+                oversampling=C.DF_OVERSAMPLING):
     """
     Model Buidling - RandomForest
 
@@ -45,90 +61,171 @@ def build_model(X_file=C.DF_X_TMP_PATH,
             Optional. Override Label Data (Panda Series)
             If this param has set, `y_file` will be ignored.
 
+        imputer_file (str):
+            Optional. Fitted Imputer File Path from data processing
+            (Default value refer to const.py)
+
+        imputer_override (MedianImputer):
+            Optional. Override fitted Imputer.
+            If this param has set, `imputer_file` will be ignored.
+
+        columns_file (str):
+            Optional. Feature Column Names File Path from data processing
+            (Default value refer to const.py)
+
+        columns_override (list):
+            Optional. Override Feature Column Names.
+            If this param has set, `columns_file` will be ignored.
+
+        enable_feature_selection (bool):
+            Optional. Refit the trained (or tuned) forest, with the same
+            parameters, on the most important features only. Selected
+            columns are stored with the model so inference only selects
+            them from DB. Scores before and after selection are reported.
+            (Default value refer to const.py)
+
+        time_budget (float):
+            Optional. Seconds the tuning search may run. None for no limit.
+            (Default value refer to const.py)
+
+        low_memory (bool):
+            Optional. Keep features float32, the dtype the forest trains
+            on, and scale them in place. (Default value refer to const.py)
+
+        oversampling (str):
+            Optional. Oversampling method of data processing, refer to
+            oversample.py. `weights` and `lazy` balance classes while
+            fitting. (Default value refer to const.py)
+
     Returns:
         result (dict):
             Status and Metrics
 
-        classifier (model):
-            Sklearn RandomForest Model
+        model (Pipeline):
+            Sklearn Pipeline - Imputer, Scaler and RandomForest Model
 
     """
     log.info('Build Model Start')
     time_start = time.time()
-    log.debug(('X_file', X_file, 'y_file', y_file))
-    log.debug(('model_save_path', model_save_path))
-    log.debug(('X_override is None', X_override is None))
-    log.debug(('y_override is None', y_override is None))
-
-    # Load Train Test Data
-    X = X_override if X_override is not None else np.loadtxt(X_file)
-    y = y_override if y_override is not None else np.loadtxt(y_file)
-    log.debug(('X y Shapes:', X.shape, y.shape))
-
-    # Split Test Data
-    X_train, X_test, y_train, y_test = \
-        train_test_split(X, y,
-                         test_size=C.MD_TEST_SIZE,
-                         random_state=C.MD_RANDOM_STATE)
-
-    # Scale Data
-    sc = StandardScaler()
-    X_train = sc.fit_transform(X_train)
-    X_test = sc.transform(X_test)
-
-    if enable_tunning:
-        log.debug('RandomSearch Tunning Model Building')
-        n_estimators = [int(x) for x in range(10, 30, 5)]
-        max_features = ['auto', 'sqrt']
-        max_depth = \
-            [int(x) for x in np.linspace(10, 30, num=11)]
-        max_depth.append(None)
-        min_samples_split = [2, 5, 10]
-        min_samples_leaf = [1, 2, 4]
-        bootstrap = [True, False]
-
-        random_grid = {'n_estimators': n_estimators,
-                       'max_features': max_features,
-                       'max_depth': max_depth,
-                       'min_samples_split': min_samples_split,
-                       'min_samples_leaf': min_samples_leaf,
-                       'bootstrap': bootstrap,
-                       'criterion': ['entropy']}
-
-        rf_random_search = RandomizedSearchCV(
-            estimator=RandomForestClassifier(),
-            param_distributions=random_grid,
-            n_iter=3,
-            cv=3,
-            verbose=2,
-            random_state=42,
-            n_jobs=-1)
-
-        rf_random_search.fit(X_train, y_train)
-        classifier = rf_random_search.best_estimator_
-
-    else:
-        log.debug('Vanilla Model Building')
-        # Model Training
-        classifier = RandomForestClassifier(
-            n_estimators=C.MD_n_estimators,
-            min_samples_split=C.MD_min_samples_split,
-            min_samples_leaf=C.MD_min_samples_leaf,
-            max_depth=C.MD_max_depth,
-            criterion='entropy',
-            random_state=C.MD_RANDOM_STATE)
-
-    classifier.fit(X_train, y_train)
-
-    # Check Accuracy
-    log.debug('Check Accuracy')
-    y_pred = classifier.predict(X_test)
-    cm = confusion_matrix(y_test, y_pred)
-    score = accuracy_score(y_test, y_pred)
-
-    # Save model to file
-    log.debug('Save Model to drive')
-    pickle.dump(classifier, open(model_save_path, 'wb'))
+    with instrument.span('build_model') as stage_span:
+        log.debug(('X_file', X_file, 'y_file', y_file))
+        log.debug(('model_save_path', model_save_path))
+        log.debug(('X_override is None', X_override is None))
+        log.debug(('y_override is None', y_override is None))
+
+        # Load Train Test Data
+        X = X_override if X_override is not None else ut.load_array(X_file)
+        y = y_override if y_override is not None else ut.load_array(y_file)
+        if imputer_override is not None:
+            imputer = imputer_override
+        else:
+            ut.file_exists_check(imputer_file,
+                                 error_msg='Imputer File not Found')
+            with open(imputer_file, 'rb') as f:
+                imputer = pickle.load(f)
+        if columns_override is not None:
+            feature_columns = list(columns_override)
+        else:
+            ut.file_exists_check(columns_file,
+                                 error_msg='Columns File not Found')
+            with open(columns_file) as f:
+                feature_columns = json.load(f)
+        input_columns = list(feature_columns)
+        log.debug(('X y Shapes:', X.shape, y.shape))
+
+        # Split Test Data
+        X_train, X_test, y_train, y_test = \
+            train_test_split(X, y,
+                             test_size=C.MD_TEST_SIZE,
+                             random_state=C.MD_RANDOM_STATE)
+
+        # Scale Data
+        with instrument.span('build_model.scale', rows=X.shape[0]):
+            if low_memory:
+                # Split made C-contiguous copies, scale them in place
+                X_train = np.ascontiguousarray(X_train, dtype=np.float32)
+                X_test = np.ascontiguousarray(X_test, dtype=np.float32)
+            sc = StandardScaler(copy=not low_memory)
+            if low_memory:
+                # Chunked fit keeps the variance temporaries chunk sized
+                chunk_size = C.DATA_CHECK_CHUNK_SIZE
+                for start in range(0, X_train.shape[0], chunk_size):
+                    sc.partial_fit(X_train[start:start + chunk_size])
+                X_train = sc.transform(X_train)
+            else:
+                X_train = sc.fit_transform(X_train)
+            X_test = sc.transform(X_test)
+            sc.set_params(copy=True)
+
+        search = None
+        if enable_tunning:
+            log.debug('Successive Halving Tunning Model Building')
+            # Returns the winner fitted on all of X_train, no refit needed
+            with instrument.span('build_model.tunning', rows=X_train.shape[0]):
+                classifier, search = tuning.successive_halving_search(
+                    X_train, y_train, time_budget=time_budget,
+                    oversampling=oversampling, workers=C.MD_TUNNING_WORKERS,
+                    backend=C.JOBLIB_BACKEND)
+
+        else:
+            log.debug('Vanilla Model Building')
+            # Model Training
+            classifier = RandomForestClassifier(
+                n_estimators=C.MD_n_estimators,
+                min_samples_split=C.MD_min_samples_split,
+                min_samples_leaf=C.MD_min_samples_leaf,
+                max_depth=C.MD_max_depth,
+                criterion='entropy',
+                n_jobs=parallel.n_jobs(),
+                random_state=C.MD_RANDOM_STATE)
+            with instrument.span('build_model.fit', rows=X_train.shape[0]):
+                oversample.fit_balanced(classifier, X_train, y_train,
+                                        oversampling)
+
+        feature_selection = None
+        if enable_feature_selection:
+            selected = select_features(classifier.feature_importances_,
+                                       C.MD_FEATURE_IMPORTANCE_CUTOFF)
+            log.debug(('Selected Features', len(selected), X_train.shape[1]))
+            feature_selection = {
+                'feature_count_before': X_train.shape[1],
+                'score_before': accuracy_score(y_test,
+                                               classifier.predict(X_test))
+            }
+            X_train = X_train[:, selected]
+            X_test = X_test[:, selected]
+            # Unfitted copy with the same parameters, tuning is not repeated
+            classifier = clone(classifier)
+            with instrument.span('build_model.refit',
+                                 rows=X_train.shape[0]) as span:
+                oversample.fit_balanced(classifier, X_train, y_train,
+                                        oversampling)
+            feature_selection['refit_seconds'] = round(span.record['seconds'],
+                                                       3)
+            imputer = _subset_features(imputer, selected)
+            sc = _subset_features(sc, selected)
+            feature_columns = [feature_columns[i] for i in selected]
+
+        # Check Accuracy
+        log.debug('Check Accuracy')
+        y_pred = classifier.predict(X_test)
+        cm = confusion_matrix(y_test, y_pred)
+        score = accuracy_score(y_test, y_pred)
+        if feature_selection is not None:
+            feature_selection['score'] = score
+            log.debug(('Feature Selection', feature_selection))
+
+        # Save model to file. Package the fitted preprocessing with the
+        # classifier so inference is a single transform + predict call.
+        log.debug('Save Model to drive')
+        model = Pipeline([('imputer', imputer),
+                          ('scaler', sc),
+                          ('classifier', classifier)])
+        with instrument.span('build_model.save') as span:
+            model_artifact = artifact.save_model(
+                model, model_save_path, score=score,
+                input_columns=input_columns, feature_columns=feature_columns)
+            span.add(bytes_written=os.path.getsize(model_save_path))
 
     # Result
     duration = ut.get_duration_msg(time_start)
@@ -137,12 +234,56 @@ def build_model(X_file=C.DF_X_TMP_PATH,
         'confusion_matrix': cm,
         'score': score,
         'tunning_enable': enable_tunning,
+        'tunning_search': search,
+        'feature_count': len(feature_columns),
+        'feature_selection': feature_selection,
         'model_save_path': model_save_path,
+        'model_version': model_artifact['model_version'],
+        'model_compact': model_artifact['compact'],
+        'model_size_mb': artifact.artifact_size_mb(model_save_path),
         'status': os.path.exists(model_save_path),
+        'low_memory': low_memory,
+        'oversampling': oversampling,
         'duration': duration,
+        'peak_rss_mb': stage_span.record['peak_rss_mb'],
         'ram_usage_percent': ut.get_memroy_percent()
     }
     log.debug(result)
     log.info('Build Model Completed')
-    return result, classifier
+    return result, model
+
+
+def select_features(importances, cutoff):
+    """
+    Feature Selection by cumulative importance.
+
+    Parameters:
+        importances (ndarray):
+            Feature importances. Ex. forest `feature_importances_`
 
+        cutoff (float):
+            Keep the most important features until their summed
+            importance reaches `cutoff` of the total.
+
+    Returns:
+        selected (ndarray):
+            Selected feature indices in their original order
+    """
+    importances = np.asarray(importances, dtype=np.float64)
+    order = np.argsort(importances)[::-1]
+    cumulative = np.cumsum(importances[order]) / importances.sum()
+    count = min(int(np.searchsorted(cumulative, cutoff)) + 1, len(order))
+    return np.sort(order[:count])
+
+
+def _subset_features(transformer, selected):
+    """
+    Restrict a fitted column-wise transformer (Imputer, Scaler) to the
+    `selected` features without refitting it.
+    """
+    transformer = copy.deepcopy(transformer)
+    for attr in ['statistics_', 'mean_', 'var_', 'scale_']:
+        if getattr(transformer, attr, None) is not None:
+            setattr(transformer, attr, getattr(transformer, attr)[selected])
+    transformer.n_features_in_ = len(selected)
+    return transformer
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import confusion_matrix, accuracy_score
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils.class_weight import compute_sample_weight
+from . import artifact
+from . import const as C
+from . import data_eng
+from . import instrument
+from . import parallel
+from . import util as ut
+from .impute import MedianImputer
+from .sketch import QuantileSketch
+
+log = logging.getLogger(__name__)
+
+"""
+Out-of-core Model Building.
+
+Trains the same Imputer, Scaler and Random Forest pipeline as data
+processing and model building, from the data file streamed in chunks,
+so memory is bounded by the chunk size rather than the table size.
+
+1. Stats pass. Column medians through a quantile sketch, a held out test
+   sample and a sample of every class.
+2. Scaler pass. Running mean and variance of the imputed chunks with
+   `StandardScaler.partial_fit`.
+3. Training pass. Every chunk grows its share of the forest's trees with
+   `warm_start`, trained on the chunk plus the class samples. With more
+   chunks than trees, only evenly spaced chunks grow one tree each. The class
+   samples give every chunk all labels and, with balanced sample weights,
+   take the place of SMOTE, which needs the whole table in memory.
+"""
+
+
+def build_model_out_of_core(data_file_path=C.DATA_FILE_PATH,
+                            model_save_path=C.MD_FILE_PATH,
+                            columns=None,
+                            chunk_size=C.MD_OUT_OF_CORE_CHUNK_SIZE,
+                            n_estimators=C.MD_n_estimators,
+                            class_sample_size=C.MD_OUT_OF_CORE_CLASS_SAMPLE,
+                            test_size=C.MD_OUT_OF_CORE_TEST_ROWS,
+                            random_state=C.MD_RANDOM_STATE):
+    """
+    Out-of-core Model Building - RandomForest
+
+    Parameters:
+        data_file_path (str):
+            Optional. Data File location, Parquet or CSV.
+            (Default value refer to const.py)
+
+        model_save_path (str):
+            Optional. Model pickle file save path
+            (Default value refer const.py)
+
+        columns (list):
+            Optional. Feature columns. All columns but the last (label)
+            column if None.
+
+        chunk_size (int):
+            Optional. Rows held in memory at a time.
+
+        n_estimators (int):
+            Optional. Trees of the forest, split evenly across chunks.
+            Chunks beyond `n_estimators` grow no tree.
+
+        class_sample_size (int):
+            Optional. Rows per class added to the training rows of every
+            chunk.
+
+        test_size (int):
+            Optional. Rows held out to score the model.
+
+        random_state (int):
+            Optional. (Default value refer to const.py)
+
+    Returns:
+        result (dict):
+            Status and Metrics
+
+        model (Pipeline):
+            Sklearn Pipeline - Imputer, Scaler and RandomForest Model
+    """
+    log.info('Build Model Out-of-core Start')
+    time_start = time.time()
+    ut.reset_peak_rss()
+    rng = np.random.default_rng(random_state)
+    feature_columns, _ = data_eng.data_file_columns(data_file_path, columns)
+
+    def chunks():
+        return data_eng.iter_feature_chunks(data_file_path, feature_columns,
+                                            chunk_size=chunk_size)
+
+    # Stats Pass
+    sketch = QuantileSketch()
+    test_sample = _Sample(test_size)
+    class_samples = {}
+    row_count = 0
+    chunk_count = 0
+    with instrument.span('build_model_out_of_core.stats') as span:
+        for X, y in chunks():
+            sketch.update(X)
+            rows = np.arange(len(y))
+            test_sample.offer(rng.random(len(y)), rows, X, y, row_count)
+            keys = rng.random(len(y))
+            for label in np.unique(y):
+                mask = y == label
+                class_samples.setdefault(
+                    label, _Sample(class_sample_size)).offer(
+                        keys[mask], rows[mask], X, y, row_count)
+            row_count += len(y)
+            chunk_count += 1
+        span.add(rows=row_count)
+    imputer = MedianImputer.from_sketch(sketch)
+    log.debug(('Class Counts', {label: sample.seen for label, sample
+                                in class_samples.items()}))
+
+    # Held out rows never train the model
+    test_index = np.sort(test_sample.index)
+    X_class, y_class = _concat_samples(
+        [s.without(test_index) for s in class_samples.values()])
+
+    # Scaler Pass
+    sc = StandardScaler()
+    with instrument.span('build_model_out_of_core.scale', rows=row_count):
+        for X, _ in chunks():
+            sc.partial_fit(imputer.transform(X))
+    X_class = sc.transform(imputer.transform(X_class))
+
+    # Training Pass
+    chunk_trees = _split_trees(n_estimators, chunk_count)
+    classifier = RandomForestClassifier(
+        n_estimators=0,
+        min_samples_split=C.MD_min_samples_split,
+        min_samples_leaf=C.MD_min_samples_leaf,
+        max_depth=C.MD_max_depth,
+        criterion='entropy',
+        warm_start=True,
+        n_jobs=parallel.n_jobs(),
+        random_state=random_state)
+    start = 0
+    with instrument.span('build_model_out_of_core.fit', rows=row_count):
+        for (X, y), trees in zip(chunks(), chunk_trees):
+            index = np.arange(start, start + len(y))
+            start += len(y)
+            if trees == 0:
+                continue
+            train = ~_isin_sorted(index, test_index)
+            X = sc.transform(imputer.transform(X[train]))
+            y = np.concatenate([y[train], y_class])
+            classifier.set_params(n_estimators=classifier.n_estimators +
+                                  trees)
+            # Balanced over the rows of the chunk, not the whole table
+            classifier.fit(np.concatenate([X, X_class]), y,
+                           sample_weight=compute_sample_weight('balanced', y))
+            log.debug(('Chunk Trees', len(classifier.estimators_)))
+    classifier.set_params(warm_start=False)
+
+    # Check Accuracy
+    log.debug('Check Accuracy')
+    y_test = test_sample.y
+    y_pred = classifier.predict(sc.transform(imputer.transform(
+        test_sample.X)))
+    cm = confusion_matrix(y_test, y_pred)
+    score = accuracy_score(y_test, y_pred)
+
+    log.debug('Save Model to drive')
+    model = Pipeline([('imputer', imputer),
+                      ('scaler', sc),
+                      ('classifier', classifier)])
+    model_artifact = artifact.save_model(model, model_save_path,
+                                         score=score,
+                                         input_columns=feature_columns,
+                                         feature_columns=feature_columns)
+
+    duration = ut.get_duration_msg(time_start)
+    result = {
+        'func_name': build_model_out_of_core.__name__,
+        'confusion_matrix': cm,
+        'score': score,
+        'row_count': row_count,
+        'chunk_count': chunk_count,
+        'chunk_size': chunk_size,
+        'n_estimators': len(classifier.estimators_),
+        'test_row_count': len(y_test),
+        'feature_count': len(feature_columns),
+        'model_save_path': model_save_path,
+        'model_version': model_artifact['model_version'],
+        'model_compact': model_artifact['compact'],
+        'model_size_mb': artifact.artifact_size_mb(model_save_path),
+        'status': os.path.exists(model_save_path),
+        'duration': duration,
+        'peak_rss_mb': ut.get_peak_rss_mb(),
+        'ram_usage_percent': ut.get_memroy_percent()
+    }
+    log.debug(result)
+    log.info('Build Model Out-of-core Completed')
+    return result, model
+
+
+class _Sample:
+    """
+    Uniform sample of at most `size` rows, the rows with the smallest
+    random keys offered so far.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.seen = 0
+        self.keys = np.empty(0)
+        self.index = np.empty(0, dtype=np.int64)
+        self.X = None
+        self.y = None
+
+    def offer(self, keys, rows, X, y, offset):
+        """
+        Offer `rows` of chunk `X`, `y`, the chunk starting at row `offset`
+        of the table.
+        """
+        self.seen += len(rows)
+        if len(self.keys) >= self.size:
+            # Only rows that beat the largest kept key can enter
+            keep = keys < self.keys.max()
+            keys, rows = keys[keep], rows[keep]
+        index = rows + offset
+        X, y = X[rows], y[rows]
+        if self.X is not None:
+            keys = np.concatenate([self.keys, keys])
+            index = np.concatenate([self.index, index])
+            X = np.concatenate([self.X, X])
+            y = np.concatenate([self.y, y])
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size - 1)[:self.size]
+            keys, index, X, y = keys[keep], index[keep], X[keep], y[keep]
+        self.keys, self.index, self.X, self.y = keys, index, X, y
+
+    def without(self, sorted_index):
+        keep = ~_isin_sorted(self.index, sorted_index)
+        return self.X[keep], self.y[keep]
+
+
+def _concat_samples(samples):
+    return (np.concatenate([X for X, _ in samples]),
+            np.concatenate([y for _, y in samples]))
+
+
+def _split_trees(n_estimators, chunk_count):
+    """
+    Trees per chunk, `n_estimators` in total. Chunks differ by at most one
+    tree, and with more chunks than trees the ones with a tree are evenly
+    spaced.
+    """
+    bounds = np.arange(chunk_count + 1) * n_estimators // max(chunk_count, 1)
+    return np.diff(bounds)
+
+
+def _isin_sorted(values, sorted_values):
+    """
+    `np.isin` for a sorted lookup array, without sorting it again.
+    """
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    position = np.minimum(np.searchsorted(sorted_values, values),
+                          len(sorted_values) - 1)
+    return sorted_values[position] == values
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+from joblib import Parallel, delayed
+from imblearn.over_sampling import SMOTE
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils.class_weight import compute_sample_weight
+from . import const as C
+from . import parallel
+
+log = logging.getLogger(__name__)
+
+"""
+Class Oversampling.
+
+`C.DF_OVERSAMPLING` picks how training balances the rare classes.
+
+- smote: imblearn SMOTE over the whole dataset in data processing.
+- approx_smote: SMOTE rows generated in batches straight into the output
+  array, from neighbours searched in a ball tree over at most
+  `C.DF_SMOTE_INDEX_ROWS` rows per class.
+- weights: no rows generated. The forest is fitted with balanced sample
+  weights.
+- lazy: no rows generated in data processing. The forest grows in
+  `C.DF_LAZY_BATCHES` batches of trees, each fitted on the training rows
+  plus its share of synthetic rows, generated for that batch only, and
+  balanced sample weights.
+"""
+
+METHODS = ('smote', 'approx_smote', 'weights', 'lazy')
+
+
+def resample(X, y, method=C.DF_OVERSAMPLING, random_state=31):
+    """
+    Oversample the rare classes of the processed dataset.
+
+    Parameters:
+        X, y:
+            Processed dataset.
+
+        method (str):
+            Optional. One of `METHODS`. Only `smote` and `approx_smote`
+            generate rows here. (Default value refer to const.py)
+
+    Returns:
+        X, y:
+            Resampled dataset. `X`, `y` for the other methods.
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown oversampling method: {}'.format(method))
+    if method == 'smote':
+        return SMOTE(random_state=random_state).fit_resample(X, y)
+    if method == 'approx_smote':
+        return ApproxSMOTE(random_state=random_state).fit_resample(X, y)
+    return X, y
+
+
+def synthetic_row_count(y):
+    """
+    Rows SMOTE generates to bring every class up to the majority class.
+    """
+    counts = np.unique(y, return_counts=True)[1]
+    return int((counts.max() - counts).sum())
+
+
+def fit_balanced(classifier, X, y, method=C.DF_OVERSAMPLING,
+                 random_state=C.MD_RANDOM_STATE):
+    """
+    Fit `classifier` the way the oversampling method balances classes.
+    Rows resampled in data processing are fitted as they are.
+
+    Returns:
+        classifier
+    """
+    if method == 'weights':
+        return classifier.fit(X, y,
+                              sample_weight=compute_sample_weight('balanced',
+                                                                  y))
+    if method != 'lazy':
+        return classifier.fit(X, y)
+
+    sampler = ApproxSMOTE(random_state=random_state).fit(X, y)
+    n_batches = max(1, min(C.DF_LAZY_BATCHES, classifier.n_estimators))
+    n_estimators = classifier.n_estimators
+    # One buffer for the training rows and a batch of synthetic rows
+    X_batch = np.empty((len(X) + sum(
+        _share(count, 0, n_batches)
+        for count in sampler.synthetic_counts_.values()), X.shape[1]),
+        dtype=X.dtype)
+    X_batch[:len(X)] = X
+    classifier.set_params(warm_start=True)
+    for batch in range(n_batches):
+        counts = {label: _share(count, batch, n_batches)
+                  for label, count in sampler.synthetic_counts_.items()}
+        n_rows = len(X) + sum(counts.values())
+        y_synthetic = sampler.sample(X, counts, out=X_batch[len(X):n_rows])
+        y_batch = np.concatenate([y, y_synthetic])
+        classifier.set_params(n_estimators=n_estimators * (batch + 1)
+                              // n_batches)
+        classifier.fit(X_batch[:n_rows], y_batch,
+                       sample_weight=compute_sample_weight('balanced',
+                                                           y_batch))
+        log.debug(('Lazy Oversampling Batch', batch, n_rows,
+                   len(classifier.estimators_)))
+    classifier.set_params(warm_start=False)
+    return classifier
+
+
+def _share(total, part, n_parts):
+    """
+    Size of part `part` of `total` split into `n_parts` near equal parts.
+    """
+    return total // n_parts + (part < total % n_parts)
+
+
+class ApproxSMOTE:
+    """
+    SMOTE with bounded memory and approximate neighbours.
+
+    Every synthetic row is a random point between a row of its class and
+    one of the row's `k_neighbors` nearest neighbours, as in SMOTE.
+    Neighbours are searched in a ball tree with batched queries, over a
+    random sample of at most `index_rows` rows per class. Synthetic rows
+    are generated in batches across threads straight into the output
+    array, rather than built as a separate array and stacked.
+    """
+
+    def __init__(self, k_neighbors=C.DF_SMOTE_K_NEIGHBORS,
+                 index_rows=C.DF_SMOTE_INDEX_ROWS,
+                 batch_size=C.DF_SMOTE_BATCH_SIZE,
+                 n_jobs=C.DF_SMOTE_N_JOBS,
+                 random_state=None):
+        self.k_neighbors = k_neighbors
+        self.index_rows = index_rows
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        """
+        Index the rows of every class below the majority count.
+        """
+        self._rng = np.random.default_rng(self.random_state)
+        labels, counts = np.unique(y, return_counts=True)
+        self.synthetic_counts_ = {}
+        self.neighbors_ = {}
+        for label, count in zip(labels, counts):
+            if count == counts.max():
+                continue
+            rows = np.flatnonzero(y == label)
+            if len(rows) > self.index_rows:
+                rows = np.sort(self._rng.choice(rows, self.index_rows,
+                                                replace=False))
+            self.synthetic_counts_[label] = int(counts.max() - count)
+            self.neighbors_[label] = (rows, self._neighbors(X[rows]))
+        self.n_synthetic_ = sum(self.synthetic_counts_.values())
+        return self
+
+    def fit_resample(self, X, y):
+        self.fit(X, y)
+        X_resampled = np.empty((len(X) + self.n_synthetic_, X.shape[1]),
+                               dtype=X.dtype)
+        X_resampled[:len(X)] = X
+        y_synthetic = self.sample(X, self.synthetic_counts_,
+                                  out=X_resampled[len(X):])
+        return X_resampled, np.concatenate([y, y_synthetic])
+
+    def sample(self, X, counts, out):
+        """
+        Generate synthetic rows into `out`.
+
+        Parameters:
+            X:
+                Rows the sampler was fitted on.
+
+            counts (dict):
+                Synthetic rows per label.
+
+            out (ndarray):
+                Output, `sum(counts.values())` rows.
+
+        Returns:
+            y (ndarray):
+                Label per synthetic row
+        """
+        tasks = []
+        start = 0
+        for label, count in counts.items():
+            for batch_start in range(0, count, self.batch_size):
+                stop = start + min(self.batch_size, count - batch_start)
+                tasks.append((label, start, stop))
+                start = stop
+        seeds = np.random.SeedSequence(
+            self._rng.integers(2 ** 32)).spawn(len(tasks))
+        Parallel(n_jobs=parallel.n_jobs(self.n_jobs), prefer='threads')(
+            delayed(self._generate)(X, label, out[start:stop],
+                                    np.random.default_rng(seed))
+            for (label, start, stop), seed in zip(tasks, seeds))
+        return np.repeat(list(counts), list(counts.values()))
+
+    def _neighbors(self, X_class):
+        """
+        `k_neighbors` nearest neighbours of every row, itself excluded.
+        """
+        k = min(self.k_neighbors, len(X_class) - 1)
+        if k < 1:
+            # A single row, synthetic rows are copies of it
+            return np.zeros((len(X_class), 1), dtype=np.int64)
+        index = NearestNeighbors(n_neighbors=k + 1, algorithm='ball_tree',
+                                 n_jobs=parallel.n_jobs(self.n_jobs)
+                                 ).fit(X_class)
+        return np.concatenate([
+            index.kneighbors(X_class[start:start + self.batch_size],
+                             return_distance=False)[:, 1:]
+            for start in range(0, len(X_class), self.batch_size)])
+
+    def _generate(self, X, label, out, rng):
+        rows, neighbors = self.neighbors_[label]
+        base = rng.integers(len(rows), size=len(out))
+        neighbor = neighbors[base, rng.integers(neighbors.shape[1],
+                                                size=len(out))]
+        np.take(X, rows[base], axis=0, out=out)
+        step = X[rows[neighbor]]
+        step -= out
+        step *= rng.random((len(out), 1), dtype=np.float32
+                           if out.dtype == np.float32 else np.float64)
+        out += step
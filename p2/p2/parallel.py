@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+import joblib
+from threadpoolctl import threadpool_limits
+from . import const as C
+
+log = logging.getLogger(__name__)
+
+"""
+Pipeline Parallelism.
+
+Every stage shares one budget of `C.CPU_BUDGET` cores, by default the
+cores the process may use, CPU affinity and cgroup CPU quota (ECS task
+CPU) included. `n_jobs=-1` and `os.cpu_count()` see all cores of the host
+instead, which oversubscribes a shared host.
+
+- Forests fit and predict with `n_jobs` threads out of the budget.
+- Tuning fits `C.MD_TUNNING_WORKERS` candidates at once with the
+  `C.JOBLIB_BACKEND` joblib backend, each forest with an even share of
+  the budget. Refer to `split`.
+- BLAS / OpenMP thread pools of numpy, scipy and sklearn are limited per
+  pipeline stage by `C.STAGE_THREAD_LIMITS`. Refer to `stage_limits`.
+"""
+
+BACKENDS = ('threading', 'loky', 'multiprocessing')
+
+
+def cpu_budget():
+    """
+    Cores the pipeline may use.
+
+    Returns:
+        budget (int):
+            `C.CPU_BUDGET`, or the cores available to the process if value
+            is None.
+    """
+    if C.CPU_BUDGET is not None and C.CPU_BUDGET > 0:
+        return int(C.CPU_BUDGET)
+    return joblib.cpu_count()
+
+
+def n_jobs(value=None):
+    """
+    `n_jobs` within the budget.
+
+    Parameters:
+        value (int):
+            Optional. Requested `n_jobs`. The whole budget if value is None
+            or below 1, ex. -1.
+    """
+    budget = cpu_budget()
+    if value is None or value < 1:
+        return budget
+    return min(value, budget)
+
+
+def split(workers=C.MD_TUNNING_WORKERS, budget=None):
+    """
+    Split the budget between parallel workers and the forest threads of
+    each worker.
+
+    Parameters:
+        workers (int):
+            Requested workers, capped by the budget.
+
+        budget (int):
+            Optional. `cpu_budget()` if value is None.
+
+    Returns:
+        workers (int):
+            Parallel workers
+
+        forest_n_jobs (int):
+            `n_jobs` of the forest of each worker
+    """
+    budget = budget or cpu_budget()
+    workers = max(1, min(workers or 1, budget))
+    return workers, max(1, budget // workers)
+
+
+def set_n_jobs(estimator, value):
+    """
+    Set every `n_jobs` parameter of `estimator` and its steps.
+    """
+    params = {name: value for name in estimator.get_params()
+              if name == 'n_jobs' or name.endswith('__n_jobs')}
+    return estimator.set_params(**params)
+
+
+@contextlib.contextmanager
+def stage_limits(stage):
+    """
+    Limit BLAS / OpenMP threads while a pipeline stage runs.
+
+    Parameters:
+        stage (str):
+            Stage name. Limited to `C.STAGE_THREAD_LIMITS[stage]` threads,
+            or the budget for a stage not listed.
+    """
+    limit = n_jobs(C.STAGE_THREAD_LIMITS.get(stage))
+    log.debug(('Stage Thread Limit', stage, limit))
+    with threadpool_limits(limits=limit):
+        yield limit
@@ -2,15 +2,43 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import asyncio
 import logging
+import os
 import traceback
-from . import data_eng, model_build, util as ut
+from . import artifact, cache, data_eng, drift, instrument, model_build
+from . import out_of_core, oversample, parallel
+from . import util as ut
 from . import inference as inf
+from . import const as C
 import pprint
 
 
 log = logging.getLogger(__name__)
 
+# const.py values the output of each cached stage depends on, refer to
+# `cache.run_stage`. Paths, DB, serving and resource settings are left out.
+_OVERSAMPLE_CONSTANTS = [
+    'DF_OVERSAMPLING', 'DF_SMOTE_K_NEIGHBORS', 'DF_SMOTE_INDEX_ROWS',
+    'DF_SMOTE_BATCH_SIZE', 'DF_LAZY_BATCHES', 'MD_RANDOM_STATE']
+_FOREST_CONSTANTS = [
+    'MD_RANDOM_STATE', 'MD_n_estimators', 'MD_min_samples_split',
+    'MD_min_samples_leaf', 'MD_max_depth', 'MD_ARTIFACT_COMPACT',
+    'MD_ARTIFACT_COMPRESS', 'MD_ARTIFACT_THRESHOLD_DTYPE',
+    'MD_ARTIFACT_PRUNE_TOLERANCE']
+_DATA_PROCESS_CONSTANTS = _OVERSAMPLE_CONSTANTS + [
+    'DF_LOW_MEMORY', 'SKETCH_SIZE', 'DATA_FETCH_CHUNK_SIZE']
+_MODEL_BUILD_CONSTANTS = _OVERSAMPLE_CONSTANTS + _FOREST_CONSTANTS + [
+    'DF_LOW_MEMORY', 'DATA_CHECK_CHUNK_SIZE', 'MD_TEST_SIZE', 'MD_TUNNING',
+    'MD_TUNNING_N_CANDIDATES', 'MD_TUNNING_FACTOR',
+    'MD_TUNNING_MIN_ESTIMATORS', 'MD_TUNNING_MAX_ESTIMATORS',
+    'MD_TUNNING_MIN_SAMPLES', 'MD_TUNNING_VALID_SIZE',
+    'MD_TUNNING_TIME_BUDGET', 'MD_FEATURE_SELECTION',
+    'MD_FEATURE_IMPORTANCE_CUTOFF']
+_MODEL_BUILD_OUT_OF_CORE_CONSTANTS = _FOREST_CONSTANTS + [
+    'MD_OUT_OF_CORE_CHUNK_SIZE', 'MD_OUT_OF_CORE_CLASS_SAMPLE',
+    'MD_OUT_OF_CORE_TEST_ROWS', 'SKETCH_SIZE']
+
 
 def setup_logging(log_option: str):
     """
@@ -66,40 +94,170 @@ def publish_error_to_sns(error_msg):
     # )
 
 
-def execute_full_pipeline():
+def execute_full_pipeline(chunk_size=None, n_workers=C.INF_N_WORKERS,
+                          use_cache=True, use_async=False,
+                          accept_drift=False):
     """
     Full Pipeline Execution
 
     Output will be store in tmp directory for each step.
+
+    Parameters:
+        chunk_size (int):
+            Optional. Stream inference input in chunks of this many rows.
+
+        n_workers (int):
+            Optional. Inference scoring worker processes.
+
+        use_cache (bool):
+            Optional. Skip processing and model building when their
+            inputs are unchanged since a previous run. Refer to cache.py.
+
+        use_async (bool):
+            Optional. Run inference on an asyncio event loop that overlaps
+            DB read, scoring and DB write of consecutive chunks.
+            Refer to `inference.batch_inference_async`.
+
+        accept_drift (bool):
+            Optional. Accept the fetched data profile as the drift
+            reference, so drifted data is retrained on.
     """
     log.info('Pipeline Start')
+    # Every stage runs in an instrument span, profiled if configured, and
+    # within its BLAS / OpenMP thread limit
     # Fetch Data
-    result = data_eng.fetch_data_from_mssql()
+    with instrument.span('data-fetch'), parallel.stage_limits('data-fetch'):
+        result = data_eng.fetch_data_from_mssql()
     validate(result)
 
     # Data File Check
-    result, df = data_eng.data_file_check()
+    # Streamed in constant memory, the dataset is only loaded for processing.
+    # Not cached, a Parquet check only reads the file footer.
+    with instrument.span('data-check'), parallel.stage_limits('data-check'):
+        result = run_data_check()
     validate(result)
 
-    # Data Processing
-    # Use dataset in memory for dataset_override to improve speed
-    result, X, y = data_eng.process_data(dataset_override=df)
-    validate(result)
+    # Data Drift Check
+    # Fetched data profile against the training data profile. With
+    # DRIFT_BLOCK_RETRAINING drifted data is not retrained on, inference
+    # keeps the current model
+    skip_model_build = False
+    if C.DATA_PROFILE:
+        with instrument.span('data-drift'), \
+                parallel.stage_limits('data-drift'):
+            result = run_data_drift(accept_drift)
+        validate(result)
+        skip_model_build = C.DRIFT_BLOCK_RETRAINING and \
+            result['drift_detected'] and not accept_drift
 
-    # Build Model
-    result, model = model_build.build_model(X_override=X, y_override=y)
-    validate(result)
+    if skip_model_build:
+        log.warning('Data Drift, model building skipped. Accept the data '
+                    'profile as reference with --accept-drift')
+    elif C.MD_OUT_OF_CORE:
+        # Build Model streamed from the data file, no in memory processing
+        with instrument.span('model-build'), \
+                parallel.stage_limits('model-build'):
+            result = run_model_build_out_of_core(use_cache)
+        validate(result)
+    else:
+        # Data Processing
+        with instrument.span('data-process'), \
+                parallel.stage_limits('data-process'):
+            result = run_data_process(use_cache)
+        validate(result)
+
+        # Build Model
+        with instrument.span('model-build'), \
+                parallel.stage_limits('model-build'):
+            result = run_model_build(use_cache)
+        validate(result)
 
     # Inference
-    result, _, _ = inf.batch_inference(model_override=model)
+    with instrument.span('inference'), parallel.stage_limits('inference'):
+        if use_async:
+            result, _ = run_inference_async(chunk_size, n_workers)
+        else:
+            result, _, _ = inf.batch_inference(chunk_size=chunk_size,
+                                               n_workers=n_workers)
     validate(result)
     log.info('Pipeline Completed')
 
 
+def run_inference_async(chunk_size=None, n_workers=C.INF_N_WORKERS):
+    """
+    Overlapped Streaming Inference on a new event loop.
+    Chunks of `C.INF_CHUNK_SIZE` rows if `chunk_size` is not given.
+    """
+    return asyncio.run(inf.batch_inference_async(
+        chunk_size=chunk_size or C.INF_CHUNK_SIZE, n_workers=n_workers))
+
+
+def run_data_check():
+    return data_eng.data_file_check()[0]
+
+
+def run_data_process(use_cache=True):
+    columns = None
+    if C.DF_REUSE_MODEL_FEATURES and os.path.exists(C.MD_FILE_PATH):
+        columns = artifact.load_model(C.MD_FILE_PATH).get('feature_columns')
+    return cache.run_stage(
+        'data-process',
+        lambda: data_eng.process_data(
+            columns=columns, oversampling=C.DF_OVERSAMPLING)[0],
+        input_paths=[C.DATA_FILE_PATH],
+        params={'columns': columns},
+        constants=_DATA_PROCESS_CONSTANTS,
+        output_paths=[C.DF_X_TMP_PATH, C.DF_Y_TMP_PATH,
+                      C.DF_IMPUTER_TMP_PATH, C.DF_COLUMNS_TMP_PATH],
+        enabled=use_cache)
+
+
+def run_data_drift(accept_drift=False):
+    result = drift.check_drift(C.DATA_PROFILE_PATH,
+                               C.DATA_PROFILE_REFERENCE_PATH)
+    # Drift is measured against the old reference first, so it is still
+    # reported
+    if accept_drift:
+        drift.set_reference(C.DATA_PROFILE_PATH,
+                            C.DATA_PROFILE_REFERENCE_PATH)
+    result['drift_accepted'] = accept_drift
+    return result
+
+
+def run_model_build(use_cache=True):
+    return _set_drift_reference(cache.run_stage(
+        'model-build',
+        lambda: model_build.build_model(
+            oversampling=C.DF_OVERSAMPLING)[0],
+        input_paths=[C.DF_X_TMP_PATH, C.DF_Y_TMP_PATH,
+                     C.DF_IMPUTER_TMP_PATH, C.DF_COLUMNS_TMP_PATH],
+        constants=_MODEL_BUILD_CONSTANTS,
+        output_paths=[C.MD_FILE_PATH],
+        enabled=use_cache))
+
+
+def run_model_build_out_of_core(use_cache=True):
+    return _set_drift_reference(cache.run_stage(
+        'model-build-out-of-core',
+        lambda: out_of_core.build_model_out_of_core()[0],
+        input_paths=[C.DATA_FILE_PATH],
+        constants=_MODEL_BUILD_OUT_OF_CORE_CONSTANTS,
+        output_paths=[C.MD_FILE_PATH],
+        enabled=use_cache))
+
+
+def _set_drift_reference(result):
+    # The model is built from the fetched data, its profile becomes the
+    # reference later fetches drift from
+    if C.DATA_PROFILE and result['status']:
+        drift.set_reference(C.DATA_PROFILE_PATH,
+                            C.DATA_PROFILE_REFERENCE_PATH)
+    return result
+
+
 def validate(data: dict, raise_exception=True):
     log.info('validate and store metric')
     ut.store_metric(data)
-    # TODO Store the status as json or database's table
     if data is None:
         raise Exception('No Validation Result')
     if data['status'] is False and raise_exception:
@@ -127,36 +285,154 @@ if __name__ == '__main__':
                         choices=[
                             'data-fetch',
                             'data-check',
+                            'data-drift',
                             'data-process',
                             'model-build',
                             'inference',
+                            'compare-models',
                             'full-pipeline'
                         ],
                         default='debug-info')
 
+    # Streaming Inference Option
+    # python -m p2.pipeline -log INFO -a inference -c 50000
+    parser.add_argument('-c', '--chunk-size',
+                        type=int,
+                        nargs='?',
+                        const=C.INF_CHUNK_SIZE,
+                        default=None)
+
+    # Incremental Inference Option. Only score rows past the last watermark
+    # python -m p2.pipeline -log INFO -a inference --incremental
+    parser.add_argument('--incremental',
+                        action='store_true')
+
+    # Inference Scoring Worker Processes. -1 for all CPU cores
+    # python -m p2.pipeline -log INFO -a inference -w 4
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=C.INF_N_WORKERS)
+
+    # Asyncio Inference. Overlap DB read, scoring and DB write of chunks
+    # python -m p2.pipeline -log INFO -a inference --async
+    parser.add_argument('--async',
+                        dest='use_async',
+                        action='store_true')
+
+    # Champion / Challenger Scoring. The first model is the champion
+    # python -m p2.pipeline -log INFO -a compare-models \
+    #     --models /tmp/model.sav /tmp/challenger.sav
+    parser.add_argument('--models',
+                        nargs='+',
+                        default=[C.MD_FILE_PATH])
+
+    # Accept the fetched data profile as the drift reference. Ex. once
+    # drift is reviewed, to retrain with DRIFT_BLOCK_RETRAINING
+    # python -m p2.pipeline -log INFO -a data-drift --accept-drift
+    parser.add_argument('--accept-drift',
+                        action='store_true')
+
+    # Disable Stage Output Cache. Rerun every stage from scratch
+    # python -m p2.pipeline -log INFO -a full-pipeline --no-cache
+    parser.add_argument('--no-cache',
+                        action='store_true')
+
+    # Out-of-core Model Building. Stream the data file in chunks instead of
+    # data processing and model building in memory
+    # python -m p2.pipeline -log INFO -a full-pipeline --out-of-core
+    parser.add_argument('--out-of-core',
+                        action='store_true')
+
+    # Class imbalance handling. Refer to oversample.py
+    # python -m p2.pipeline -log INFO -a full-pipeline --oversampling lazy
+    parser.add_argument('--oversampling',
+                        choices=oversample.METHODS,
+                        default=C.DF_OVERSAMPLING)
+
+    # Cores shared by all stages. Refer to parallel.py
+    # python -m p2.pipeline -log INFO -a full-pipeline --cpu-budget 8 \
+    #     --tunning-workers 2 --joblib-backend loky
+    parser.add_argument('--cpu-budget',
+                        type=int,
+                        default=C.CPU_BUDGET)
+    parser.add_argument('--tunning-workers',
+                        type=int,
+                        default=C.MD_TUNNING_WORKERS)
+    parser.add_argument('--joblib-backend',
+                        choices=parallel.BACKENDS,
+                        default=C.JOBLIB_BACKEND)
+
+    # Profile every stage. Output in C.PROFILE_DIR
+    # python -m p2.pipeline -log INFO -a full-pipeline --profile cprofile
+    parser.add_argument('--profile',
+                        choices=instrument.PROFILERS,
+                        default=None)
+
+    # Trace Python allocations per stage and sub-step with tracemalloc
+    # python -m p2.pipeline -log INFO -a full-pipeline --trace-memory
+    parser.add_argument('--trace-memory',
+                        action='store_true')
+
+    # Metrics Sink. JSON lines, or SQLite if the path ends with .db
+    # python -m p2.pipeline -log INFO -a full-pipeline --metrics metrics.db
+    parser.add_argument('--metrics',
+                        default=C.METRICS_PATH)
+
     # Log Option
     parser.add_argument('-log', '--log',
                         default='warning')
     options = parser.parse_args()
+    if options.use_async and options.incremental:
+        parser.error('--async does not support --incremental')
     setup_logging(options.log)
+    C.METRICS_PATH = options.metrics
+    C.MD_OUT_OF_CORE = C.MD_OUT_OF_CORE or options.out_of_core
+    C.DF_OVERSAMPLING = options.oversampling
+    C.CPU_BUDGET = options.cpu_budget
+    C.MD_TUNNING_WORKERS = options.tunning_workers
+    C.JOBLIB_BACKEND = options.joblib_backend
+    instrument.configure(profiler=options.profile,
+                         trace_memory=options.trace_memory)
 
     # Action Processing
     action = options.action
     log.info(('Action:', action))
     try:
         if action == 'full-pipeline':
-            execute_full_pipeline()
-        # For Troubleshooting, invoke manually. Data will be fetch from cache - /tmp folder
-        if action == 'data-fetch':
-            data_eng.fetch_data_from_mssql()
-        if action == 'data-check':
-            data_eng.data_file_check()
-        if action == 'data-process':
-            data_eng.process_data()
-        if action == 'model-build':
-            model_build.build_model()
-        if action == 'inference':
-            inf.batch_inference()
+            execute_full_pipeline(chunk_size=options.chunk_size,
+                                  n_workers=options.workers,
+                                  use_cache=not options.no_cache,
+                                  use_async=options.use_async,
+                                  accept_drift=options.accept_drift)
+        else:
+            # For Troubleshooting, invoke manually. Data will be fetch from
+            # cache - /tmp folder
+            with instrument.span(action), parallel.stage_limits(action):
+                if action == 'data-fetch':
+                    data_eng.fetch_data_from_mssql()
+                if action == 'data-check':
+                    run_data_check()
+                if action == 'data-drift':
+                    validate(run_data_drift(options.accept_drift))
+                # Cached stages are rerun only if their input in /tmp has
+                # changed
+                if action == 'data-process':
+                    run_data_process(not options.no_cache)
+                if action == 'model-build' and C.MD_OUT_OF_CORE:
+                    run_model_build_out_of_core(not options.no_cache)
+                elif action == 'model-build':
+                    run_model_build(not options.no_cache)
+                if action == 'inference' and options.use_async:
+                    run_inference_async(options.chunk_size, options.workers)
+                elif action == 'inference':
+                    inf.batch_inference(chunk_size=options.chunk_size,
+                                        incremental=options.incremental,
+                                        n_workers=options.workers)
+                if action == 'compare-models':
+                    result, _, _ = inf.compare_models(
+                        options.models, chunk_size=options.chunk_size,
+                        n_workers=options.workers)
+                    validate(result)
     except (OSError, Exception):
         traceback.print_exc()
         tb = traceback.format_exc()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from threadpoolctl import threadpool_limits
+from . import const as C
+from . import parallel
+
+log = logging.getLogger(__name__)
+
+# Model loaded once per worker process by `_init_worker`
+_worker_model = None
+
+
+class ParallelScorer:
+    """
+    Multi-process Batch Scorer.
+
+    Input rows are copied once into shared memory and split into row
+    shards. Each worker of the process pool holds its own copy of the
+    model, loaded once when the worker starts, and only receives the
+    shard bounds per task. Predictions are merged back in row order.
+    Workers split the core budget, each model predicts with
+    `budget // n_workers` threads and one BLAS / OpenMP thread.
+
+    Usage:
+        with ParallelScorer(model, n_workers=4) as scorer:
+            y = scorer.predict(X)
+    """
+
+    def __init__(self, model, n_workers=C.INF_N_WORKERS, shard_size=None):
+        """
+        Parameters:
+            model (Pipeline):
+                Fitted model with `predict`.
+
+            n_workers (int):
+                Worker process count. -1 for the core budget, refer to
+                parallel.py.
+                Score in the calling process if value is 1.
+
+            shard_size (int):
+                Optional. Rows per task. Split evenly across workers
+                if value is None.
+        """
+        if n_workers is None or n_workers < 1:
+            n_workers = parallel.cpu_budget()
+        self.model = model
+        self.n_workers = n_workers
+        self.shard_size = shard_size
+        self.executor = None
+        if n_workers > 1:
+            log.debug(('Start Scoring Workers', n_workers))
+            self.executor = ProcessPoolExecutor(
+                max_workers=n_workers, initializer=_init_worker,
+                initargs=(model, parallel.split(n_workers)[1]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def predict(self, X):
+        """
+        Predict rows of `X` across the worker pool.
+
+        Parameters:
+            X (ndarray):
+                Feature rows.
+
+        Returns:
+            y (ndarray):
+                Predictions in the row order of `X`.
+        """
+        return self._score('predict', X)
+
+    def predict_proba(self, X):
+        """
+        Class probabilities of rows of `X` across the worker pool.
+
+        Returns:
+            proba (ndarray):
+                Probability per class in `model.classes_` order.
+        """
+        return self._score('predict_proba', X)
+
+    def _score(self, method, X):
+        if self.executor is None or X.shape[0] == 0:
+            return getattr(self.model, method)(X)
+
+        X = np.ascontiguousarray(X)
+        shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+        try:
+            X_shared = np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)
+            X_shared[:] = X
+            del X_shared
+            tasks = [(method, shm.name, X.shape, X.dtype.str, start, stop)
+                     for start, stop in self._shards(X.shape[0])]
+            log.debug(('Score Shards', len(tasks), X.shape))
+            return np.concatenate(list(self.executor.map(_predict_shard,
+                                                         *zip(*tasks))))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _shards(self, row_count):
+        shard_size = self.shard_size or -(-row_count // self.n_workers)
+        return [(start, min(start + shard_size, row_count))
+                for start in range(0, row_count, shard_size)]
+
+
+def _init_worker(model, n_jobs):
+    global _worker_model
+    threadpool_limits(limits=1)
+    _worker_model = parallel.set_n_jobs(model, n_jobs)
+
+
+def _predict_shard(method, shm_name, shape, dtype, start, stop):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Copy the shard out so no view pins the buffer when it is closed
+        X = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        X = X[start:stop].copy()
+    finally:
+        shm.close()
+    return getattr(_worker_model, method)(X)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from . import artifact
+from . import const as C
+
+log = logging.getLogger(__name__)
+
+"""
+Online Prediction Server.
+
+Loads the model artifact once and keeps it warm. Concurrent requests are
+coalesced into micro-batches, so the forest is evaluated once per batch
+rather than once per request. With `C.SRV_VECTORIZED_FOREST` the forest
+is evaluated by a `CompactForest`, whose per call overhead is far lower
+at micro-batch sizes. A newly built model is picked up without
+dropping requests in flight.
+
+Endpoints:
+    POST /predict   JSON `{"rows": [[...], ...]}` or `{"rows": [{...}]}`,
+                    or binary `application/octet-stream` float64 rows
+    GET  /metrics   p50/p99 latency and throughput counters
+    GET  /health    Model version in service
+    POST /reload    Reload the model artifact
+
+python -m p2.server -log INFO --port 8080
+"""
+
+
+class ModelStore:
+    """
+    Hot Reloadable Model.
+    A new artifact is fully loaded before it replaces the one in service.
+    Requests already queued are scored by the model they arrived with.
+    """
+
+    def __init__(self, model_save_path=C.MD_FILE_PATH):
+        self.model_save_path = model_save_path
+        self.current = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """
+        Returns:
+            reloaded (bool):
+                False if the artifact is unchanged since the last load.
+        """
+        with self._lock:
+            mtime = os.path.getmtime(self.model_save_path)
+            if mtime == self._mtime:
+                return False
+            self.current = ServingModel(
+                artifact.load_model(self.model_save_path))
+            self._mtime = mtime
+        log.info(('Model Loaded', self.current.model_version))
+        return True
+
+    def watch(self, interval=C.SRV_RELOAD_INTERVAL):
+        """
+        Reload in the background whenever the artifact file changes.
+        """
+        def _watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception:
+                    # Keep serving the current model
+                    log.exception('Model Reload Failed')
+
+        thread = threading.Thread(target=_watch, daemon=True)
+        thread.start()
+        return thread
+
+
+class ServingModel:
+    """
+    Model artifact with its input schema.
+    """
+
+    def __init__(self, model_artifact):
+        self.model = model_artifact['model']
+        if C.SRV_VECTORIZED_FOREST and not model_artifact.get('compact'):
+            try:
+                self.model = artifact.compact_model(self.model)
+            except ValueError:
+                log.warning(('Model Not Vectorized',
+                             type(self.model).__name__))
+        self.model_version = model_artifact['model_version']
+        self.feature_columns = model_artifact.get('feature_columns')
+        # Positional rows follow the full input schema and are projected
+        # onto the features the model was trained with
+        self.input_columns = model_artifact.get('input_columns') or \
+            self.feature_columns
+        self.feature_index = None
+        if self.input_columns != self.feature_columns:
+            position = {c: i for i, c in enumerate(self.input_columns)}
+            self.feature_index = [position[c] for c in self.feature_columns]
+
+    @property
+    def input_width(self):
+        if self.input_columns is None:
+            return self.model.n_features_in_
+        return len(self.input_columns)
+
+    def to_features(self, rows):
+        """
+        Parameters:
+            rows (list or ndarray):
+                Positional rows of `input_width` values, or dicts keyed by
+                column name. Missing and null values are NaN.
+
+        Returns:
+            X (ndarray):
+                Feature rows in model column order.
+        """
+        if len(rows) and isinstance(rows[0], dict):
+            columns = self.feature_columns
+            return np.array([[_to_float(row.get(c)) for c in columns]
+                             for row in rows], dtype=np.float64)
+        X = np.array([[_to_float(v) for v in row] for row in rows]
+                     if isinstance(rows, list) else rows, dtype=np.float64)
+        X = X.reshape(-1, self.input_width) if X.size else \
+            np.empty((0, self.input_width))
+        if X.shape[1] != self.input_width:
+            raise ValueError('Expected {} values per row, got {}'.format(
+                self.input_width, X.shape[1]))
+        if self.feature_index is not None:
+            X = X[:, self.feature_index]
+        return X
+
+
+class MicroBatcher:
+    """
+    Request Coalescing.
+    Requests already queued, and those arriving within `max_wait_ms` of
+    the first one, up to `max_batch_rows` rows, are scored in a single
+    `predict_proba` call.
+    """
+
+    def __init__(self, store, stats, max_batch_rows=C.SRV_MAX_BATCH_ROWS,
+                 max_wait_ms=C.SRV_MAX_WAIT_MS):
+        self.store = store
+        self.stats = stats
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, rows):
+        """
+        Score `rows` with the model in service. Blocks until the batch
+        holding the rows is scored.
+
+        Returns:
+            prediction (dict):
+                `model_version`, `predictions` and `probabilities`
+        """
+        serving = self.store.current
+        pending = _Pending(serving, serving.to_features(rows))
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            row_count = batch[0].X.shape[0]
+            deadline = time.perf_counter() + self.max_wait
+            while row_count < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        pending = self._queue.get(timeout=timeout)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                row_count += pending.X.shape[0]
+            self._score(batch, row_count)
+
+    def _score(self, batch, row_count):
+        # Rows were projected with the schema of the model in service when
+        # they arrived. Score each schema group with its own model.
+        groups = collections.defaultdict(list)
+        for pending in batch:
+            groups[id(pending.serving)].append(pending)
+        for pendings in groups.values():
+            serving = pendings[0].serving
+            try:
+                X = np.concatenate([p.X for p in pendings])
+                proba = serving.model.predict_proba(X) if X.shape[0] \
+                    else np.empty((0, len(serving.model.classes_)))
+                y = serving.model.classes_.take(proba.argmax(axis=1))
+                probability = proba.max(axis=1)
+                start = 0
+                for p in pendings:
+                    stop = start + p.X.shape[0]
+                    p.result = {
+                        'model_version': serving.model_version,
+                        'predictions': y[start:stop].tolist(),
+                        'probabilities': probability[start:stop].tolist()
+                    }
+                    start = stop
+            except Exception as e:
+                log.exception('Batch Scoring Failed')
+                for p in pendings:
+                    p.error = e
+            for p in pendings:
+                p.done.set()
+        self.stats.record_batch(row_count)
+
+
+class _Pending:
+
+    def __init__(self, serving, X):
+        self.serving = serving
+        self.X = X
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ServerStats:
+    """
+    Latency and throughput counters.
+    Percentiles are taken over the last `window` requests.
+    """
+
+    def __init__(self, window=C.SRV_LATENCY_WINDOW):
+        self.started = time.time()
+        self.latency_ms = collections.deque(maxlen=window)
+        self.request_count = 0
+        self.row_count = 0
+        self.error_count = 0
+        self.batch_count = 0
+        self.batch_row_count = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, latency_ms, row_count, ok=True):
+        with self._lock:
+            self.latency_ms.append(latency_ms)
+            self.request_count += 1
+            self.row_count += row_count
+            self.error_count += not ok
+
+    def record_batch(self, row_count):
+        with self._lock:
+            self.batch_count += 1
+            self.batch_row_count += row_count
+
+    def snapshot(self):
+        with self._lock:
+            latency_ms = np.array(self.latency_ms)
+            uptime = time.time() - self.started
+            p50 = p99 = None
+            if latency_ms.size:
+                p50, p99 = np.percentile(latency_ms, [50, 99]).round(3)
+            return {
+                'request_count': self.request_count,
+                'row_count': self.row_count,
+                'error_count': self.error_count,
+                'batch_count': self.batch_count,
+                'rows_per_batch': round(
+                    self.batch_row_count / self.batch_count, 1)
+                if self.batch_count else None,
+                'latency_p50_ms': p50,
+                'latency_p99_ms': p99,
+                'requests_per_sec': round(self.request_count / uptime, 1),
+                'rows_per_sec': round(self.row_count / uptime, 1),
+                'uptime_sec': round(uptime, 1)
+            }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Set by `make_server`
+    batcher = None
+    store = None
+    stats = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, self.stats.snapshot())
+        elif self.path == '/health':
+            self._send(200, {'status': True,
+                             'model_version':
+                                 self.store.current.model_version})
+        else:
+            self._send(404, {'error': 'Not Found'})
+
+    def do_POST(self):
+        if self.path == '/reload':
+            try:
+                reloaded = self.store.reload()
+            except Exception as e:
+                log.exception('Model Reload Failed')
+                return self._send(500, {'error': str(e)})
+            return self._send(200, {
+                'reloaded': reloaded,
+                'model_version': self.store.current.model_version})
+        if self.path != '/predict':
+            return self._send(404, {'error': 'Not Found'})
+
+        time_start = time.perf_counter()
+        row_count = 0
+        try:
+            status, body = 200, self.batcher.predict(self._read_rows())
+            # Rows as scored. A binary payload is read as a flat array
+            row_count = len(body['predictions'])
+        except (ValueError, TypeError, KeyError) as e:
+            status, body = 400, {'error': str(e)}
+        except Exception as e:
+            status, body = 500, {'error': str(e)}
+        self._send(status, body)
+        self.stats.record_request(
+            (time.perf_counter() - time_start) * 1000, row_count,
+            ok=status == 200)
+
+    def _read_rows(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = self.rfile.read(length)
+        if self.headers.get('Content-Type') == 'application/octet-stream':
+            # Row-major little-endian float64, NaN for missing values
+            if len(payload) % 8:
+                raise ValueError('Binary payload is not float64 rows')
+            return np.frombuffer(payload, dtype='<f8')
+        try:
+            body = json.loads(payload)
+        except json.JSONDecodeError as e:
+            raise ValueError('Invalid JSON - {}'.format(e))
+        if isinstance(body, dict) and 'row' in body:
+            return [body['row']]
+        if not isinstance(body, dict) or 'rows' not in body:
+            raise ValueError('Expected {"rows": [...]} or {"row": ...}')
+        return body['rows']
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Listen backlog. Default of 5 resets connections under load
+    request_queue_size = C.SRV_MAX_BATCH_ROWS
+
+
+def make_server(model_save_path=C.MD_FILE_PATH, host=C.SRV_HOST,
+                port=C.SRV_PORT, max_batch_rows=C.SRV_MAX_BATCH_ROWS,
+                max_wait_ms=C.SRV_MAX_WAIT_MS,
+                reload_interval=C.SRV_RELOAD_INTERVAL):
+    """
+    Prediction Server.
+
+    Parameters:
+        model_save_path (str):
+            Model file that save during model building.
+
+        host (str), port (int):
+            Listen address. Port 0 picks a free port.
+
+        max_batch_rows (int), max_wait_ms (float):
+            Micro-batch limits. Refer to `MicroBatcher`.
+
+        reload_interval (float):
+            Seconds between model file checks. 0 to only reload on
+            `POST /reload`.
+
+    Returns:
+        server (ThreadingHTTPServer):
+            Call `serve_forever` to start serving
+    """
+    store = ModelStore(model_save_path)
+    if reload_interval:
+        store.watch(reload_interval)
+    stats = ServerStats()
+    handler = type('Handler', (PredictionHandler,), {
+        'store': store,
+        'stats': stats,
+        'batcher': MicroBatcher(store, stats, max_batch_rows, max_wait_ms)
+    })
+    return PredictionServer((host, port), handler)
+
+
+def _to_float(value):
+    return np.nan if value is None else float(value)
+
+
+if __name__ == '__main__':
+    from .pipeline import setup_logging
+
+    parser = argparse.ArgumentParser()
+    # Command:
+    # python -m p2.server -log INFO --port 8080
+    parser.add_argument('--host', default=C.SRV_HOST)
+    parser.add_argument('--port', type=int, default=C.SRV_PORT)
+    parser.add_argument('-m', '--model', default=C.MD_FILE_PATH)
+    parser.add_argument('-log', '--log', default='warning')
+    options = parser.parse_args()
+    setup_logging(options.log)
+
+    server = make_server(options.model, options.host, options.port)
+    log.info(('Serving', server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+from . import const as C
+
+log = logging.getLogger(__name__)
+
+"""
+Mergeable Quantile Sketch.
+
+Every update summarizes its rows by `size` evenly spaced order statistics
+per column, each standing for an equal share of the column's non NaN
+values. Two summaries of the same level are merged into one of the next
+level, like the carry of a binary counter, so a sketch of `n` chunks holds
+at most `log2(n) + 1` summaries and every value passes through about
+`log2(n)` merges. The rank error of a quantile stays within about
+`log2(n) / size` of the values, whatever the row count.
+
+Sketches of different chunks, files or processes merge into the sketch of
+all their rows.
+"""
+
+
+class QuantileSketch:
+
+    def __init__(self, size=C.SKETCH_SIZE):
+        """
+        Parameters:
+            size (int):
+                Optional. Order statistics per column and summary.
+                (Default value refer to const.py)
+        """
+        self.size = size
+        self.n_columns = None
+        self.count = None
+        self.nan_count = None
+        self.min = None
+        self.max = None
+        # Level -> (values (n_columns, size) sorted per column,
+        #           weight per value (n_columns, 1))
+        self._levels = {}
+
+    def update(self, X):
+        """
+        Add rows. NaN values are counted but not summarized.
+
+        Parameters:
+            X (ndarray):
+                2D array, rows by columns.
+        """
+        X = np.asarray(X)
+        if X.dtype not in (np.float32, np.float64):
+            X = X.astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        # Columns sorted as contiguous rows, faster than strided along
+        # axis 0
+        return self.update_sorted(np.sort(X.T, axis=1))
+
+    def update_sorted(self, columns):
+        """
+        Add rows given as columns, each sorted with NaN last, ex.
+        `np.sort(X.T, axis=1)`. For callers that also need them sorted.
+
+        Parameters:
+            columns (ndarray):
+                2D array, columns by rows.
+        """
+        if self.n_columns is None:
+            self._init_columns(columns.shape[0])
+        elif columns.shape[0] != self.n_columns:
+            raise ValueError('Sketch has {} columns, got {}'.format(
+                self.n_columns, columns.shape[0]))
+        n_rows = columns.shape[1]
+        if n_rows == 0:
+            return self
+
+        # The first `count` values of a column are valid
+        count = n_rows - np.isnan(columns).sum(axis=1)
+        self.count += count
+        self.nan_count += n_rows - count
+        has_value = count > 0
+        last = np.maximum(count - 1, 0)
+        self.min[has_value] = np.fmin(self.min[has_value],
+                                      columns[has_value, 0])
+        self.max[has_value] = np.fmax(
+            self.max[has_value],
+            columns[np.arange(self.n_columns), last][has_value])
+
+        ranks = np.minimum(
+            ((np.arange(self.size) + 0.5) * count[:, None] / self.size)
+            .astype(np.int64), last[:, None])
+        values = np.take_along_axis(columns, ranks, axis=1)
+        values[~has_value] = np.nan
+        self._push(0, values, (count / self.size)[:, None])
+        return self
+
+    def merge(self, other):
+        """
+        Add the rows summarized by another sketch of the same size.
+        """
+        if other.n_columns is None:
+            return self
+        if other.size != self.size:
+            raise ValueError('Sketch sizes differ: {} and {}'.format(
+                self.size, other.size))
+        if self.n_columns is None:
+            self._init_columns(other.n_columns)
+        self.count += other.count
+        self.nan_count += other.nan_count
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        for level, (values, weights) in sorted(other._levels.items()):
+            self._push(level, values.copy(), weights.copy())
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate quantiles per column.
+
+        Parameters:
+            q (float or list):
+                Quantiles in [0, 1].
+
+        Returns:
+            values (ndarray):
+                (n_columns, ) for a float `q`, otherwise
+                (len(q), n_columns). NaN for columns without a value.
+        """
+        q_array = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        result = np.full((len(q_array), self.n_columns or 0), np.nan)
+        if self._levels:
+            values, weights = self._collapse()
+            cumulative = np.cumsum(weights, axis=1)
+            last = (~np.isnan(values)).sum(axis=1) - 1
+            for j in np.flatnonzero(self.count):
+                # First value whose cumulative weight reaches the rank
+                index = np.searchsorted(cumulative[j],
+                                        q_array * self.count[j])
+                result[:, j] = values[j, np.minimum(index, last[j])]
+            # Extremes are tracked exactly
+            result[q_array <= 0] = self.min
+            result[q_array >= 1] = self.max
+        return result[0] if np.ndim(q) == 0 else result
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def cdf(self, x):
+        """
+        Approximate fraction of the non NaN values <= `x` per column.
+        The inverse of `quantile`.
+
+        Parameters:
+            x (ndarray):
+                (n_columns, ) or (n_points, n_columns) values.
+
+        Returns:
+            fractions (ndarray):
+                Same shape as `x`. NaN for columns without a value.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        points = np.atleast_2d(x)
+        result = np.full(points.shape, np.nan)
+        if self._levels:
+            values, weights = self._collapse()
+            cumulative = np.concatenate(
+                [np.zeros((len(values), 1)), np.cumsum(weights, axis=1)],
+                axis=1)
+            last = (~np.isnan(values)).sum(axis=1)
+            for j in np.flatnonzero(self.count):
+                # Weight of the values <= each point
+                index = np.searchsorted(values[j, :last[j]], points[:, j],
+                                        side='right')
+                result[:, j] = cumulative[j, index] / self.count[j]
+        return result[0] if x.ndim == 1 else result
+
+    def _init_columns(self, n_columns):
+        self.n_columns = n_columns
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.nan_count = np.zeros(n_columns, dtype=np.int64)
+        self.min = np.full(n_columns, np.nan)
+        self.max = np.full(n_columns, np.nan)
+
+    def _push(self, level, values, weights):
+        while level in self._levels:
+            values, weights = self._compact(
+                *self._levels.pop(level), values, weights)
+            level += 1
+        self._levels[level] = (values, weights)
+
+    def _compact(self, values_a, weights_a, values_b, weights_b):
+        """
+        Merge two summaries into `size` evenly spaced values of their
+        combined weighted distribution.
+        """
+        values, weights = self._sorted([(values_a, weights_a),
+                                        (values_b, weights_b)])
+        cumulative = np.cumsum(weights, axis=1)
+        total = cumulative[:, -1]
+        last = (~np.isnan(values)).sum(axis=1) - 1
+        targets = (np.arange(self.size) + 0.5) / self.size
+        compacted = np.full((len(values), self.size), np.nan)
+        for j in np.flatnonzero(total):
+            index = np.searchsorted(cumulative[j], targets * total[j])
+            compacted[j] = values[j, np.minimum(index, last[j])]
+        return compacted, (total / self.size)[:, None]
+
+    def _collapse(self):
+        """
+        All summaries as one weighted value list, sorted per column.
+        """
+        return self._sorted(self._levels.values())
+
+    @staticmethod
+    def _sorted(summaries):
+        values = np.concatenate([v for v, _ in summaries], axis=1)
+        weights = np.concatenate([np.broadcast_to(w, v.shape)
+                                  for v, w in summaries], axis=1)
+        order = np.argsort(values, axis=1)
+        return (np.take_along_axis(values, order, axis=1),
+                np.take_along_axis(weights, order, axis=1))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterSampler, train_test_split
+from sklearn.utils.class_weight import compute_sample_weight
+from . import const as C
+from . import oversample
+from . import parallel
+
+log = logging.getLogger(__name__)
+
+"""
+Random Forest Tuning by Successive Halving.
+
+All candidates start on a small sample with few trees. After each rung
+only the best `1 / factor` candidates are kept, and both the sample count
+and the tree count grow. Surviving forests keep their trees
+and grow new ones with `warm_start` instead of being retrained, and the
+samples of a rung are a superset of the samples of the previous one.
+
+The candidates of a rung are fitted `workers` at a time, each forest with
+an even share of the core budget. Refer to parallel.py.
+"""
+
+RANDOM_GRID = {
+    'max_features': ['sqrt', 'log2'],
+    'max_depth': [int(x) for x in np.linspace(10, 30, num=11)] + [None],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4],
+    'bootstrap': [True, False],
+    'criterion': ['entropy']
+}
+
+
+def successive_halving_search(X, y,
+                              param_distributions=RANDOM_GRID,
+                              n_candidates=C.MD_TUNNING_N_CANDIDATES,
+                              factor=C.MD_TUNNING_FACTOR,
+                              min_estimators=C.MD_TUNNING_MIN_ESTIMATORS,
+                              max_estimators=C.MD_TUNNING_MAX_ESTIMATORS,
+                              min_samples=C.MD_TUNNING_MIN_SAMPLES,
+                              time_budget=C.MD_TUNNING_TIME_BUDGET,
+                              valid_size=C.MD_TUNNING_VALID_SIZE,
+                              refit=True,
+                              oversampling=None,
+                              workers=C.MD_TUNNING_WORKERS,
+                              backend=C.JOBLIB_BACKEND,
+                              random_state=C.MD_RANDOM_STATE):
+    """
+    Successive Halving Search over sample count and `n_estimators`.
+
+    Parameters:
+        X, y:
+            Training data. `valid_size` of it is held out for scoring.
+
+        param_distributions (dict):
+            Optional. Random Forest parameter grid, `n_estimators` excluded.
+
+        n_candidates (int):
+            Optional. Parameter sets sampled for the first rung.
+
+        factor (int):
+            Optional. Candidates kept per rung is `1 / factor`.
+            Samples grow by `factor`.
+
+        min_estimators, max_estimators (int):
+            Optional. Trees per forest on the first and last rung.
+
+        min_samples (int):
+            Optional. Samples on the first rung.
+
+        time_budget (float):
+            Optional. Seconds. No candidate is fitted once the budget is
+            spent, and the best candidate scored so far on the highest
+            rung wins. No limit if value is None.
+
+        refit (bool):
+            Optional. Fit the winning parameters with `max_estimators`
+            trees on all of `X`, the only fit outside the search. The
+            winning forest, fitted without the held out rows, is returned
+            if value is False.
+
+        oversampling (str):
+            Optional. Oversampling method of `X`, refer to oversample.py.
+            Candidates fit with balanced sample weights if value is
+            `weights` or `lazy`, and the refit balances classes the way
+            the method does. Rows are fitted as they are if value is None.
+
+        workers (int):
+            Optional. Candidates fitted at once. Capped by the core budget,
+            each forest fits with `budget // workers` threads.
+
+        backend (str):
+            Optional. joblib backend of the workers, one of
+            `parallel.BACKENDS`. (Default value refer to const.py)
+
+        random_state (int):
+            Optional. (Default value refer to const.py)
+
+    Returns:
+        classifier (RandomForestClassifier):
+            Best forest
+
+        search (dict):
+            Best parameters and score, rungs run and candidates evaluated
+    """
+    time_start = time.time()
+    X_fit, X_valid, y_fit, y_valid = train_test_split(
+        X, y, test_size=valid_size, stratify=y, random_state=random_state)
+    # Prefixes of a stratified order make nested, class balanced samples
+    order = _stratified_order(y_fit, np.random.default_rng(random_state))
+    balanced = oversampling in ('weights', 'lazy')
+    workers, forest_n_jobs = parallel.split(workers)
+    log.debug(('Tunning Workers', workers, forest_n_jobs, backend))
+
+    candidates = [{'params': params, 'score': None, 'forest': None}
+                  for params in ParameterSampler(param_distributions,
+                                                 n_candidates,
+                                                 random_state=random_state)]
+    n_rungs = max(1, math.ceil(math.log(n_candidates, factor)) + 1)
+    rungs = []
+    best = None
+    out_of_time = False
+    for rung in range(n_rungs):
+        # Trees grow geometrically from min to max, samples by `factor`
+        # up to all rows on the last rung
+        n_estimators = round(min_estimators * (max_estimators / min_estimators)
+                             ** (rung / max(1, n_rungs - 1)))
+        n_samples = min(len(order), max(min_samples, math.ceil(
+            len(order) * factor ** (rung - n_rungs + 1))))
+        sample = order[:n_samples]
+        log.debug(('Rung', rung, len(candidates), n_estimators, n_samples))
+
+        X_sample, y_sample = X_fit[sample], y_fit[sample]
+        sample_weight = compute_sample_weight('balanced', y_sample) \
+            if balanced else None
+        scored = []
+        pending = []
+        for candidate in candidates:
+            forest = candidate['forest']
+            if forest is not None and \
+                    len(forest.estimators_) >= n_estimators:
+                # No new trees to grow, the score stands
+                scored.append(candidate)
+            else:
+                pending.append(candidate)
+        for start in range(0, len(pending), workers):
+            if (best or scored) and _spent(time_start, time_budget):
+                out_of_time = True
+                break
+            batch = pending[start:start + workers]
+            fitted = Parallel(n_jobs=len(batch), backend=backend)(
+                delayed(_fit_candidate)(
+                    candidate['forest'] or RandomForestClassifier(
+                        warm_start=True, random_state=random_state,
+                        **candidate['params']),
+                    n_estimators, forest_n_jobs, X_sample, y_sample,
+                    sample_weight, X_valid, y_valid)
+                for candidate in batch)
+            for candidate, (forest, score) in zip(batch, fitted):
+                candidate.update(forest=forest, score=score)
+                scored.append(candidate)
+
+        if scored:
+            rungs.append({'rung': rung,
+                          'candidates': len(scored),
+                          'n_estimators': n_estimators,
+                          'n_samples': n_samples,
+                          'best_score': max(c['score'] for c in scored)})
+            scored.sort(key=lambda c: c['score'], reverse=True)
+            best = scored[0]
+            candidates = scored[:max(1, len(scored) // factor)]
+        if out_of_time:
+            break
+
+    classifier = best['forest']
+    if refit:
+        classifier = clone(classifier).set_params(
+            n_estimators=max_estimators, warm_start=False,
+            n_jobs=parallel.n_jobs())
+        oversample.fit_balanced(classifier, X, y, oversampling,
+                                random_state=random_state)
+    else:
+        classifier.set_params(warm_start=False, n_jobs=parallel.n_jobs())
+
+    search = {
+        'best_params': best['params'],
+        'best_score': best['score'],
+        'rungs': rungs,
+        'candidates_evaluated': sum(r['candidates'] for r in rungs),
+        'out_of_time': out_of_time,
+        'workers': workers,
+        'forest_n_jobs': forest_n_jobs,
+        'seconds': round(time.time() - time_start, 1)
+    }
+    log.debug(('Successive Halving', search))
+    return classifier, search
+
+
+def _fit_candidate(forest, n_estimators, n_jobs, X, y, sample_weight,
+                   X_valid, y_valid):
+    """
+    Grow `forest` to `n_estimators` trees and score it.
+
+    Returns:
+        forest, score
+    """
+    # Keeps the trees grown on earlier rungs and adds the rest
+    forest.set_params(n_estimators=n_estimators, n_jobs=n_jobs)
+    forest.fit(X, y, sample_weight=sample_weight)
+    return forest, accuracy_score(y_valid, forest.predict(X_valid))
+
+
+def _spent(time_start, time_budget):
+    return time_budget is not None and time.time() - time_start > time_budget
+
+
+def _stratified_order(y, rng):
+    """
+    Row order where every prefix holds each class in about its overall
+    proportion.
+    """
+    position = np.empty(len(y))
+    for label in np.unique(y):
+        index = np.flatnonzero(y == label)
+        position[index] = (rng.permutation(len(index)) + rng.random()) \
+            / len(index)
+    return np.argsort(position, kind='stable')
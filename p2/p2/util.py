@@ -2,20 +2,88 @@
 # -*- coding: utf-8 -*-
 
 import time
+import json
 import logging
 import psutil
 import os
+import sqlite3
+import numpy as np
+from . import const as C
 
 log = logging.getLogger(__name__)
 
+# One id per process run, to trend metrics across nightly runs
+RUN_ID = '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), os.getpid())
+
+# Peak RSS of open measurements, kept across `reset_peak_rss`
+_open_peaks = []
+
+# Peak RSS since the last `reset_peak_rss`, kept across the resets of
+# nested measurements
+_reset_peak = 0.0
+
 
 def get_duration_msg(start_time: time):
     end_time = time.time()
     return '{} seconds'.format(round(end_time - start_time))
 
 
-def store_metric(metrics: dict):
+def store_metric(metrics: dict, kind='stage', metrics_path=None):
+    """
+    Log metrics and append them to the metrics sink.
+
+    Parameters:
+        metrics (dict):
+            Stage result or instrument span.
+
+        kind (str):
+            Optional. Record type. Ex. `stage`, `span`.
+
+        metrics_path (str):
+            Optional. JSON lines file, or SQLite table `metrics` if the
+            path ends with `.db`. Not stored if value and
+            `C.METRICS_PATH` are None.
+    """
     log.info(('metrics:', metrics))
+    metrics_path = metrics_path or C.METRICS_PATH
+    if metrics is None or not metrics_path:
+        return
+    record = {
+        'run_id': RUN_ID,
+        'kind': kind,
+        'name': metrics.get('func_name') or metrics.get('name'),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'metrics': metrics
+    }
+    data = json.dumps(record, default=_to_json)
+    if metrics_path.endswith('.db'):
+        _store_metric_sqlite(metrics_path, record, data)
+    else:
+        with open(metrics_path, 'a') as f:
+            f.write(data + '\n')
+
+
+def _store_metric_sqlite(metrics_path, record, data):
+    metrics = record['metrics']
+    with sqlite3.connect(metrics_path) as connection:
+        connection.execute(
+            'create table if not exists metrics (run_id text, kind text, '
+            'name text, recorded_at text, seconds real, peak_rss_mb real, '
+            'rows integer, data text)')
+        connection.execute(
+            'insert into metrics values (?, ?, ?, ?, ?, ?, ?, ?)',
+            (record['run_id'], record['kind'], record['name'],
+             record['recorded_at'], metrics.get('seconds'),
+             metrics.get('peak_rss_mb'), metrics.get('rows'), data))
+    connection.close()
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
 
 
 def file_exists_check(path, error_msg='File Not Found'):
@@ -24,10 +92,109 @@ def file_exists_check(path, error_msg='File Not Found'):
     return True
 
 
+def save_array(path, arr):
+    """
+    Save array as binary .npy. Written through a memory map so the
+    pages land in the OS cache for the next step to map directly.
+    """
+    arr = np.ascontiguousarray(arr)
+    # A new file, not the old one rewritten, which may be linked from the
+    # stage cache or still mapped by a reader
+    delete_file(path)
+    out = np.lib.format.open_memmap(path, mode='w+',
+                                    dtype=arr.dtype, shape=arr.shape)
+    out[:] = arr
+    out.flush()
+    del out
+
+
+def load_array(path, mmap_mode='r'):
+    """
+    Load array saved by `save_array` memory-mapped, without parsing.
+    Text files from older runs are still read with `np.loadtxt`.
+    """
+    file_exists_check(path)
+    if not path.endswith('.npy'):
+        return np.loadtxt(path)
+    return np.load(path, mmap_mode=mmap_mode)
+
+
 def delete_file(path):
     if os.path.exists(path):
         os.remove(path)
 
 
 def get_memroy_percent():
-    return psutil.virtual_memory()[2]
\ No newline at end of file
+    return psutil.virtual_memory()[2]
+
+
+def get_rss_mb():
+    rss = psutil.Process(os.getpid()).memory_info().rss
+    return round(rss / 1024 / 1024, 1)
+
+
+def reset_peak_rss():
+    """
+    Restart the peak RSS of the process from its current RSS, so a stage
+    reports its own peak. Linux only, elsewhere the peak stays the peak
+    since process start. Open measurements keep the peak seen so far.
+    """
+    global _reset_peak
+    _clear_peak_rss()
+    _reset_peak = 0.0
+
+
+def get_peak_rss_mb():
+    """
+    Peak RSS since process start or the last `reset_peak_rss`, including
+    the peaks of nested measurements started since.
+    Current RSS where the peak is not available.
+    """
+    return max(_reset_peak, _read_peak_rss_mb())
+
+
+def start_peak_rss():
+    """
+    Start a nested peak RSS measurement, ended by `stop_peak_rss`.
+    """
+    _clear_peak_rss()
+    _open_peaks.append(0.0)
+
+
+def stop_peak_rss():
+    """
+    Returns:
+        peak_rss_mb (float):
+            Peak RSS since the matching `start_peak_rss`
+    """
+    return max(_open_peaks.pop(), _read_peak_rss_mb())
+
+
+def _clear_peak_rss():
+    """
+    Restart the process peak RSS. Open measurements and the peak since the
+    last `reset_peak_rss` keep the peak seen so far.
+    """
+    global _reset_peak
+    peak = _read_peak_rss_mb()
+    _open_peaks[:] = [max(p, peak) for p in _open_peaks]
+    _reset_peak = max(_reset_peak, peak)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _read_peak_rss_mb():
+    """
+    Process peak RSS, VmHWM, since the last clear.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return get_rss_mb()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import os
+from p2 import cache
+from p2 import pipeline
+from p2 import const as C
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_cache.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def test_run_stage_cache_hit(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_run_stage_cache_hit
+    """
+    cache_dir = str(tmp_path / 'cache')
+    input_path = str(tmp_path / 'input.txt')
+    output_path = str(tmp_path / 'output.txt')
+    calls = []
+
+    def stage():
+        calls.append(1)
+        with open(input_path) as f_in, open(output_path, 'w') as f:
+            f.write(f_in.read())
+        return {'status': True}
+
+    with open(input_path, 'w') as f:
+        f.write('v1')
+    args = dict(input_paths=[input_path], output_paths=[output_path],
+                cache_dir=cache_dir)
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is False
+
+    # Unchanged input restores the output without running the stage
+    os.remove(output_path)
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is True
+    assert os.path.exists(output_path)
+    assert len(calls) == 1
+
+    # Changed input runs the stage again
+    with open(input_path, 'w') as f:
+        f.write('v2')
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is False
+    assert len(calls) == 2
+
+    # Outputs are linked, not copied. Rewriting a restored output leaves
+    # its entry as it was
+    result = cache.run_stage('stage', stage, **args)
+    entry_path = os.path.join(cache_dir, result['cache_key'], 'output.txt')
+    assert os.path.samefile(entry_path, output_path)
+    with open(input_path, 'w') as f:
+        f.write('v1')
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is True
+    with open(entry_path) as f:
+        assert f.read() == 'v2'
+    with open(output_path) as f:
+        assert f.read() == 'v1'
+
+
+def test_run_stage_failure_not_cached(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_run_stage_failure_not_cached
+    """
+    cache_dir = str(tmp_path / 'cache')
+    result = cache.run_stage('stage', lambda: {'status': False},
+                             cache_dir=cache_dir)
+    assert 'cache_hit' not in result
+    assert not os.path.exists(cache_dir) or not os.listdir(cache_dir)
+
+
+def test_store_larger_than_cache(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_store_larger_than_cache
+    """
+    cache_dir = str(tmp_path / 'cache')
+    output_path = str(tmp_path / 'output.bin')
+    with open(output_path, 'wb') as f:
+        f.write(b'0' * 1024 * 1024)
+    assert cache.store('a', [output_path], {'status': True}, cache_dir,
+                       max_size_mb=0.5) is False
+    assert not os.path.exists(os.path.join(cache_dir, 'a'))
+    assert cache.store('a', [output_path], {'status': True}, cache_dir,
+                       max_size_mb=2) is True
+
+
+def test_evict_least_recently_used(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_evict_least_recently_used
+    """
+    cache_dir = str(tmp_path / 'cache')
+    output_path = str(tmp_path / 'output.bin')
+    with open(output_path, 'wb') as f:
+        f.write(b'0' * 1024 * 1024)
+    for key in ['a', 'b', 'c']:
+        cache.store(key, [output_path], {'status': True}, cache_dir,
+                    max_size_mb=100)
+    # Use `a` so `b` becomes the least recently used entry
+    cache.restore('a', [output_path], cache_dir)
+    os.utime(os.path.join(cache_dir, 'b', 'result.pkl'), (0, 0))
+
+    cache.evict(cache_dir, max_size_mb=2.5)
+    assert sorted(os.listdir(cache_dir)) == ['a', 'c']
+
+
+def test_file_fingerprint_memoized(tmp_path, monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_file_fingerprint_memoized
+    """
+    path = str(tmp_path / 'input.txt')
+    with open(path, 'w') as f:
+        f.write('v1')
+    opened = []
+
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return open(*args, **kwargs)
+
+    monkeypatch.setattr(cache, 'open', counting_open, raising=False)
+    # Just written, it may still change within its time stamp resolution
+    fingerprint = cache.file_fingerprint(path)
+    assert cache.file_fingerprint(path) == fingerprint
+    assert len(opened) == 2
+
+    monkeypatch.setattr(cache, '_RACY_NS', 0)
+    fingerprint = cache.file_fingerprint(path)
+    assert cache.file_fingerprint(path) == fingerprint
+    assert len(opened) == 3
+
+    # A new file is hashed again
+    os.remove(path)
+    with open(path, 'w') as f:
+        f.write('v2.1')
+    assert cache.file_fingerprint(path) != fingerprint
+    assert len(opened) == 4
+
+
+def test_run_stage_constants(tmp_path, monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_run_stage_constants
+    """
+    args = dict(constants=['MD_RANDOM_STATE'],
+                cache_dir=str(tmp_path / 'cache'))
+
+    def stage():
+        return {'status': True}
+
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is False
+    # Settings the stage does not declare leave it cached
+    monkeypatch.setattr(C, 'SRV_PORT', C.SRV_PORT + 1)
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is True
+    monkeypatch.setattr(C, 'MD_RANDOM_STATE', C.MD_RANDOM_STATE + 1)
+    assert cache.run_stage('stage', stage, **args)['cache_hit'] is False
+
+
+def test_pipeline_stage_constants():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_cache.py::test_pipeline_stage_constants
+    """
+    for constants in [pipeline._DATA_PROCESS_CONSTANTS,
+                      pipeline._MODEL_BUILD_CONSTANTS,
+                      pipeline._MODEL_BUILD_OUT_OF_CORE_CONSTANTS]:
+        assert all(hasattr(C, name) for name in constants)
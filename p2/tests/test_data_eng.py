@@ -3,7 +3,11 @@
 import pytest
 import logging
 import os
+import numpy as np
+import pandas as pd
 from p2 import data_eng as data_eng
+from p2 import util
+from p2 import const as C
 
 """
 Unit Test - Module Level
@@ -41,13 +45,29 @@ def test_data_file_check():
         tests/test_data_eng.py::test_data_file_check
     """
     test_data_file = '../Q6_data.csv'
-    result, df = data_eng.data_file_check(data_file_path=test_data_file)
+    result, df = data_eng.data_file_check(data_file_path=test_data_file,
+                                          load_data=True)
     log.debug(result)
     assert result is not None
     assert df is not None
     assert result['status'] is True
 
 
+def test_data_file_check_stream():
+    """
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_data_file_check_stream
+    """
+    test_data_file = '../Q6_data.csv'
+    result, df = data_eng.data_file_check(data_file_path=test_data_file)
+    log.debug(result)
+    assert df is None
+    assert result['status'] is True
+    assert result['value_range'][1] is True
+    assert len(result['column_stats']) == C.DATA_FILE_COL_COUNT
+
+
 def test_process_data():
     """
     Command:
@@ -62,3 +82,110 @@ def test_process_data():
     assert result['status'] is True
     assert X is not None
     assert y is not None
+
+
+def test_data_file_check_parquet():
+    """
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_data_file_check_parquet
+    """
+    result = data_eng.fetch_data_from_mssql()
+    assert result['path'].endswith('.parquet')
+
+    # Counts come from Parquet metadata, the frame is not loaded
+    result, df = data_eng.data_file_check()
+    log.debug(result)
+    assert result['status'] is True
+    assert df is None
+
+
+def test_read_data_file_columns():
+    """
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_read_data_file_columns
+    """
+    data_eng.fetch_data_from_mssql()
+    df = data_eng.read_data_file(columns=['0', '1', 'target'])
+    assert list(df.columns) == ['0', '1', 'target']
+    assert df['0'].dtype == C.DATA_FILE_FLOAT_DTYPE
+
+
+def test_process_data_low_memory():
+    """
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_process_data_low_memory
+    """
+    test_data_file = '../Q6_data.csv'
+    result, X, y = data_eng.process_data(data_file_path=test_data_file,
+                                         low_memory=True)
+    log.debug(result)
+
+    assert result['status'] is True
+    assert result['peak_rss_mb'] > 0
+    assert X.dtype == np.float32
+    assert X.flags['C_CONTIGUOUS']
+    assert not np.isnan(X).any()
+    assert X.shape[0] == y.shape[0]
+
+
+def test_read_feature_array(tmp_path):
+    """
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_read_feature_array
+    """
+    df = pd.DataFrame({'0': [1.5, np.nan, 3.0], '1': [4.0, 5.0, 6.0],
+                       'target': [0, 1, 0]})
+    parquet_file = str(tmp_path / 'data.parquet')
+    csv_file = str(tmp_path / 'data.csv')
+    df.to_parquet(parquet_file)
+    df.to_csv(csv_file, index=False)
+
+    for path in [parquet_file, csv_file]:
+        X, y, feature_columns = data_eng.read_feature_array(path)
+        assert feature_columns == ['0', '1']
+        assert X.dtype == np.float32 and X.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(X, df[['0', '1']].to_numpy())
+        np.testing.assert_array_equal(y, [0, 1, 0])
+
+        X, _, feature_columns = data_eng.read_feature_array(path, ['1'])
+        assert feature_columns == ['1'] and X.shape == (3, 1)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'),
+                    reason='Peak RSS reset is Linux only')
+def test_process_data_peak_rss(tmp_path, monkeypatch):
+    """
+    Stage peak RSS covers an allocation inside a sub-step span, though
+    later sub-steps restart the process peak.
+
+    Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_data_eng.py::test_process_data_peak_rss
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(1000, 5)),
+                      columns=[str(i) for i in range(5)])
+    df['target'] = rng.integers(0, 2, 1000)
+    data_file = str(tmp_path / 'data.parquet')
+    df.to_parquet(data_file)
+    resample = data_eng.oversample.resample
+
+    def resample_allocating(X, y, method):
+        # Inside the process_data.oversample span
+        buffer = np.ones((2000, 10000))
+        del buffer
+        return resample(X, y, method)
+
+    monkeypatch.setattr(data_eng.oversample, 'resample',
+                        resample_allocating)
+    baseline = util.get_rss_mb()
+    result, _, _ = data_eng.process_data(
+        data_file, *[str(tmp_path / name) for name in (
+            'X.npy', 'y.npy', 'imputer.pkl', 'columns.json')],
+        imputer_stats_path=str(tmp_path / 'imputer_stats.json'))
+    assert result['status'] is True
+    assert result['peak_rss_mb'] >= baseline + 100
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from p2 import db
+from p2 import const as C
+
+"""
+Runs against a local SQLite stand-in, no MySQL required.
+python -m pytest -s --log-cli-level=DEBUG tests/test_db.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture()
+def db_url(tmp_path):
+    db_url = 'sqlite:///{}'.format(tmp_path / 'micron.db')
+    df = pd.DataFrame(np.arange(2500 * 3).reshape(-1, 3),
+                      columns=['0', '1', 'target'])
+    df.to_sql('q6_data', db.get_engine(db_url), index=False)
+    yield db_url
+    db.dispose_engines()
+
+
+def test_get_engine_shared(db_url):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_db.py::test_get_engine_shared
+    """
+    assert db.get_engine(db_url) is db.get_engine(db_url)
+
+
+def test_read_sql_chunks(db_url):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_db.py::test_read_sql_chunks
+    """
+    chunks = list(db.read_sql_chunks('select * from q6_data', 1000,
+                                     engine=db.get_engine(db_url)))
+    assert [df.shape[0] for df in chunks] == [1000, 1000, 500]
+
+    chunks = list(db.read_sql_chunks('select * from q6_data where "0" > :v',
+                                     1000, params={'v': 7494},
+                                     engine=db.get_engine(db_url)))
+    assert [df.shape[0] for df in chunks] == [1]
+
+
+@pytest.mark.parametrize('method', ['batch', 'multi'])
+def test_result_writer(db_url, method):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_db.py::test_result_writer
+    """
+    engine = db.get_engine(db_url)
+    df = pd.DataFrame({'target': np.arange(2500) % 5,
+                       'probability': np.linspace(0, 1, 2500)})
+    for run in range(2):
+        writer = db.ResultWriter('q6_data_result', engine, method=method,
+                                 batch_size=300)
+        for start in range(0, 2500, 1000):
+            writer.write(df.iloc[start:start + 1000])
+            # Result table is only replaced on commit
+            assert run == 1 or \
+                not sa.inspect(engine).has_table('q6_data_result')
+        writer.commit()
+        assert writer.row_count == 2500
+        assert writer.write_seconds > 0
+
+    stored = pd.read_sql('select * from q6_data_result', engine)
+    assert stored.shape == (2500, 3)
+    assert (stored[C.DB_KEY_COLUMN] == df.index).all()
+    assert (stored['target'] == df['target']).all()
+    assert sa.inspect(engine).get_table_names() == \
+        ['q6_data', 'q6_data_result']
+
+    writer = db.ResultWriter('q6_data_result', engine, method=method,
+                             atomic=False)
+    upsert = df.iloc[:10].copy()
+    upsert['target'] = 9
+    writer.upsert(upsert)
+    stored = pd.read_sql('select * from q6_data_result', engine)
+    assert stored.shape == (2500, 3)
+    assert (stored['target'] == 9).sum() == 10
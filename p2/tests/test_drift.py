@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from p2 import drift
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_drift.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def _frame(rng, rows, shift=0.0, nan_rate=0.0):
+    df = pd.DataFrame({
+        'stable': rng.standard_normal(rows),
+        'shifted': rng.standard_normal(rows) + shift,
+        'skewed': rng.exponential(size=rows),
+        'target': rng.integers(0, 5, rows),
+        'name': ['row'] * rows})
+    df.loc[rng.random(rows) < nan_rate, 'skewed'] = np.nan
+    return df
+
+
+def _profile(df, chunk_size=5000, **params):
+    profile = drift.DataProfile(**params)
+    for start in range(0, len(df), chunk_size):
+        profile.update(df.iloc[start:start + chunk_size])
+    return profile
+
+
+def test_data_profile():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_drift.py::test_data_profile
+    """
+    rng = np.random.default_rng(0)
+    df = _frame(rng, 40000, nan_rate=0.1)
+    profile = _profile(df)
+    assert profile.columns == ['stable', 'shifted', 'skewed', 'target']
+    assert profile.row_count == 40000
+    stats = profile.column_stats()
+    assert stats['skewed']['null_count'] == df['skewed'].isna().sum()
+    assert stats['target']['min'] == 0 and stats['target']['max'] == 4
+    assert abs(stats['stable']['median']) < 0.05
+    np.testing.assert_array_equal(profile.histogram.sum(axis=1),
+                                  profile.sketch.count)
+    # Deciles of the first chunk as bins
+    fractions = profile.histogram[0] / profile.histogram[0].sum()
+    np.testing.assert_allclose(fractions, 0.1, atol=0.02)
+
+    # Profiles of parts merge into the profile of all rows
+    first = _profile(df.iloc[:20000])
+    second = _profile(df.iloc[20000:], reference=first)
+    merged = drift.DataProfile().merge(first).merge(second)
+    assert merged.row_count == 40000
+    np.testing.assert_array_equal(merged.sketch.nan_count,
+                                  profile.sketch.nan_count)
+    np.testing.assert_array_equal(merged.histogram.sum(axis=1),
+                                  profile.histogram.sum(axis=1))
+    with pytest.raises(ValueError):
+        merged.merge(_profile(df.iloc[5000:10000]))
+
+
+def test_drift(tmp_path, monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_drift.py::test_drift
+    """
+    rng = np.random.default_rng(1)
+    monkeypatch.setattr(drift.C, 'DATA_PROFILE_DIR', str(tmp_path))
+    reference = _profile(_frame(rng, 40000))
+    current = _profile(_frame(rng, 30000, shift=1.0, nan_rate=0.2),
+                       reference=reference)
+    scores = drift.compare(reference, current)
+    log.debug(('Drift', scores))
+    assert set(scores) == {'stable', 'shifted', 'skewed', 'target'}
+    assert scores['stable']['psi'] < 0.02
+    assert scores['target']['psi'] < 0.02
+    assert scores['shifted']['psi'] > 0.5
+    assert abs(scores['shifted']['ks'] - 0.38) < 0.03
+    assert scores['stable']['ks'] < 0.03
+    assert abs(scores['skewed']['null_rate_delta'] - 0.2) < 0.01
+    assert scores['skewed']['psi'] < 0.02
+
+    # Bins other than the reference's are estimated from the sketch
+    unbinned = _profile(_frame(rng, 30000, shift=1.0))
+    estimated = drift.compare(reference, unbinned)
+    assert abs(estimated['shifted']['psi'] - scores['shifted']['psi']) < 0.1
+    assert estimated['stable']['psi'] < 0.02
+
+    # Drift of persisted profiles is reported, it never fails the check
+    reference_path = str(tmp_path / 'reference.pkl')
+    profile_path = str(tmp_path / 'profile.pkl')
+    drift.save_profile(current, 'fetch', profile_path)
+    result = drift.check_drift(profile_path, reference_path)
+    assert result['status'] is True
+    assert result['drift_detected'] is False
+    assert result['reference'] is None
+    assert result['peak_rss_mb'] > 0
+
+    drift.save_profile(reference, 'fetch', reference_path)
+    result = drift.check_drift(profile_path, reference_path)
+    assert result['drifted_columns'] == ['shifted']
+    assert result['drifted_share'] == 0.25
+    assert result['drift_detected'] is True
+    assert result['status'] is True
+    monkeypatch.setattr(drift.C, 'DRIFT_MAX_DRIFTED_SHARE', 0.5)
+    result = drift.check_drift(profile_path, reference_path)
+    assert result['drift_detected'] is False
+    assert len(list(tmp_path.glob('*_fetch.pkl'))) == 1
+
+    # Accepted as the reference, the profile has no drift
+    monkeypatch.setattr(drift.C, 'DRIFT_MAX_DRIFTED_SHARE', 0.2)
+    drift.set_reference(profile_path, reference_path)
+    result = drift.check_drift(profile_path, reference_path)
+    assert result['drifted_columns'] == []
+    assert result['drift_detected'] is False
+
+
+def test_save_profile_keep(tmp_path, monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_drift.py::test_save_profile_keep
+    """
+    monkeypatch.setattr(drift.C, 'DATA_PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(drift.C, 'DATA_PROFILE_KEEP', 2)
+    profile = _profile(_frame(np.random.default_rng(0), 100))
+    paths = [drift.save_profile(profile, source)
+             for source in ['fetch', 'inference']]
+    # Make the first profile the oldest
+    os.utime(paths[0], (0, 0))
+    paths.append(drift.save_profile(profile, 'newest'))
+    assert sorted(str(p) for p in tmp_path.iterdir()) == sorted(paths[1:])
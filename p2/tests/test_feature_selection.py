@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+from p2 import model_build as mb
+
+"""
+No DB required.
+python -m pytest -s --log-cli-level=DEBUG tests/test_feature_selection.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def test_select_features():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_feature_selection.py::test_select_features
+    """
+    importances = [0.05, 0.5, 0.02, 0.3, 0.13]
+    assert list(mb.select_features(importances, 0.8)) == [1, 3]
+    assert list(mb.select_features(importances, 0.9)) == [1, 3, 4]
+    assert list(mb.select_features(importances, 1.0)) == [0, 1, 2, 3, 4]
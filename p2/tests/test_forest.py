@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pickle
+import logging
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from p2 import artifact
+from p2 import forest as forest_module
+from p2.forest import CompactForest
+from p2.scoring import ParallelScorer
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_forest.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope='module')
+def forest_and_data():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((4000, 30))
+    y = (X[:, 0] > 0).astype(int) + (X[:, 1] > 1).astype(int) + \
+        (rng.random(4000) < 0.05)
+    forest = RandomForestClassifier(n_estimators=8, min_samples_leaf=2,
+                                    max_depth=26, random_state=0)
+    forest.fit(X[:3000], y[:3000])
+    return forest, X[3000:]
+
+
+def test_compact_forest(forest_and_data):
+    """
+    Same probabilities as the forest, smaller with float32 thresholds and
+    pruning.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_forest.py::test_compact_forest
+    """
+    forest, X = forest_and_data
+    compact = CompactForest.from_forest(forest)
+    np.testing.assert_array_equal(compact.predict_proba(X),
+                                  forest.predict_proba(X))
+    np.testing.assert_array_equal(compact.predict(X), forest.predict(X))
+    assert compact.n_nodes_ == compact.n_forest_nodes_
+    assert compact.nbytes < len(pickle.dumps(forest)) / 2
+    with pytest.raises(TypeError, match='from_forest'):
+        compact.fit(X, forest.predict(X))
+
+    # float32 thresholds route float32 features exactly as before
+    compact32 = CompactForest.from_forest(forest, threshold_dtype='float32')
+    assert compact32.threshold_.dtype == np.float32
+    assert compact32.nbytes < compact.nbytes
+    X_edges = forest.estimators_[0].tree_.threshold[:20]
+    X_edges = np.tile(X_edges.astype(np.float32)[:, None], (1, X.shape[1]))
+    for X_check in (X, X_edges):
+        np.testing.assert_array_equal(compact32.predict_proba(X_check),
+                                      forest.predict_proba(X_check))
+
+    pruned = CompactForest.from_forest(forest, prune_tolerance=0.5)
+    log.debug(('Nodes', compact.n_nodes_, 'Pruned', pruned.n_nodes_))
+    assert pruned.n_nodes_ < compact.n_nodes_
+    assert np.abs(pruned.predict_proba(X) -
+                  forest.predict_proba(X)).max() <= 0.5
+    assert (pruned.predict(X) == forest.predict(X)).mean() > 0.95
+
+
+def test_compact_artifact(forest_and_data, tmp_path):
+    """
+    Compact artifact is memory-mapped on load, and scoring workers map it
+    rather than receive a copy.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_forest.py::test_compact_artifact
+    """
+    forest, X = forest_and_data
+    model = Pipeline([('scaler', StandardScaler().fit(X)),
+                      ('classifier', forest)])
+    path = str(tmp_path / 'model.sav')
+    artifact.save_model(model, path, compact=True)
+    loaded = artifact.load_model(path)
+    compact = loaded['model'].named_steps['classifier']
+    assert loaded['compact'] is True
+    assert isinstance(compact, CompactForest)
+    assert isinstance(compact.threshold_, np.memmap)
+    # The saved pipeline still holds the forest
+    assert model.named_steps['classifier'] is forest
+    np.testing.assert_array_equal(loaded['model'].predict_proba(X),
+                                  model.predict_proba(X))
+
+    state = pickle.dumps(loaded['model'])
+    assert len(state) < compact.nbytes / 2
+    assert isinstance(pickle.loads(state).named_steps['classifier']
+                      .value_, np.memmap)
+    with ParallelScorer(loaded['model'], n_workers=2) as scorer:
+        np.testing.assert_array_equal(scorer.predict(X), model.predict(X))
+
+    # Compressed to ship, read in full
+    compressed_path = str(tmp_path / 'model_compressed.sav')
+    artifact.save_model(model, compressed_path, compact=True, compress=3)
+    compressed = artifact.load_model(compressed_path)
+    assert artifact.artifact_size_mb(compressed_path) < \
+        artifact.artifact_size_mb(path)
+    assert not isinstance(compressed['model'].named_steps['classifier']
+                          .threshold_, np.memmap)
+    np.testing.assert_array_equal(compressed['model'].predict(X),
+                                  model.predict(X))
+
+
+def test_vectorized_forest(forest_and_data, monkeypatch):
+    """
+    All trees walked together give the forest's results, whatever the
+    batch size.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_forest.py::test_vectorized_forest
+    """
+    forest, X = forest_and_data
+    compact = CompactForest.from_forest(forest)
+    for X_batch in (X[:1], X[:100]):
+        np.testing.assert_array_equal(compact.predict_proba(X_batch),
+                                      forest.predict_proba(X_batch))
+    assert compact.predict_proba(X[:0]).shape == (0, len(forest.classes_))
+    # Rows walked in blocks
+    monkeypatch.setattr(forest_module, 'BLOCK_ROWS', 64)
+    np.testing.assert_array_equal(compact.predict_proba(X),
+                                  forest.predict_proba(X))
+    leaves = compact.apply(X)
+    assert leaves.shape == (len(X), len(forest.estimators_))
+    assert (leaves >= compact.n_internal_).all()
+    # Leaf values are the trees' own probabilities
+    for i, tree in enumerate(forest.estimators_):
+        np.testing.assert_array_equal(
+            compact.value_[leaves[:, i] - compact.n_internal_],
+            tree.predict_proba(X))
+
+    # Trees of a single leaf
+    stumps = RandomForestClassifier(n_estimators=3, max_depth=1,
+                                    random_state=0)
+    stumps.fit(X[:50], np.zeros(50, dtype=int))
+    np.testing.assert_array_equal(
+        CompactForest.from_forest(stumps).predict_proba(X[:5]),
+        stumps.predict_proba(X[:5]))
+
+    with pytest.raises(ValueError):
+        compact.predict(X[:, :-1])
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import pickle
+import time
+import numpy as np
+from sklearn.impute import SimpleImputer
+from p2.impute import MedianImputer
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_impute.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def _q6_like(row_count, random_state=0):
+    rng = np.random.default_rng(random_state)
+    X = rng.standard_normal((row_count, 151))
+    X[:, :10] = rng.exponential(size=(row_count, 10))
+    X[rng.random(X.shape) < 0.01] = np.nan
+    return X
+
+
+def test_median_imputer():
+    """
+    Approximate medians against exact medians. Fit time against
+    SimpleImputer is logged.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_impute.py::test_median_imputer
+    """
+    X = _q6_like(100000)
+
+    time_start = time.perf_counter()
+    exact = SimpleImputer(strategy='median').fit(X)
+    exact_seconds = time.perf_counter() - time_start
+    time_start = time.perf_counter()
+    imputer = MedianImputer().fit(X)
+    seconds = time.perf_counter() - time_start
+    log.info(('SimpleImputer', exact_seconds, 'MedianImputer', seconds,
+              'Speedup', exact_seconds / seconds))
+
+    np.testing.assert_allclose(imputer.statistics_, exact.statistics_,
+                               atol=0.01)
+    np.testing.assert_allclose(imputer.statistics_, np.nanmedian(X, axis=0),
+                               atol=0.01)
+
+    X_imputed = imputer.transform(X)
+    assert not np.isnan(X_imputed).any()
+    assert np.isnan(X).any()
+    mask = np.isnan(X)
+    np.testing.assert_array_equal(X_imputed[~mask], X[~mask])
+
+    # In place on float32, the sketch is not pickled
+    X32 = X.astype(np.float32)
+    assert imputer.set_params(copy=False).transform(X32) is X32
+    assert not np.isnan(X32).any()
+    loaded = pickle.loads(pickle.dumps(imputer))
+    assert not hasattr(loaded, 'sketch_')
+    np.testing.assert_array_equal(loaded.statistics_, imputer.statistics_)
+
+
+def test_median_imputer_partial_fit():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_impute.py::test_median_imputer_partial_fit
+    """
+    X = _q6_like(30000)
+    X[:, 5] = np.nan
+    imputer = MedianImputer()
+    for chunk in np.array_split(X, 7):
+        imputer.partial_fit(chunk)
+    # Medians are taken once, on first use
+    assert imputer._statistics is None
+    np.testing.assert_allclose(np.delete(imputer.statistics_, 5),
+                               np.nanmedian(np.delete(X, 5, axis=1), axis=0),
+                               atol=0.02)
+    # Columns without a value are kept and filled with 0
+    assert imputer.statistics_[5] == 0
+    assert imputer.transform(X).shape == X.shape
+
+
+def test_median_imputer_statistics(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_impute.py::test_median_imputer_statistics
+    """
+    path = str(tmp_path / 'imputer_stats.json')
+    columns = [str(i) for i in range(151)]
+    X = _q6_like(5000)
+    imputer = MedianImputer().fit(X)
+    imputer.save_statistics(path, columns, source='data.parquet:1')
+
+    loaded = MedianImputer.load_statistics(path, columns[::2],
+                                           source='data.parquet:1')
+    np.testing.assert_array_equal(loaded.statistics_,
+                                  imputer.statistics_[::2])
+    np.testing.assert_array_equal(loaded.transform(X[:, ::2]),
+                                  imputer.transform(X)[:, ::2])
+    assert MedianImputer.load_statistics(path, columns,
+                                         source='data.parquet:2') is None
+    assert MedianImputer.load_statistics(path, columns + ['extra'],
+                                         source='data.parquet:1') is None
+    assert MedianImputer.load_statistics(
+        str(tmp_path / 'missing.json'), columns) is None
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import asyncio
 import pytest
 import logging
+import sqlalchemy as sa
+from p2 import artifact
+from p2 import db
 from p2 import data_eng as de
 from p2 import model_build as mb
 from p2 import inference as inf
@@ -25,6 +29,8 @@ def run_before_and_after_tests():
     util.delete_file(C.DATA_FILE_PATH)
     util.delete_file(C.DF_Y_TMP_PATH)
     util.delete_file(C.DF_X_TMP_PATH)
+    util.delete_file(C.DF_IMPUTER_TMP_PATH)
+    util.delete_file(C.DF_COLUMNS_TMP_PATH)
     util.delete_file(C.MD_FILE_PATH)
 
 
@@ -34,5 +40,89 @@ def test_inference():
     python -m pytest -s tests/test_inference.py::test_inference \
     --log-cli-level=DEBUG
     """
-    inf.batch_inference(is_test=True)
+    result, y, _ = inf.batch_inference(is_test=True)
+    assert result['status'] is True
+    assert result['peak_rss_mb'] > 0
 
+
+def test_inference_stream():
+    """
+    # Unit Test Command:
+    python -m pytest -s tests/test_inference.py::test_inference_stream \
+    --log-cli-level=DEBUG
+    """
+    result, y, _ = inf.batch_inference(is_test=True, chunk_size=1000)
+    assert result['status'] is True
+    assert result['chunk_count'] > 1
+    assert result['data_input_shape'][0] == y.shape[0]
+    assert result['rows_per_sec'] is not None
+    assert result['peak_rss_mb'] > 0
+
+
+def test_inference_incremental():
+    """
+    # Unit Test Command:
+    python -m pytest -s tests/test_inference.py::test_inference_incremental \
+    --log-cli-level=DEBUG
+    """
+    columns = [c['name'] for c in sa.inspect(db.get_engine())
+               .get_columns(C.DB_SOURCE_TABLE)]
+    if C.DB_KEY_COLUMN not in columns:
+        pytest.skip('No key column in the source table')
+    result, y, _ = inf.batch_inference(is_test=True, incremental=True)
+    assert result['status'] is True
+    assert result['data_input_shape'][0] == y.shape[0]
+    assert 'watermark' in result
+
+
+def test_inference_async():
+    """
+    # Unit Test Command:
+    python -m pytest -s tests/test_inference.py::test_inference_async \
+    --log-cli-level=DEBUG
+    """
+    _, y_expected, _ = inf.batch_inference(is_test=True)
+    result, y = asyncio.run(inf.batch_inference_async(is_test=True,
+                                                      chunk_size=1000))
+    assert result['status'] is True
+    assert result['chunk_count'] > 1
+    assert (y == y_expected).all()
+    assert set(result['stage_seconds']) == {'read', 'score', 'write'}
+
+
+def test_compare_models(tmp_path):
+    """
+    # Unit Test Command:
+    python -m pytest -s tests/test_inference.py::test_compare_models \
+    --log-cli-level=DEBUG
+    """
+    champion = artifact.load_model(C.MD_FILE_PATH)
+    challenger_path = str(tmp_path / 'challenger.sav')
+    artifact.save_model(champion['model'], challenger_path, compact=True,
+                        model_version='challenger',
+                        feature_columns=champion['feature_columns'])
+    _, y_expected, _ = inf.batch_inference(is_test=True)
+
+    result, y, df = inf.compare_models([C.MD_FILE_PATH, challenger_path],
+                                       is_test=True)
+    assert result['status'] is True
+    # Same imputer and scaler, the input is transformed once
+    assert result['preprocessing_count'] == 1
+    assert (y[:, 0] == y_expected).all()
+    assert (y[:, 1] == y_expected).all()
+    assert list(df.columns) == [
+        'target_' + champion['model_version'],
+        'probability_' + champion['model_version'],
+        'target_challenger', 'probability_challenger']
+    challenger = result['models'][1]
+    assert challenger['agreement'] == 1.0
+    assert challenger['accuracy_delta'] == 0.0
+    # Stage peak covers the peak of every model
+    assert all(0 < model['peak_rss_mb'] <= result['peak_rss_mb']
+               for model in result['models'])
+
+    result, y_stream, df = inf.compare_models(
+        [C.MD_FILE_PATH, challenger_path], is_test=True, chunk_size=1000)
+    assert result['chunk_count'] > 1
+    assert df is None
+    assert (y_stream == y).all()
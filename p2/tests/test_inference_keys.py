@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+from p2 import db
+from p2 import data_eng as de
+from p2 import model_build as mb
+from p2 import inference as inf
+from p2 import const as C
+
+"""
+Result keys and incremental inference.
+Runs against a local SQLite stand-in, no MySQL required.
+python -m pytest -s --log-cli-level=DEBUG tests/test_inference_keys.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture()
+def source(tmp_path, monkeypatch):
+    """
+    600 row source table with an `id` key column, of which the first 500
+    rows are in DB, and a model built from them.
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(600, 20)),
+                      columns=[str(i) for i in range(20)])
+    df.insert(0, 'id', np.arange(600))
+    df['target'] = rng.integers(0, 5, 600)
+    db_url = 'sqlite:///{}'.format(tmp_path / 'micron.db')
+    df.iloc[:500].to_sql('q6_data', db.get_engine(db_url), index=False)
+    monkeypatch.setattr(C, 'DB_URL', db_url)
+    monkeypatch.setattr(C, 'DATA_PROFILE', False)
+    paths = {name: str(tmp_path / name) for name in (
+        'data.parquet', 'X.npy', 'y.npy', 'imputer.pkl', 'columns.json',
+        'model.sav')}
+
+    de.fetch_data_from_mssql(paths['data.parquet'])
+    feature_columns, _ = de.data_file_columns(paths['data.parquet'])
+    assert feature_columns == [str(i) for i in range(20)]
+    de.process_data(paths['data.parquet'], paths['X.npy'], paths['y.npy'],
+                    paths['imputer.pkl'], paths['columns.json'])
+    mb.build_model(paths['X.npy'], paths['y.npy'], paths['model.sav'],
+                   enable_tunning=False, imputer_file=paths['imputer.pkl'],
+                   columns_file=paths['columns.json'])
+    yield df, db.get_engine(db_url), paths['model.sav']
+    db.dispose_engines()
+
+
+def _result_keys(engine):
+    with engine.connect() as db_connection:
+        return sorted(pd.read_sql(f'select * from {C.DB_RESULT_TABLE}',
+                                  db_connection)[C.DB_KEY_COLUMN])
+
+
+def test_inference_incremental_key_column(source):
+    """
+    Fetch, build and incremental inference on a table with a key column.
+    The key is never a feature.
+
+    # Unit Test Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_inference_keys.py::test_inference_incremental_key_column
+    """
+    df, engine, model_path = source
+    result, y, _ = inf.batch_inference(model_path, incremental=True)
+    assert result['status'] is True
+    assert result['watermark'] == (None, 499)
+    assert y.shape[0] == 500
+
+    # Only the new rows are scored and upserted
+    df.iloc[500:].to_sql('q6_data', engine, index=False, if_exists='append')
+    result, y, _ = inf.batch_inference(model_path, incremental=True)
+    assert result['watermark'] == (499, 599)
+    assert y.shape[0] == 100
+    assert _result_keys(engine) == list(range(600))
+
+
+def test_inference_full_then_incremental(source):
+    """
+    Full and streaming runs key the result table like incremental runs,
+    so an incremental run can upsert into it.
+
+    # Unit Test Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_inference_keys.py::test_inference_full_then_incremental
+    """
+    df, engine, model_path = source
+    result, _, _ = inf.batch_inference(model_path, incremental=True)
+    assert result['watermark'] == (None, 499)
+
+    # Rescore every row, result keys are the source keys
+    df.iloc[500:].to_sql('q6_data', engine, index=False, if_exists='append')
+    result, _, df_result = inf.batch_inference(model_path)
+    assert result['status'] is True
+    assert result['peak_rss_mb'] > 0
+    assert list(df_result.index) == list(range(600))
+    result, _, _ = inf.batch_inference(model_path, chunk_size=250)
+    assert result['chunk_count'] == 3
+    assert _result_keys(engine) == list(range(600))
+
+    df_new = df.iloc[500:].copy()
+    df_new['id'] += 100
+    df_new.to_sql('q6_data', engine, index=False, if_exists='append')
+    result, y, _ = inf.batch_inference(model_path, incremental=True)
+    assert result['watermark'] == (499, 699)
+    assert y.shape[0] == 200
+    assert _result_keys(engine) == list(range(700))
+
+
+def test_inference_incremental_no_key_column(source, monkeypatch):
+    """
+    # Unit Test Command:
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_inference_keys.py::test_inference_incremental_no_key_column
+    """
+    _, _, model_path = source
+    monkeypatch.setattr(C, 'DB_KEY_COLUMN', 'no_such_key')
+    monkeypatch.setattr(C, 'DB_WATERMARK_COLUMN', 'no_such_key')
+    with pytest.raises(ValueError, match='no_such_key'):
+        inf.batch_inference(model_path, is_test=True, incremental=True)
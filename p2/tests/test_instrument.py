@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import time
+import numpy as np
+import pytest
+from p2 import const as C
+from p2 import instrument
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_instrument.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def metrics_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'metrics.jsonl')
+    monkeypatch.setattr(C, 'METRICS_PATH', path)
+    yield path
+    instrument.configure()
+
+
+def _records(path):
+    with open(path) as f:
+        return [json.loads(line)['metrics'] for line in f]
+
+
+def test_span(metrics_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_instrument.py::test_span
+    """
+    with instrument.span('stage', rows=1000) as outer:
+        with instrument.span('stage.step') as inner:
+            time.sleep(0.01)
+            inner.add(rows=500, bytes_written=10)
+            inner.add(bytes_written=5)
+
+    records = _records(metrics_path)
+    assert [r['name'] for r in records] == ['stage.step', 'stage']
+    assert records[0]['parent'] == 'stage'
+    assert records[0]['bytes_written'] == 15
+    assert records[0]['seconds'] >= 0.01
+    assert records[0]['rows_per_sec'] <= 500 / 0.01
+    assert records[1]['parent'] is None
+    assert records[1]['seconds'] >= records[0]['seconds']
+    assert outer.record == records[1]
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'),
+                    reason='Peak RSS reset is Linux only')
+def test_span_peak(metrics_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_instrument.py::test_span_peak
+    """
+    instrument.configure(trace_memory=True)
+    with instrument.span('stage') as outer:
+        with instrument.span('stage.allocate') as inner:
+            X = np.ones((2000, 10000))
+            del X
+        # Resets the process peak, the peak of `stage` is kept
+        with instrument.span('stage.small'):
+            pass
+
+    assert inner.record['peak_rss_delta_mb'] >= 100
+    assert inner.record['traced_peak_delta_mb'] >= 100
+    assert outer.record['peak_rss_mb'] >= inner.record['peak_rss_mb']
+    assert outer.record['traced_peak_delta_mb'] >= 100
+
+
+def test_timed_profile(metrics_path, tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_instrument.py::test_timed_profile
+    """
+    profile_dir = str(tmp_path / 'profile')
+    instrument.configure(profiler='cprofile', profile_dir=profile_dir)
+
+    @instrument.timed()
+    def stage():
+        with instrument.span('stage.step'):
+            return sum(range(1000))
+
+    assert stage() == sum(range(1000))
+    records = _records(metrics_path)
+    # Only the outermost span is profiled
+    assert 'profile_path' not in records[0]
+    assert os.path.exists(records[1]['profile_path'])
+    assert records[1]['name'].endswith('stage')
+
+    with pytest.raises(ValueError):
+        instrument.configure(profiler='perf')
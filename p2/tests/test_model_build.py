@@ -7,6 +7,7 @@ from p2 import util
 from p2 import const as C
 from p2 import model_build as mb
 from p2 import data_eng as de
+from p2 import artifact
 
 """
 python -m pytest -s --log-cli-level=DEBUG tests/test_model_build.py
@@ -23,6 +24,8 @@ def run_before_and_after_tests():
     util.delete_file(C.DATA_FILE_PATH)
     util.delete_file(C.DF_Y_TMP_PATH)
     util.delete_file(C.DF_X_TMP_PATH)
+    util.delete_file(C.DF_IMPUTER_TMP_PATH)
+    util.delete_file(C.DF_COLUMNS_TMP_PATH)
     util.delete_file(C.MD_FILE_PATH)
     pass
 
@@ -42,7 +45,8 @@ def test_build_model_tunning():
     python -m pytest -s --log-cli-level=DEBUG \
         tests/test_model_build.py::test_build_model_tunning
     """
-    mb.build_model(enable_tunning=True)
+    result, _ = mb.build_model(enable_tunning=True)
+    assert result['tunning_search']['candidates_evaluated'] > 0
 
 
 def test_build_model_with_df_override():
@@ -67,3 +71,40 @@ def test_build_model_with_df_override():
     assert result['confusion_matrix'] is not None
     assert result['score'] is not None
 
+
+def test_build_model_artifact():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_model_build.py::test_build_model_artifact
+    """
+    result, model = mb.build_model(enable_tunning=False)
+    model_artifact = artifact.load_model(result['model_save_path'])
+
+    # Imputer and Scaler are saved together with the classifier
+    assert list(model_artifact['model'].named_steps) == \
+        ['imputer', 'scaler', 'classifier']
+    assert model_artifact['model_version'] == result['model_version']
+
+
+def test_build_model_feature_selection():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_model_build.py::test_build_model_feature_selection
+    """
+    result, model = mb.build_model(enable_tunning=False,
+                                   enable_feature_selection=True)
+    model_artifact = artifact.load_model(result['model_save_path'])
+    feature_columns = model_artifact['feature_columns']
+
+    # Every pipeline step expects only the selected columns
+    assert len(feature_columns) == result['feature_count']
+    assert model.named_steps['imputer'].statistics_.shape[0] == \
+        len(feature_columns)
+    assert model.named_steps['classifier'].n_features_in_ == \
+        len(feature_columns)
+    assert result['feature_selection']['feature_count_before'] >= \
+        len(feature_columns)
+    assert result['feature_selection']['score'] == result['score']
+    assert 0 <= result['feature_selection']['score_before'] <= 1
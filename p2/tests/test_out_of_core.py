@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+import pandas as pd
+from p2 import artifact, out_of_core
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_out_of_core.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def test_build_model_out_of_core(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_out_of_core.py::test_build_model_out_of_core
+    """
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((6000, 12))
+    y = (X[:, 0] > 0).astype(int) + (X[:, 1] > 1.5).astype(int)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    df = pd.DataFrame(X, columns=[str(i) for i in range(12)])
+    df['target'] = y
+    data_path = str(tmp_path / 'data.csv')
+    model_path = str(tmp_path / 'model.sav')
+    df.to_csv(data_path, index=False)
+
+    result, model = out_of_core.build_model_out_of_core(
+        data_path, model_path, chunk_size=1000, n_estimators=9,
+        class_sample_size=100, test_size=1000)
+    assert result['status'] is True
+    assert result['row_count'] == 6000
+    assert result['chunk_count'] == 6
+    assert result['n_estimators'] == 9
+    assert result['test_row_count'] == 1000
+    assert result['score'] > 0.8
+
+    # Medians from the sketch, running mean / variance of imputed values
+    imputer = model.named_steps['imputer']
+    np.testing.assert_allclose(imputer.statistics_,
+                               np.nanmedian(X, axis=0), atol=0.02)
+    X_imputed = imputer.transform(X)
+    np.testing.assert_allclose(model.named_steps['scaler'].mean_,
+                               X_imputed.mean(axis=0), atol=1e-4)
+
+    model_artifact = artifact.load_model(model_path)
+    assert model_artifact['feature_columns'] == list(df.columns[:-1])
+    assert (model_artifact['model'].predict(X) == y).mean() > 0.8
+
+    # More chunks than trees, only some chunks grow a tree
+    result, _ = out_of_core.build_model_out_of_core(
+        data_path, model_path, chunk_size=1000, n_estimators=4,
+        class_sample_size=100, test_size=1000)
+    assert result['n_estimators'] == 4
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from p2 import oversample
+from p2.oversample import ApproxSMOTE
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_oversample.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def _imbalanced(random_state=0):
+    rng = np.random.default_rng(random_state)
+    counts = {0: 5000, 1: 300, 2: 40, 3: 1}
+    X = np.concatenate([rng.normal(label * 3, 1, size=(count, 8))
+                        for label, count in counts.items()])
+    y = np.repeat(list(counts), list(counts.values()))
+    return X, y
+
+
+def test_approx_smote():
+    """
+    Every class is brought up to the majority count, synthetic rows lie
+    between rows of their own class.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_oversample.py::test_approx_smote
+    """
+    X, y = _imbalanced()
+    sampler = ApproxSMOTE(index_rows=100, batch_size=1000, n_jobs=2,
+                          random_state=0)
+    X_resampled, y_resampled = sampler.fit_resample(X, y)
+    log.debug(('Resampled', X_resampled.shape, np.bincount(y_resampled)))
+
+    assert oversample.synthetic_row_count(y) == sampler.n_synthetic_
+    np.testing.assert_array_equal(np.bincount(y_resampled), [5000] * 4)
+    np.testing.assert_array_equal(X_resampled[:len(X)], X)
+    for label in range(1, 4):
+        rows = X[y == label]
+        synthetic = X_resampled[len(X):][y_resampled[len(X):] == label]
+        assert (synthetic >= rows.min(axis=0)).all()
+        assert (synthetic <= rows.max(axis=0)).all()
+    # A single row class has only copies of it
+    np.testing.assert_array_equal(
+        X_resampled[y_resampled == 3], np.repeat(X[y == 3], 5000, axis=0))
+
+    # Same seed, same rows. dtype is kept
+    X_again, _ = ApproxSMOTE(index_rows=100, batch_size=1000, n_jobs=2,
+                             random_state=0).fit_resample(X, y)
+    np.testing.assert_array_equal(X_again, X_resampled)
+    X32, _ = ApproxSMOTE(random_state=0).fit_resample(
+        X.astype(np.float32), y)
+    assert X32.dtype == np.float32
+
+
+def test_fit_balanced():
+    """
+    `weights` and `lazy` generate no rows in data processing and still
+    learn the rare classes.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_oversample.py::test_fit_balanced
+    """
+    X, y = _imbalanced()
+    X_test, y_test = _imbalanced(random_state=1)
+    for method in ('weights', 'lazy'):
+        X_resampled, y_resampled = oversample.resample(X, y, method)
+        assert X_resampled is X and y_resampled is y
+        classifier = oversample.fit_balanced(
+            RandomForestClassifier(n_estimators=12, random_state=0),
+            X, y, method)
+        recall = [(classifier.predict(X_test[y_test == label]) == label)
+                  .mean() for label in range(3)]
+        log.debug((method, 'Recall', recall))
+        assert len(classifier.estimators_) == 12
+        assert not classifier.warm_start
+        assert min(recall) > 0.8
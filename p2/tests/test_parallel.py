@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import joblib
+from threadpoolctl import threadpool_info
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from p2 import parallel
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_parallel.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def test_budget_split(monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_parallel.py::test_budget_split
+    """
+    monkeypatch.setattr(parallel.C, 'CPU_BUDGET', None)
+    assert parallel.cpu_budget() == joblib.cpu_count()
+
+    monkeypatch.setattr(parallel.C, 'CPU_BUDGET', 8)
+    assert parallel.n_jobs() == 8
+    assert parallel.n_jobs(-1) == 8
+    assert parallel.n_jobs(3) == 3
+    assert parallel.n_jobs(32) == 8
+    assert parallel.split(1) == (1, 8)
+    assert parallel.split(3) == (3, 2)
+    assert parallel.split(16) == (8, 1)
+    assert parallel.split(2, budget=6) == (2, 3)
+
+    model = Pipeline([('scaler', StandardScaler()),
+                      ('classifier', RandomForestClassifier(n_jobs=-1))])
+    parallel.set_n_jobs(model, 2)
+    assert model.named_steps['classifier'].n_jobs == 2
+
+
+def test_stage_limits(monkeypatch):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_parallel.py::test_stage_limits
+    """
+    monkeypatch.setattr(parallel.C, 'CPU_BUDGET', 4)
+    monkeypatch.setattr(parallel.C, 'STAGE_THREAD_LIMITS',
+                        {'data-check': 1})
+    with parallel.stage_limits('data-check') as limit:
+        assert limit == 1
+        assert all(pool['num_threads'] == 1 for pool in threadpool_info())
+    with parallel.stage_limits('model-build') as limit:
+        assert limit == 4
+        assert all(pool['num_threads'] <= 4 for pool in threadpool_info())
@@ -20,6 +20,8 @@ def run_before_and_after_tests():
     util.delete_file(C.DATA_FILE_PATH)
     util.delete_file(C.DF_Y_TMP_PATH)
     util.delete_file(C.DF_X_TMP_PATH)
+    util.delete_file(C.DF_IMPUTER_TMP_PATH)
+    util.delete_file(C.DF_COLUMNS_TMP_PATH)
     util.delete_file(C.MD_FILE_PATH)
 
 
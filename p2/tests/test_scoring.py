@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from p2.scoring import ParallelScorer
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_scoring.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture()
+def model_and_data():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((3000, 151))
+    y = (X[:, 0] > 0).astype(int) + (X[:, 1] > 1).astype(int)
+    model = RandomForestClassifier(n_estimators=10, random_state=0)
+    model.fit(X[:1000], y[:1000])
+    return model, X
+
+
+def test_parallel_scorer_matches_predict(model_and_data):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_scoring.py::test_parallel_scorer_matches_predict
+    """
+    model, X = model_and_data
+    with ParallelScorer(model, n_workers=2, shard_size=700) as scorer:
+        y = scorer.predict(X)
+        proba = scorer.predict_proba(X)
+    np.testing.assert_array_equal(y, model.predict(X))
+    np.testing.assert_array_equal(proba, model.predict_proba(X))
+
+
+def test_parallel_scorer_single_worker(model_and_data):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_scoring.py::test_parallel_scorer_single_worker
+    """
+    model, X = model_and_data
+    with ParallelScorer(model, n_workers=1) as scorer:
+        assert scorer.executor is None
+        np.testing.assert_array_equal(scorer.predict(X), model.predict(X))
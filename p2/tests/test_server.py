@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from p2 import artifact, server
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_server.py
+"""
+
+log = logging.getLogger(__name__)
+
+INPUT_COLUMNS = [str(i) for i in range(151)]
+FEATURE_COLUMNS = INPUT_COLUMNS[::3]
+
+
+def _save_model(path, version, random_state=0):
+    rng = np.random.default_rng(random_state)
+    X = rng.standard_normal((500, len(FEATURE_COLUMNS)))
+    y = (X[:, 0] > 0).astype(int) + (X[:, 1] > 1).astype(int)
+    model = Pipeline([('imputer', SimpleImputer(strategy='median')),
+                      ('classifier', RandomForestClassifier(
+                          n_estimators=5, random_state=random_state))])
+    model.fit(X, y)
+    artifact.save_model(model, path, model_version=version,
+                        input_columns=INPUT_COLUMNS,
+                        feature_columns=FEATURE_COLUMNS)
+    return model
+
+
+@pytest.fixture()
+def prediction_server(tmp_path):
+    model_path = str(tmp_path / 'model.sav')
+    model = _save_model(model_path, 'v1')
+    srv = server.make_server(model_path, port=0, reload_interval=0)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv, model, model_path
+    srv.shutdown()
+    srv.server_close()
+
+
+def _request(srv, path, body=None, content_type='application/json'):
+    url = 'http://{}:{}{}'.format(*srv.server_address, path)
+    request = urllib.request.Request(url, data=body,
+                                     headers={'Content-Type': content_type})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_predict(prediction_server):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_server.py::test_predict
+    """
+    srv, model, _ = prediction_server
+    X = np.random.default_rng(1).standard_normal((20, 151))
+    X[0, 0] = np.nan
+    expected = model.predict(X[:, ::3]).tolist()
+
+    rows = [[None if np.isnan(v) else v for v in row] for row in X.tolist()]
+    body = _request(srv, '/predict', json.dumps({'rows': rows}).encode())
+    assert body['predictions'] == expected
+    assert body['model_version'] == 'v1'
+
+    records = [dict(zip(INPUT_COLUMNS, row)) for row in rows]
+    body = _request(srv, '/predict', json.dumps({'rows': records}).encode())
+    assert body['predictions'] == expected
+
+    body = _request(srv, '/predict', X.astype('<f8').tobytes(),
+                    'application/octet-stream')
+    assert body['predictions'] == expected
+    assert len(body['probabilities']) == 20
+    # Rows, not values, of every request
+    assert _request(srv, '/metrics')['row_count'] == 60
+
+
+def test_predict_concurrent(prediction_server):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_server.py::test_predict_concurrent
+    """
+    srv, model, _ = prediction_server
+    X = np.random.default_rng(2).standard_normal((200, 151))
+
+    def predict(row):
+        body = json.dumps({'row': row.tolist()}).encode()
+        return _request(srv, '/predict', body)['predictions'][0]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        y = list(executor.map(predict, X))
+    assert y == model.predict(X[:, ::3]).tolist()
+
+    metrics = _request(srv, '/metrics')
+    assert metrics['request_count'] == 200
+    assert metrics['error_count'] == 0
+    assert metrics['batch_count'] <= 200
+    assert metrics['latency_p99_ms'] >= metrics['latency_p50_ms'] > 0
+
+
+def test_reload(prediction_server):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_server.py::test_reload
+    """
+    srv, _, model_path = prediction_server
+    assert _request(srv, '/health')['model_version'] == 'v1'
+    model = _save_model(model_path, 'v2', random_state=1)
+    assert _request(srv, '/reload', b'')['reloaded'] is True
+
+    X = np.random.default_rng(3).standard_normal((5, 151))
+    body = _request(srv, '/predict',
+                    json.dumps({'rows': X.tolist()}).encode())
+    assert body['model_version'] == 'v2'
+    assert body['predictions'] == model.predict(X[:, ::3]).tolist()
+
+
+def test_predict_bad_row(prediction_server):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_server.py::test_predict_bad_row
+    """
+    srv, _, _ = prediction_server
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _request(srv, '/predict', json.dumps({'rows': [[1, 2]]}).encode())
+    assert e.value.code == 400
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+from p2.sketch import QuantileSketch
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_sketch.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def _rank(column, value):
+    column = np.sort(column[~np.isnan(column)])
+    return np.searchsorted(column, value) / len(column)
+
+
+def test_quantile_sketch():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_sketch.py::test_quantile_sketch
+    """
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.standard_normal(200000),
+                         rng.exponential(size=200000),
+                         np.full(200000, np.nan),
+                         rng.integers(0, 5, 200000).astype(float)])
+    X[rng.random(200000) < 0.3, 1] = np.nan
+
+    sketch = QuantileSketch(size=512)
+    for start in range(0, len(X), 10000):
+        sketch.update(X[start:start + 10000])
+    q = [0.01, 0.25, 0.5, 0.75, 0.99]
+    quantiles = sketch.quantile(q)
+    assert quantiles.shape == (5, 4)
+    for j in [0, 1]:
+        for i, value in enumerate(quantiles[:, j]):
+            assert abs(_rank(X[:, j], value) - q[i]) < 0.01
+    # Columns without a value have no quantile
+    assert np.isnan(quantiles[:, 2]).all()
+    np.testing.assert_array_equal(quantiles[:, 3], [0, 1, 2, 3, 4])
+    np.testing.assert_array_equal(sketch.count, (~np.isnan(X)).sum(axis=0))
+    assert sketch.quantile(0)[0] == np.nanmin(X[:, 0])
+    assert sketch.quantile(1)[0] == np.nanmax(X[:, 0])
+
+    # cdf is the inverse of quantile
+    points = np.column_stack([np.nanquantile(X[:, :2], q, axis=0),
+                              np.zeros((5, 2))])
+    fractions = sketch.cdf(points)
+    np.testing.assert_allclose(fractions[:, :2],
+                               np.repeat(np.array(q)[:, None], 2, axis=1),
+                               atol=0.01)
+    assert np.isnan(fractions[:, 2]).all()
+    assert sketch.cdf(np.full(4, 10.0))[0] == 1.0
+
+
+def test_quantile_sketch_merge():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_sketch.py::test_quantile_sketch_merge
+    """
+    rng = np.random.default_rng(1)
+    X = rng.standard_normal((60000, 3))
+    merged = QuantileSketch(size=512)
+    for part in np.array_split(X, 3):
+        merged.merge(QuantileSketch(size=512).update(part))
+    single = QuantileSketch(size=512).update(X)
+
+    np.testing.assert_array_equal(merged.count, single.count)
+    np.testing.assert_array_equal(merged.min, X.min(axis=0))
+    for j in range(3):
+        assert abs(_rank(X[:, j], merged.median()[j]) - 0.5) < 0.01
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+import numpy as np
+from p2 import tuning
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_tuning.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture()
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((3000, 20))
+    y = (X[:, 0] > 0).astype(int) + (X[:, 1] > 1).astype(int)
+    return X, y
+
+
+def test_successive_halving_search(data):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_tuning.py::test_successive_halving_search
+    """
+    X, y = data
+    classifier, search = tuning.successive_halving_search(
+        X, y, n_candidates=9, factor=3, min_estimators=2, max_estimators=8,
+        min_samples=200, time_budget=None)
+    rungs = search['rungs']
+    assert [r['candidates'] for r in rungs] == [9, 3, 1]
+    assert [r['n_estimators'] for r in rungs] == [2, 4, 8]
+    assert rungs[-1]['n_samples'] == int(len(y) * 0.8)
+    assert search['out_of_time'] is False
+    assert len(classifier.estimators_) == 8
+    assert classifier.warm_start is False
+    assert (classifier.predict(X) == y).mean() > 0.9
+
+
+def test_successive_halving_warm_start(data):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_tuning.py::test_successive_halving_warm_start
+    """
+    X, y = data
+    classifier, search = tuning.successive_halving_search(
+        X, y, n_candidates=3, factor=3, min_estimators=2, max_estimators=6,
+        min_samples=200, time_budget=None, refit=False)
+    # Trees of the first rung, fitted on a third of the rows, are kept
+    assert [r['n_samples'] for r in search['rungs']] == [800, 2400]
+    assert len(classifier.estimators_) == 6
+    root_samples = [t.tree_.n_node_samples[0]
+                    for t in classifier.estimators_]
+    assert max(root_samples[:2]) <= 800 < min(root_samples[2:])
+
+
+def test_successive_halving_time_budget(data):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_tuning.py::test_successive_halving_time_budget
+    """
+    X, y = data
+    classifier, search = tuning.successive_halving_search(
+        X, y, n_candidates=9, min_estimators=2, max_estimators=8,
+        min_samples=200, time_budget=0)
+    assert search['out_of_time'] is True
+    assert search['candidates_evaluated'] == 1
+    assert len(classifier.estimators_) == 8
+
+
+@pytest.mark.parametrize('backend', ['threading', 'loky'])
+def test_successive_halving_workers(data, backend, monkeypatch):
+    """
+    Candidates fitted in parallel pick the same forest as one at a time.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_tuning.py::test_successive_halving_workers
+    """
+    X, y = data
+    monkeypatch.setattr(tuning.C, 'CPU_BUDGET', 4)
+    params = dict(n_candidates=9, factor=3, min_estimators=2,
+                  max_estimators=8, min_samples=200, time_budget=None)
+    classifier, search = tuning.successive_halving_search(X, y, **params)
+    parallel_classifier, parallel_search = tuning.successive_halving_search(
+        X, y, workers=3, backend=backend, **params)
+    assert (search['workers'], search['forest_n_jobs']) == (1, 4)
+    assert (parallel_search['workers'],
+            parallel_search['forest_n_jobs']) == (3, 1)
+    assert parallel_search['rungs'] == search['rungs']
+    assert parallel_search['best_params'] == search['best_params']
+    assert parallel_classifier.n_jobs == 4
+    np.testing.assert_array_equal(parallel_classifier.predict(X),
+                                  classifier.predict(X))
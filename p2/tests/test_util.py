@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import numpy as np
+import pytest
+from p2 import util
+
+"""
+python -m pytest -s --log-cli-level=DEBUG tests/test_util.py
+"""
+
+log = logging.getLogger(__name__)
+
+
+def test_save_load_array(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_util.py::test_save_load_array
+    """
+    path = str(tmp_path / 'X.npy')
+    X = np.random.default_rng(0).standard_normal((100, 151))
+    util.save_array(path, X)
+
+    X_loaded = util.load_array(path)
+    assert isinstance(X_loaded, np.memmap)
+    np.testing.assert_array_equal(X_loaded, X)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'),
+                    reason='Peak RSS reset is Linux only')
+def test_peak_rss():
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_util.py::test_peak_rss
+    """
+    util.reset_peak_rss()
+    baseline = util.get_peak_rss_mb()
+    X = np.ones((2000, 10000))
+    del X
+    assert util.get_peak_rss_mb() >= baseline + 100
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'),
+                    reason='Peak RSS reset is Linux only')
+def test_peak_rss_nested():
+    """
+    Nested measurements restart the process peak, the peak since
+    `reset_peak_rss` still covers them.
+
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_util.py::test_peak_rss_nested
+    """
+    util.reset_peak_rss()
+    baseline = util.get_peak_rss_mb()
+    util.start_peak_rss()
+    X = np.ones((2000, 10000))
+    del X
+    assert util.stop_peak_rss() >= baseline + 100
+    util.start_peak_rss()
+    assert util.stop_peak_rss() < baseline + 100
+    assert util.get_peak_rss_mb() >= baseline + 100
+
+
+def test_store_metric(tmp_path):
+    """
+    # Unit Test
+    python -m pytest -s --log-cli-level=DEBUG \
+        tests/test_util.py::test_store_metric
+    """
+    metrics = {'func_name': 'process_data', 'status': True,
+               'X_shape': (10, 2), 'confusion_matrix': np.eye(2),
+               'score': np.float64(0.5)}
+    jsonl_path = str(tmp_path / 'metrics.jsonl')
+    util.store_metric(metrics, metrics_path=jsonl_path)
+    util.store_metric(metrics, kind='span', metrics_path=jsonl_path)
+    with open(jsonl_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['kind'] for r in records] == ['stage', 'span']
+    assert records[0]['run_id'] == util.RUN_ID
+    assert records[0]['metrics']['confusion_matrix'] == [[1, 0], [0, 1]]
+
+    db_path = str(tmp_path / 'metrics.db')
+    util.store_metric(metrics, metrics_path=db_path)
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute(
+            'select run_id, name, data from metrics').fetchall()
+    connection.close()
+    assert rows[0][:2] == (util.RUN_ID, 'process_data')
+    assert json.loads(rows[0][2])['metrics']['score'] == 0.5